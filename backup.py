@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+from database import db
+from storage import UploadTooLarge, blob_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# إصدار صيغة الأرشيف: manifest.json ثم لكل بوت bots/<n>/meta.json وملفه
+ARCHIVE_FORMAT = 1
+META_MAX_BYTES = 64 * 1024
+LANGUAGES = ('python', 'php')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _bots_page(conn, user_id, after_id, limit):
+    # صفحة من بوتات المستخدم بعد after_id؛ الاتصال يعود إلى المجمع بعد كل صفحة
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT id, bot_name, bot_language, bot_token, file_path, is_active, created_at, length(bot_code)
+            FROM bots WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s
+        ''', (user_id, after_id, limit))
+        return cur.fetchall()
+
+
+def _code_chunk(conn, bot_id, offset, size):
+    with conn.cursor() as cur:
+        cur.execute('SELECT substr(bot_code, %s, %s) FROM bots WHERE id = %s', (offset, size, bot_id))
+        return cur.fetchone()[0]
+
+
+def _export_meta(user_id, row):
+    # يعيد (اسم الملف في الأرشيف، البيانات الوصفية)
+    bot_id, name, language, token, file_path, is_active, created_at, _ = row
+    file_name = os.path.basename(file_path or name or f"bot_{bot_id}")
+    # بادئة المستخدم تُضاف من جديد عند الاستيراد
+    file_name = file_name.removeprefix(f"{user_id}_{language}_")
+    return file_name, {
+        'name': name,
+        'language': language,
+        'token': token,
+        'file': file_name,
+        'was_active': bool(is_active),
+        'created_at': created_at.isoformat() if created_at else None,
+    }
+
+
+def _free_path(user_id, language, file_name):
+    # نفس تسمية الملفات المرفوعة، مع رقم إذا كان الاسم مستخدماً حتى لا يُستبدل ملف بوت قائم
+    path = f"bots/{user_id}_{language}_{file_name}"
+    index = 1
+    while os.path.lexists(path):
+        index += 1
+        path = f"bots/{user_id}_{language}_{index}_{file_name}"
+    return path
+
+
+def _insert(conn, user_id, batch):
+    # آمن للتكرار: إذا أُعيد الاستدعاء بعد دفعة ثُبتت فعلاً لا تُضاف صفوفها مرة ثانية
+    # (مسارات الدفعة جديدة دائماً، انظر _free_path)
+    with conn.cursor() as cur:
+        execute_values(cur, '''
+            INSERT INTO bots (user_id, bot_name, bot_language, bot_token, file_path, is_active)
+            SELECT v.user_id, v.name, v.language, v.token, v.path, FALSE
+            FROM (VALUES %s) AS v (user_id, name, language, token, path)
+            WHERE NOT EXISTS (SELECT 1 FROM bots b WHERE b.user_id = v.user_id AND b.file_path = v.path)
+        ''', [(user_id, name, language, token, path) for name, language, token, path in batch],
+            page_size=len(batch))
+
+
+def _remaining(conn, user_id):
+    # ما بقي من حصة المستخدم: max_bots ناقص كل بوتاته المحفوظة (النشطة وغير النشطة)
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT u.max_bots - (SELECT count(*) FROM bots b WHERE b.user_id = u.user_id)
+            FROM users u WHERE u.user_id = %s
+        ''', (user_id,))
+        row = cur.fetchone()
+        return max(row[0] or 0, 0) if row else 0
+
+
+def _open_import(path, max_bots, max_uncompressed):
+    # يعيد الأرشيف مفتوحاً ومدخلات meta.json فيه
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ArchiveError("الملف ليس أرشيف zip صالحاً")
+    infos = archive.infolist()
+    entries = [
+        info for info in infos
+        if info.filename.startswith('bots/') and info.filename.endswith('/meta.json')
+    ]
+    if len(entries) > max_bots:
+        archive.close()
+        raise ArchiveError(f"الأرشيف يحتوي على {len(entries)} بوت، والحد {max_bots}")
+    # zipfile لا يعيد من أي عضو أكثر من file_size المعلن، فمجموعها حد لكل ما سيُفك
+    uncompressed = sum(info.file_size for info in infos)
+    if uncompressed > max_uncompressed:
+        archive.close()
+        raise ArchiveError(
+            f"حجم الأرشيف بعد فك الضغط {uncompressed // (1024 * 1024)} ميغابايت، "
+            f"والحد {max_uncompressed // (1024 * 1024)} ميغابايت"
+        )
+    return archive, entries
+
+
+def _read_batch(archive, entries, user_id):
+    # يخزن ملفات البوتات في entries ويعيد (الدفعة، عدد المتجاهلة)؛ يعمل في خيط منفصل
+    batch = []
+    skipped = 0
+    for info in entries:
+        try:
+            if info.file_size > META_MAX_BYTES:
+                raise ValueError(info.filename)
+            meta = json.loads(archive.read(info))
+            language = meta.get('language')
+            file_name = os.path.basename(meta.get('file') or '')
+            if language not in LANGUAGES or not file_name:
+                raise ValueError(info.filename)
+            code = archive.getinfo(info.filename[:-len('meta.json')] + file_name)
+            if code.file_size > blob_store.max_size:
+                raise UploadTooLarge(code.file_size)
+            link_path = _free_path(user_id, language, file_name)
+            with archive.open(code) as source:
+                blob_store.store_file(source, link_path)
+        except (KeyError, ValueError, UploadTooLarge, zipfile.BadZipFile):
+            skipped += 1
+            continue
+        name = str(meta.get('name') or file_name)[:100]
+        token = str(meta.get('token') or 'TOKEN_HERE')[:100]
+        batch.append((name, language, token, link_path))
+    return batch, skipped
+
+
+def _referenced(conn, user_id, paths):
+    with conn.cursor() as cur:
+        cur.execute('SELECT file_path FROM bots WHERE user_id = %s AND file_path = ANY(%s)', (user_id, paths))
+        return {row[0] for row in cur.fetchall()}
+
+
+def _remove_links(paths):
+    for link_path in paths:
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+
+
+class BotBackup:
+    # تصدير بوتات المستخدم إلى أرشيف zip واستيرادها منه بذاكرة ثابتة
+    def __init__(self, database=None, chunk_size=None, batch_size=None, max_bots=None,
+                 max_archive_bytes=None, max_uncompressed_bytes=None):
+        self.db = database or db
+        self.chunk_size = chunk_size or int(os.getenv('EXPORT_CHUNK_CHARS', 256 * 1024))
+        self.batch_size = batch_size or int(os.getenv('IMPORT_BATCH', 200))
+        self.max_bots = max_bots or int(os.getenv('IMPORT_MAX_BOTS', 1000))
+        # حد تنزيل الملفات في Bot API هو 20 ميغابايت
+        self.max_archive_bytes = max_archive_bytes or int(os.getenv('IMPORT_MAX_BYTES', 20 * 1024 * 1024))
+        # حد ما يُفك من الأرشيف كله: أرشيف صغير قد ينفك إلى حجم كبير جداً
+        self.max_uncompressed_bytes = max_uncompressed_bytes or int(
+            os.getenv('IMPORT_MAX_UNCOMPRESSED_BYTES', 100 * 1024 * 1024)
+        )
+        self.exports = 0
+        self.imports = 0
+        self.exported_bots = 0
+        self.imported_bots = 0
+        self.skipped_bots = 0
+
+    def _temp_path(self, prefix):
+        os.makedirs(blob_store.tmp_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix='.zip', dir=blob_store.tmp_dir)
+        os.close(fd)
+        return path
+
+    async def _export_code(self, archive, name, bot_id, code_length):
+        # الكود المحفوظ في قاعدة البيانات يُقرأ بـ substr جزءاً بعد جزء، كل جزء باستعلام مستقل
+        out = await asyncio.to_thread(archive.open, name, 'w')
+        try:
+            for offset in range(1, code_length + 1, self.chunk_size):
+                chunk = await self.db.run(_code_chunk, bot_id, offset, self.chunk_size)
+                await asyncio.to_thread(out.write, chunk.encode('utf-8'))
+        finally:
+            await asyncio.to_thread(out.close)
+
+    async def _export(self, user_id, path):
+        # قاعدة البيانات لصفحات البوتات فقط، والكتابة على القرص خارجها: لا يُحجز اتصال من
+        # المجمع طوال التصدير، ولا يُحمّل في الذاكرة أكثر من صفحة صفوف وجزء واحد من الكود
+        count = 0
+        after_id = 0
+        archive = await asyncio.to_thread(zipfile.ZipFile, path, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            while rows := await self.db.run(_bots_page, user_id, after_id, 100):
+                after_id = rows[-1][0]
+                for row in rows:
+                    count += 1
+                    entry = f"bots/{count:05d}"
+                    file_name, meta = _export_meta(user_id, row)
+                    bot_id, file_path, code_length = row[0], row[4], row[7]
+                    if code_length:
+                        await self._export_code(archive, f"{entry}/{file_name}", bot_id, code_length)
+                    elif file_path and os.path.exists(file_path):
+                        # الكود محفوظ في الملف فقط (الحالة المعتادة)؛ zipfile ينسخه على دفعات
+                        await asyncio.to_thread(archive.write, file_path, f"{entry}/{file_name}")
+                    else:
+                        meta['missing'] = True
+                    await asyncio.to_thread(
+                        archive.writestr, f"{entry}/meta.json", json.dumps(meta, ensure_ascii=False)
+                    )
+            await asyncio.to_thread(archive.writestr, 'manifest.json', json.dumps({
+                'format': ARCHIVE_FORMAT,
+                'user_id': user_id,
+                'bots': count,
+                'exported_at': datetime.now(timezone.utc).isoformat(),
+            }))
+        finally:
+            await asyncio.to_thread(archive.close)
+        return count
+
+    async def export(self, user_id):
+        # يعيد (مسار الأرشيف، عدد البوتات)؛ على المستدعي حذف الملف بعد إرساله
+        path = self._temp_path('export_')
+        try:
+            count = await self._export(user_id, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        self.exports += 1
+        self.exported_bots += count
+        return path, count
+
+    async def _import(self, user_id, path):
+        # قراءة الأرشيف وتخزين الملفات في خيط، ثم كل دفعة باستعلام واحد آمن للتكرار
+        imported = skipped = 0
+        archive, entries = await asyncio.to_thread(
+            _open_import, path, self.max_bots, self.max_uncompressed_bytes
+        )
+        try:
+            for index in range(0, len(entries), self.batch_size):
+                # الحصة تُقرأ قبل كل دفعة، فلا تُخزن ملفات بوتات لا مكان لها؛ ما زاد عنها يُتجاهل
+                remaining = await self.db.run(_remaining, user_id)
+                if not remaining:
+                    skipped += len(entries) - index
+                    break
+                chunk = entries[index:index + min(self.batch_size, remaining)]
+                skipped += min(self.batch_size, len(entries) - index) - len(chunk)
+                batch, rejected = await asyncio.to_thread(_read_batch, archive, chunk, user_id)
+                skipped += rejected
+                if not batch:
+                    continue
+                try:
+                    await self.db.run(_insert, user_id, batch)
+                except Exception:
+                    await self._discard(user_id, [link_path for *_, link_path in batch])
+                    raise
+                imported += len(batch)
+        finally:
+            await asyncio.to_thread(archive.close)
+        return imported, skipped
+
+    async def _discard(self, user_id, paths):
+        # ملفات الدفعة التي لم تُسجل في قاعدة البيانات؛ انتهاء المهلة لا يعني أن الإدخال لم يُثبت،
+        # فلا يُحذف رابط يشير إليه صف، وإذا تعذر التأكد تبقى الروابط
+        try:
+            referenced = await self.db.run(_referenced, user_id, paths)
+        except Exception as e:
+            logger.warning("تعذر التحقق من ملفات الاستيراد غير المسجلة: %s", e)
+            return
+        await asyncio.to_thread(_remove_links, [path for path in paths if path not in referenced])
+
+    async def import_document(self, user_id, document):
+        # يعيد (عدد البوتات المستوردة، عدد المتجاهلة)
+        path = self._temp_path('import_')
+        try:
+            await blob_store.save_document(document, path, self.max_archive_bytes)
+            imported, skipped = await self._import(user_id, path)
+        finally:
+            await asyncio.to_thread(os.remove, path)
+        self.imports += 1
+        self.imported_bots += imported
+        self.skipped_bots += skipped
+        return imported, skipped
+
+    def stats(self):
+        return {
+            'exports': self.exports,
+            'imports': self.imports,
+            'exported_bots': self.exported_bots,
+            'imported_bots': self.imported_bots,
+            'skipped_bots': self.skipped_bots,
+        }
+
+
+# النسخ الاحتياطي للبوتات
+backups = BotBackup()
@@ -0,0 +1,331 @@
+"""Replay simulated users through the manager bot's handlers and report throughput.
+
+Usage (needs a disposable Postgres database):
+
+    BENCH_DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_handlers.py --users 2000
+    python benchmarks/bench_handlers.py --users 2000 --save-baseline
+    python benchmarks/bench_handlers.py --users 2000 --transport webhook
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+sys.path.insert(0, ROOT)
+
+# مستخدمو الاختبار يبدؤون من هذا المعرف حتى لا يختلطوا ببيانات حقيقية
+BENCH_USER_BASE = 9_000_000_000
+FLOWS = ("run", "create", "libraries")
+# مسارات الملفات التي تكتبها المعالجات، نسبة إلى مجلد العمل المؤقت
+WORKDIR_PATHS = {
+    "BOTS_DIR": "bots",
+    "BLOB_DIR": os.path.join("bots", ".blobs"),
+    "BOT_HOME_DIR": os.path.join("bots", ".home"),
+    "SESSION_DIR": "sessions",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--mix", default="run,create,libraries",
+                        help="comma separated flows assigned to users round-robin")
+    parser.add_argument("--code-lines", type=int, default=20)
+    parser.add_argument("--transport", choices=("direct", "polling", "webhook"), default="direct")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("CONCURRENT_UPDATES", 8)))
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="simulated seconds per Bot API call")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the send limiter on (SEND_* settings) instead of disabling it")
+    parser.add_argument("--flood-limit", type=int, default=0,
+                        help="fake API answers 429 above this many calls per chat per second")
+    parser.add_argument("--spawn", action="store_true", help="really launch uploaded bots")
+    parser.add_argument("--install", action="store_true", help="really install libraries")
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail when updates/sec drops by more than this fraction of the baseline")
+    return parser.parse_args()
+
+
+@contextlib.contextmanager
+def bench_workdir():
+    # كل قياس يعمل في مجلد مؤقت يُحذف بعده: لا يمس bots/ ومخزن الملفات في المشروع.
+    # المسارات المطلقة تتقدم على أي قيم في .env، وتُضبط قبل استيراد bot
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench-") as work:
+        for key, path in WORKDIR_PATHS.items():
+            os.environ[key] = os.path.join(work, path)
+        os.chdir(work)
+        try:
+            yield work
+        finally:
+            os.chdir(previous)
+
+
+def user_dict(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}", "username": f"u{uid}"}
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _message(self, uid, **fields):
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": user_dict(uid),
+        }
+        message.update(fields)
+        return {"update_id": next(self._ids), "message": message}
+
+    def text(self, uid, text):
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._message(uid, **fields)
+
+    def document(self, uid, name):
+        return self._message(uid, document={
+            "file_id": f"f{uid}", "file_unique_id": "bench-template", "file_name": name, "file_size": 64,
+        })
+
+    def callback(self, uid, data):
+        return {
+            "update_id": next(self._ids),
+            "callback_query": {
+                "id": str(next(self._ids)),
+                "from": user_dict(uid),
+                "chat_instance": str(uid),
+                "data": data,
+                "message": {
+                    "message_id": next(self._ids),
+                    "date": int(time.time()),
+                    "chat": {"id": uid, "type": "private"},
+                    "from": {"id": 1000, "is_bot": True, "first_name": "bench"},
+                    "text": "menu",
+                },
+            },
+        }
+
+    def flow(self, name, uid, code_lines):
+        if name == "run":
+            return [
+                self.text(uid, "/start"),
+                self.callback(uid, "run_file"),
+                self.callback(uid, "run_python"),
+                self.document(uid, "bot.py"),
+                self.text(uid, f"{uid}:BENCH-TOKEN"),
+            ]
+        if name == "create":
+            return [
+                self.text(uid, "/start"),
+                self.callback(uid, "our_services"),
+                self.callback(uid, "create_file"),
+                self.callback(uid, "lang_python"),
+                *[self.text(uid, f"print({line})") for line in range(code_lines)],
+                self.text(uid, "/don"),
+            ]
+        return [
+            self.text(uid, "/start"),
+            self.callback(uid, "our_services"),
+            self.callback(uid, "install_libraries"),
+            self.text(uid, "requests\nflask\nRequests\nhttpx==0.25.2"),
+            self.text(uid, "/done"),
+        ]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def post_updates(port, path, secret, batches):
+    # اتصال دائم لكل مجموعة مستخدمين حتى يبقى ترتيب تحديثات كل مستخدم محفوظاً
+    async def send_batch(batch):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for sent_at, payload in batch:
+            body = json.dumps(payload).encode()
+            sent_at[payload["update_id"]] = time.perf_counter()
+            writer.write(
+                f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+        writer.close()
+    await asyncio.gather(*(send_batch(batch) for batch in batches))
+
+
+async def run(args):
+    os.environ["CONCURRENT_UPDATES"] = str(args.concurrency)
+    if not args.rate_limit:
+        # بدون حدود الإرسال يقيس الاختبار المعالجات وليس الانتظار المتعمد
+        os.environ["SEND_GLOBAL_RATE"] = os.environ["SEND_CHAT_RATE"] = "0"
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import bot
+    from benchmarks.fake_telegram import FakeTelegramAPI
+    from webhook import WebhookServer
+
+    os.makedirs("bots", exist_ok=True)
+    template = tempfile.NamedTemporaryFile("w", suffix=".py", delete=False)
+    template.write("print('hello from a benchmark bot')\n")
+    template.close()
+
+    api = FakeTelegramAPI(upload_path=template.name, latency=args.api_latency, flood_limit=args.flood_limit)
+    application = bot.build_application("1000:BENCH", api.request(), api.request())
+
+    if not args.spawn:
+        # تشغيل البوتات يُحاكى بالحجز في قاعدة البيانات فقط (يتم في المعالج قبل start)
+        async def fake_start(bot_id, user_id, language, file_path, token):
+            return True
+        bot.supervisor.start = fake_start
+        bot.supervisor.restore = lambda owns=None: asyncio.sleep(0)
+    if not args.install:
+        bot.installer.submit = lambda *a, **k: None
+
+    sent_at = {}
+    latencies = []
+    done = asyncio.Event()
+    factory = UpdateFactory()
+    mix = args.mix.split(",")
+    per_user = [
+        factory.flow(mix[index % len(mix)], BENCH_USER_BASE + index, args.code_lines)
+        for index in range(args.users)
+    ]
+    total = sum(len(updates) for updates in per_user)
+
+    async def mark_done(update, context):
+        latencies.append(time.perf_counter() - sent_at[update.update_id])
+        if len(latencies) == total:
+            done.set()
+
+    # مجموعة لاحقة تُنفذ بعد انتهاء معالج المجموعة 0 لنفس التحديث
+    application.add_handler(TypeHandler(Update, mark_done), group=99)
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    server = None
+    if args.transport == "polling":
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+    elif args.transport == "webhook":
+        server = WebhookServer(application, listen="127.0.0.1", port=0, secret_token="bench")
+        await server.start()
+
+    # تشذير تحديثات المستخدمين كما تصل في الواقع
+    interleaved = [
+        update for step in itertools.zip_longest(*per_user) for update in step if update is not None
+    ]
+    started = time.perf_counter()
+    if args.transport == "direct":
+        for payload in interleaved:
+            sent_at[payload["update_id"]] = time.perf_counter()
+            await application.update_queue.put(Update.de_json(payload, application.bot))
+    elif args.transport == "polling":
+        for payload in interleaved:
+            sent_at[payload["update_id"]] = time.perf_counter()
+            api.pending.put_nowait(payload)
+    else:
+        connections = 16
+        batches = [[] for _ in range(connections)]
+        for payload in interleaved:
+            uid = (payload.get("message") or payload.get("callback_query"))["from"]["id"]
+            batches[uid % connections].append((sent_at, payload))
+        await post_updates(server.port, server.url_path, "bench", batches)
+    await done.wait()
+    elapsed = time.perf_counter() - started
+
+    if server is not None:
+        await server.stop()
+    if args.transport == "polling":
+        await application.updater.stop()
+    if not args.keep_data:
+        await cleanup(bot.db)
+    await application.stop()
+    await application.post_stop(application)
+    await application.post_shutdown(application)
+    await application.shutdown()
+    os.unlink(template.name)
+
+    return {
+        "users": args.users,
+        "mix": args.mix,
+        "transport": args.transport,
+        "concurrency": args.concurrency,
+        "updates": total,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "api_calls": dict(api.calls),
+        "outbox": bot.outbox.stats(),
+        "send_limiter": application.bot.rate_limiter.stats(),
+    }
+
+
+async def cleanup(database):
+    bench = (BENCH_USER_BASE,)
+    await database.execute("DELETE FROM bots WHERE user_id >= %s", bench)
+    await database.execute("DELETE FROM libraries WHERE installed_by >= %s", bench)
+    await database.execute("DELETE FROM sessions WHERE user_id >= %s", bench)
+    await database.execute("DELETE FROM users WHERE user_id >= %s", bench)
+    # ملفات البوتات في مجلد العمل المؤقت (bench_workdir) وتُحذف معه
+
+
+def compare(result, baseline, max_regression):
+    print("\nمقارنة مع خط الأساس:")
+    for key in ("updates_per_sec", "p50_ms", "p99_ms", "peak_rss_mb"):
+        old, new = baseline.get(key), result[key]
+        if old:
+            print(f"  {key}: {old} -> {new} ({(new - old) / old:+.1%})")
+    old_rate = baseline.get("updates_per_sec")
+    return not old_rate or result["updates_per_sec"] >= old_rate * (1 - max_regression)
+
+
+def main():
+    args = parse_args()
+    if not set(args.mix.split(",")) <= set(FLOWS):
+        sys.exit(f"--mix accepts only: {', '.join(FLOWS)}")
+    if not os.getenv("BENCH_DATABASE_URL"):
+        sys.exit("BENCH_DATABASE_URL must point at a disposable Postgres database")
+    os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+
+    with bench_workdir():
+        result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = f"{args.transport}-{args.mix.replace(',', '+')}"
+    baseline_path = os.path.join(RESULTS_DIR, f"baseline-{name}.json")
+    with open(os.path.join(RESULTS_DIR, f"latest-{name}.json"), "w") as f:
+        json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nتم حفظ خط الأساس في {baseline_path}")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            if not compare(result, json.load(f), args.max_regression):
+                sys.exit("regression: updates/sec fell below the baseline threshold")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Run health-check cycles over many active bots against a local Bot API stand-in.
+
+Usage (needs a disposable Postgres database):
+
+    BENCH_DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_health.py --bots 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# نفس نطاق معرفات مستخدمي الاختبار في bench_handlers.py
+BENCH_USER_BASE = 9_000_000_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bots", type=int, default=2000)
+    parser.add_argument("--bots-per-user", type=int, default=5)
+    parser.add_argument("--dead", type=float, default=0.05, help="fraction of active bots with no process")
+    parser.add_argument("--invalid", type=float, default=0.02, help="fraction of bots with a revoked token")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="seconds per getMe on the stand-in")
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--cycles", type=int, default=4)
+    parser.add_argument("--keep-data", action="store_true")
+    return parser.parse_args()
+
+
+class StandInAPI:
+    # يجيب getMe فقط: التوكنات التي تبدأ بـ revoked مرفوضة (401)
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def handle(self, method, path, headers, body):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        token = path.split("/")[1][len("bot"):]
+        if token.startswith("revoked"):
+            return 401, b'{"ok":false,"error_code":401,"description":"Unauthorized"}', "application/json"
+        return 200, b'{"ok":true,"result":{"id":1,"is_bot":true,"first_name":"bench"}}', "application/json"
+
+
+class Running:
+    running = True
+
+
+class StubSupervisor:
+    # عمليات وهمية: الفحص يقيس الجدولة وقاعدة البيانات وليس تشغيل آلاف العمليات
+    def __init__(self):
+        self.processes = {}
+        self.started = 0
+
+    async def start(self, bot_id, user_id, language, file_path, token):
+        self.started += 1
+        self.processes[bot_id] = Running()
+        return True
+
+    async def stop(self, bot_id, release=True):
+        return self.processes.pop(bot_id, None) is not None
+
+
+async def seed(database, args, file_path):
+    users = max(1, -(-args.bots // args.bots_per_user))
+    await database.execute('''
+        INSERT INTO users (user_id, username, max_bots, active_bots)
+        SELECT u, 'bench', %s, 0 FROM generate_series(%s::bigint, %s::bigint) u
+    ''', (args.bots_per_user, BENCH_USER_BASE, BENCH_USER_BASE + users - 1))
+    dead_every = int(1 / args.dead) if args.dead else 0
+    invalid_every = int(1 / args.invalid) if args.invalid else 0
+    rows = await database.fetchall('''
+        INSERT INTO bots (user_id, bot_name, bot_language, bot_token, file_path, is_active)
+        SELECT %s + n / %s, 'bench.py', 'python',
+               CASE WHEN %s > 0 AND n %% %s = 1 THEN 'revoked' ELSE 'valid' END || n, %s, TRUE
+        FROM generate_series(0, %s - 1) n
+        RETURNING id
+    ''', (BENCH_USER_BASE, args.bots_per_user, invalid_every, invalid_every or 1, file_path, args.bots))
+    await database.execute('''
+        UPDATE users SET active_bots = c.active
+        FROM (SELECT user_id, count(*) AS active FROM bots WHERE user_id >= %s GROUP BY user_id) c
+        WHERE users.user_id = c.user_id
+    ''', (BENCH_USER_BASE,))
+    ids = [row[0] for row in rows]
+    return [bot_id for index, bot_id in enumerate(ids) if not dead_every or index % dead_every]
+
+
+async def cleanup(database):
+    bench = (BENCH_USER_BASE,)
+    await database.execute("DELETE FROM bots WHERE user_id >= %s", bench)
+    await database.execute("DELETE FROM users WHERE user_id >= %s", bench)
+
+
+async def run(args):
+    from database import Database
+    from health import HealthMonitor
+    from http_server import HTTPServer
+
+    database = Database(os.environ["BENCH_DATABASE_URL"])
+    await database.prepare()
+    await cleanup(database)
+    api = StandInAPI(args.api_latency)
+    server = HTTPServer(api.handle, "127.0.0.1", 0)
+    await server.start()
+    file_path = os.path.abspath(__file__)
+
+    supervisor = StubSupervisor()
+    for bot_id in await seed(database, args, file_path):
+        supervisor.processes[bot_id] = Running()
+
+    monitor = HealthMonitor(
+        supervisor, database,
+        batch_size=args.batch, concurrency=args.concurrency,
+        api_url=f"http://127.0.0.1:{server.port}",
+        backoff_base=0.01, backoff_max=0.01,
+    )
+    cycles = []
+    for _ in range(args.cycles):
+        before = api.calls
+        await monitor.check()
+        cycles.append({"seconds": round(monitor.last_duration, 3), "getme_calls": api.calls - before})
+        await asyncio.sleep(0.05)
+
+    # العدادات بعد الإيقاف الجماعي يجب أن تطابق البوتات النشطة فعلاً
+    drift = await database.fetchone('''
+        SELECT count(*) FROM users u
+        LEFT JOIN (SELECT user_id, count(*) AS active FROM bots WHERE is_active GROUP BY user_id) b
+        ON b.user_id = u.user_id
+        WHERE u.user_id >= %s AND u.active_bots <> coalesce(b.active, 0)
+    ''', (BENCH_USER_BASE,))
+    still_revoked = await database.fetchone(
+        "SELECT count(*) FROM bots WHERE user_id >= %s AND is_active AND bot_token LIKE 'revoked%%'",
+        (BENCH_USER_BASE,)
+    )
+    health = await database.fetchall(
+        "SELECT health, count(*) FROM bots WHERE user_id >= %s GROUP BY health ORDER BY health",
+        (BENCH_USER_BASE,)
+    )
+
+    await server.stop(1)
+    await monitor.close()
+    if not args.keep_data:
+        await cleanup(database)
+    database.close()
+    return {
+        "bots": args.bots,
+        "batch": args.batch,
+        "concurrency": args.concurrency,
+        "cycles": cycles,
+        "probes_per_sec_first_cycle": round(args.bots / cycles[0]["seconds"], 1) if cycles[0]["seconds"] else None,
+        "restarted": supervisor.started,
+        "monitor": monitor.stats(),
+        "health_column": {status or "null": count for status, count in health},
+        "counter_drift_users": drift[0],
+        "revoked_still_active": still_revoked[0],
+    }
+
+
+def main():
+    args = parse_args()
+    if not os.getenv("BENCH_DATABASE_URL"):
+        sys.exit("BENCH_DATABASE_URL must point at a disposable Postgres database")
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if result["counter_drift_users"] or result["revoked_still_active"]:
+        sys.exit("health check left active_bots counters or revoked bots inconsistent")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Hammer slot reservation concurrently and check that no user goes over max_bots.
+
+Usage (needs a disposable Postgres database):
+
+    BENCH_DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_quota.py --users 200 --attempts 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# نفس نطاق معرفات مستخدمي الاختبار في bench_handlers.py
+BENCH_USER_BASE = 9_000_000_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--max-bots", type=int, default=3)
+    parser.add_argument("--attempts", type=int, default=20,
+                        help="bots per user, all reserved at the same time")
+    parser.add_argument("--release-ratio", type=float, default=0.3,
+                        help="fraction of successful reservations released while others are still reserving")
+    parser.add_argument("--pool", type=int, default=20)
+    parser.add_argument("--keep-data", action="store_true")
+    return parser.parse_args()
+
+
+async def run(args):
+    from database import Database
+    database = Database(os.environ["BENCH_DATABASE_URL"], min_size=1, max_size=args.pool)
+    users = [BENCH_USER_BASE + index for index in range(args.users)]
+    await database.prepare()
+    await cleanup(database)
+
+    for uid in users:
+        await database.add_user(uid, f"u{uid}", f"u{uid}")
+    await database.execute(
+        "UPDATE users SET max_bots = %s, active_bots = 0 WHERE user_id >= %s",
+        (args.max_bots, BENCH_USER_BASE)
+    )
+    bots = []
+    for uid in users:
+        for attempt in range(args.attempts):
+            bot_id = await database.add_bot(uid, f"b{attempt}", "python", "T", None, f"bots/q{uid}_{attempt}.py")
+            bots.append(bot_id)
+
+    reserved = 0
+    released = 0
+
+    async def attempt(bot_id):
+        nonlocal reserved, released
+        if await database.reserve_slot(bot_id):
+            reserved += 1
+            if random.random() < args.release_ratio:
+                await database.release_slot(bot_id)
+                released += 1
+
+    random.shuffle(bots)
+    started = time.perf_counter()
+    await asyncio.gather(*(attempt(bot_id) for bot_id in bots))
+    elapsed = time.perf_counter() - started
+
+    violations = await database.fetchall('''
+        SELECT u.user_id, u.active_bots, u.max_bots, count(b.id) FROM users u
+        LEFT JOIN bots b ON b.user_id = u.user_id AND b.is_active
+        WHERE u.user_id >= %s
+        GROUP BY u.user_id, u.active_bots, u.max_bots
+        HAVING count(b.id) > u.max_bots OR count(b.id) <> u.active_bots
+    ''', (BENCH_USER_BASE,))
+
+    # انحراف متعمد في العدادات ثم تصحيحه بالمهمة الدورية
+    await database.execute("UPDATE users SET active_bots = active_bots + 2 WHERE user_id >= %s", (BENCH_USER_BASE,))
+    fixed = await database.reconcile_active_bots()
+    drift_left = await database.fetchone('''
+        SELECT count(*) FROM users u WHERE u.user_id >= %s AND u.active_bots <>
+        (SELECT count(*) FROM bots b WHERE b.user_id = u.user_id AND b.is_active)
+    ''', (BENCH_USER_BASE,))
+
+    if not args.keep_data:
+        await cleanup(database)
+    database.close()
+
+    return {
+        "reservations": len(bots),
+        "reserved": reserved,
+        "released": released,
+        "seconds": round(elapsed, 3),
+        "reservations_per_sec": round(len(bots) / elapsed, 1),
+        "violations": [list(row) for row in violations],
+        "reconciled_users": len(fixed),
+        "drift_after_reconcile": drift_left[0],
+    }
+
+
+async def cleanup(database):
+    bench = (BENCH_USER_BASE,)
+    await database.execute("DELETE FROM bots WHERE user_id >= %s", bench)
+    await database.execute("DELETE FROM users WHERE user_id >= %s", bench)
+
+
+def main():
+    args = parse_args()
+    if not os.getenv("BENCH_DATABASE_URL"):
+        sys.exit("BENCH_DATABASE_URL must point at a disposable Postgres database")
+    result = asyncio.run(run(args))
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    if result["violations"] or result["drift_after_reconcile"]:
+        sys.exit("quota violated: a user has more active bots than max_bots or a stale counter")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Measure how update throughput scales when updates are routed to shard processes.
+
+Usage (needs a disposable Postgres database):
+
+    BENCH_DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_shards.py --users 4000 --shards 1,2,4
+"""
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_handlers import BENCH_USER_BASE, FLOWS, UpdateFactory, bench_workdir, cleanup, percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--mix", default="run,create,libraries",
+                        help="comma separated flows assigned to users round-robin")
+    parser.add_argument("--code-lines", type=int, default=20)
+    parser.add_argument("--shards", default=f"1,{os.cpu_count() or 1}",
+                        help="comma separated shard counts to measure, one run each")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("CONCURRENT_UPDATES", 8)),
+                        help="concurrent updates inside each shard")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="simulated seconds per Bot API call")
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def worker():
+    # عملية معالجة حقيقية (run_shard) لكن مع واجهة تيليجرام وهمية، تكتب نتائجها في ملف عند الإيقاف
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import bot
+    from benchmarks.fake_telegram import FakeTelegramAPI
+    from sharding import SHARD_INDEX, run_shard
+
+    results = os.environ["BENCH_RESULTS"]
+    api = FakeTelegramAPI(upload_path=os.environ["BENCH_TEMPLATE"], latency=float(os.environ["BENCH_API_LATENCY"]))
+    application = bot.build_application("1000:BENCH", api.request(), api.request())
+
+    async def fake_start(bot_id, user_id, language, file_path, token):
+        return True
+    bot.supervisor.start = fake_start
+    bot.supervisor.restore = lambda owns=None: asyncio.sleep(0)
+    bot.installer.submit = lambda *a, **k: None
+
+    latencies = []
+    last_done = [0.0]
+
+    async def mark_done(update, context):
+        # وقت الإرسال يصل مع التحديث نفسه (حقل إضافي يبقى في api_kwargs)
+        last_done[0] = time.time()
+        latencies.append(last_done[0] - update.api_kwargs["bench_sent"])
+
+    application.add_handler(TypeHandler(Update, mark_done), group=99)
+    post_init, post_shutdown = application.post_init, application.post_shutdown
+
+    async def ready(app):
+        await post_init(app)
+        open(os.path.join(results, f"ready-{SHARD_INDEX}"), "w").close()
+
+    async def report(app):
+        await post_shutdown(app)
+        with open(os.path.join(results, f"shard-{SHARD_INDEX}.json"), "w") as f:
+            json.dump({
+                "processed": len(latencies),
+                "last_done": last_done[0],
+                "latencies": latencies,
+                "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "api_calls": sum(api.calls.values()),
+            }, f)
+
+    application.post_init = ready
+    application.post_shutdown = report
+    asyncio.run(run_shard(application))
+
+
+async def run(args, shards, interleaved):
+    from telegram import Update
+    from benchmarks.fake_telegram import FakeTelegramAPI
+    from sharding import build_front
+
+    with tempfile.TemporaryDirectory() as results:
+        template = os.path.join(results, "template.py")
+        with open(template, "w") as f:
+            f.write("print('hello from a benchmark bot')\n")
+        env = dict(
+            os.environ,
+            BENCH_RESULTS=results,
+            BENCH_TEMPLATE=template,
+            BENCH_API_LATENCY=str(args.api_latency),
+            CONCURRENT_UPDATES=str(args.concurrency),
+            # بدون حدود الإرسال يقيس الاختبار المعالجة وليس الانتظار المتعمد
+            SEND_GLOBAL_RATE="0",
+            SEND_CHAT_RATE="0",
+        )
+        command = [sys.executable, os.path.abspath(__file__), "--worker"]
+        front = build_front("1000:BENCH", shards, command, env, FakeTelegramAPI().request())
+        await front.initialize()
+        await front.start()
+
+        # التوقيت يبدأ بعد أن تجهز كل العمليات (الاتصال بقاعدة البيانات وpost_init)
+        deadline = time.monotonic() + 120
+        while len(glob.glob(os.path.join(results, "ready-*"))) < shards:
+            if time.monotonic() > deadline:
+                sys.exit("shard processes did not become ready")
+            await asyncio.sleep(0.05)
+
+        started = time.time()
+        for payload in interleaved:
+            payload["bench_sent"] = time.time()
+            await front.update_queue.put(Update.de_json(payload, front.bot))
+        # stop يفرغ الطابور نحو العمليات، وshutdown ينتظر انتهاءها من كل ما وصلها
+        await front.stop()
+        router = front.update_processor
+        await front.shutdown()
+
+        reports = []
+        for path in glob.glob(os.path.join(results, "shard-*.json")):
+            with open(path) as f:
+                reports.append(json.load(f))
+
+    latencies = [value for report in reports for value in report["latencies"]]
+    processed = sum(report["processed"] for report in reports)
+    elapsed = max((report["last_done"] for report in reports), default=started) - started
+    if processed != len(interleaved):
+        print(f"⚠️ {shards} shards processed {processed} of {len(interleaved)} updates", file=sys.stderr)
+    return {
+        "shards": shards,
+        "updates": processed,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(processed / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "per_shard": sorted(report["processed"] for report in reports),
+        "shard_peak_rss_mb": max((report["peak_rss_mb"] for report in reports), default=0),
+        "api_calls": sum(report["api_calls"] for report in reports),
+        "router": router.stats(),
+    }
+
+
+async def reset(keep_data=False):
+    from database import db
+    if not keep_data:
+        await cleanup(db)
+    db.close()
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        worker()
+        return
+    if not set(args.mix.split(",")) <= set(FLOWS):
+        sys.exit(f"--mix accepts only: {', '.join(FLOWS)}")
+    if not os.getenv("BENCH_DATABASE_URL"):
+        sys.exit("BENCH_DATABASE_URL must point at a disposable Postgres database")
+    os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+
+    factory = UpdateFactory()
+    mix = args.mix.split(",")
+    per_user = [
+        factory.flow(mix[index % len(mix)], BENCH_USER_BASE + index, args.code_lines)
+        for index in range(args.users)
+    ]
+    interleaved = [
+        update for step in itertools.zip_longest(*per_user) for update in step if update is not None
+    ]
+
+    runs = []
+    for shards in [int(value) for value in args.shards.split(",")]:
+        # كل تشغيل يبدأ من قاعدة بيانات نظيفة ومجلد عمل جديد حتى تتكرر التدفقات نفسها
+        asyncio.run(reset())
+        with bench_workdir():
+            os.makedirs("bots", exist_ok=True)
+            result = asyncio.run(run(args, shards, interleaved))
+        runs.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+    asyncio.run(reset(args.keep_data))
+
+    # الكفاءة 1.0 تعني تدرجاً خطياً تماماً مقارنة بأول تشغيل
+    base = runs[0]
+    print("\nالتدرج:")
+    for result in runs:
+        speedup = result["updates_per_sec"] / base["updates_per_sec"] if base["updates_per_sec"] else 0.0
+        efficiency = speedup / (result["shards"] / base["shards"])
+        result["speedup"] = round(speedup, 2)
+        result["efficiency"] = round(efficiency, 2)
+        print(f"  {result['shards']} shards: {result['updates_per_sec']} updates/s, "
+              f"x{result['speedup']}, efficiency {result['efficiency']:.0%}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, f"latest-shards-{args.mix.replace(',', '+')}.json"), "w") as f:
+        json.dump({"users": args.users, "mix": args.mix, "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
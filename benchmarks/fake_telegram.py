@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict, deque
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+class FakeTelegramAPI:
+    # واجهة Bot API محلية: تعد الاستدعاءات وتخدم getUpdates من طابور داخلي
+    def __init__(self, upload_path=None, latency=0.0, flood_limit=0):
+        self.upload_path = upload_path
+        self.latency = latency
+        # مثل تيليجرام: أكثر من flood_limit استدعاء في الثانية لمحادثة واحدة يعيد 429
+        self.flood_limit = flood_limit
+        self._chat_calls = defaultdict(deque)
+        self.calls = Counter()
+        self.pending = asyncio.Queue()
+        self._message_ids = itertools.count(1)
+        self._offset = 0
+
+    def request(self):
+        return FakeRequest(self)
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": int(params.get("message_id", 0)) or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    async def get_updates(self, params):
+        timeout = float(params.get("timeout", 0) or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.pending.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            return []
+        while not self.pending.empty() and len(updates) < 100:
+            updates.append(self.pending.get_nowait())
+        return updates
+
+    def flooded(self, params):
+        if not self.flood_limit or "chat_id" not in params:
+            return False
+        now = time.monotonic()
+        window = self._chat_calls[params["chat_id"]]
+        while window and now - window[0] >= 1:
+            window.popleft()
+        if len(window) >= self.flood_limit:
+            return True
+        window.append(now)
+        return False
+
+    async def call(self, method, params):
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return await self.get_updates(params)
+        if self.flooded(params):
+            self.calls["429"] += 1
+            raise Flooded(1)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return self._message(params)
+        if method == "getFile":
+            return {
+                "file_id": params.get("file_id"),
+                "file_unique_id": f"u{params.get('file_id')}",
+                "file_size": 64,
+                "file_path": self.upload_path,
+            }
+        return True
+
+
+class Flooded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class FakeRequest(BaseRequest):
+    def __init__(self, api):
+        self.api = api
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        try:
+            result = await self.api.call(api_method, params)
+        except Flooded as e:
+            return 429, json.dumps({
+                "ok": False, "error_code": 429, "description": "Too Many Requests",
+                "parameters": {"retry_after": e.retry_after},
+            }).encode()
+        return 200, json.dumps({"ok": True, "result": result}).encode()
@@ -1,11 +1,27 @@
 import os
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from datetime import datetime, timedelta
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, 
-    MessageHandler, filters, ContextTypes, ConversationHandler
+    MessageHandler, filters, ContextTypes
 )
 from database import db
+from supervisor import supervisor
+from installer import installer
+from code_buffer import CodeBuffer, CodeBufferFull
+from sessions import Session, sessions
+from webhook import run_webhook
+from dispatcher import PerUserUpdateProcessor
+from storage import UploadTooLarge, blob_store
+from outbox import FloodLimiter, outbox
+from validator import ValidatorUnavailable, validator
+from botlogs import loghub
+from backup import ArchiveError, backups
+from health import watchdog
+from sharding import PRIMARY, SHARD_INDEX, SHARDS, build_front, owns, run_shard
+from metrics import ENABLED as METRICS_ENABLED, METRICS_PORT, InstrumentedRequest, MetricsServer, observe, registry
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,17 +31,32 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+logger = logging.getLogger(__name__)
 
-# حالات المحادثة
-CHOOSING_LANGUAGE, WAITING_FOR_FILE, WAITING_FOR_CODE, WAITING_FOR_LIBRARIES = range(4)
+# كل كم ثانية تُعاد حسابات active_bots من bots.is_active
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", 600))
 
-# متغيرات مؤقتة لتخزين البيانات
-user_sessions = {}
+# خطأ في أداة التحقق نفسها: الملف أو الكود يبقى كما هو ويمكن المحاولة مجدداً
+VALIDATOR_UNAVAILABLE = "⚠️ تعذر التحقق من الكود حالياً بسبب خطأ في الخادم، حاول مرة أخرى بعد قليل."
+
+# حدود أعمدة bots: bot_name VARCHAR(100) وfile_path VARCHAR(200) (مع بادئة الرابط)
+BOT_NAME_MAX = 100
+LINK_NAME_MAX = 64
+
+def shorten(file_name, limit):
+    # يقص الاسم الطويل مع الإبقاء على الامتداد
+    if len(file_name) <= limit:
+        return file_name
+    stem, extension = os.path.splitext(file_name)
+    if len(extension) >= limit:
+        return file_name[:limit]
+    return stem[:limit - len(extension)] + extension
 
 def main_menu_keyboard():
     keyboard = [
         [InlineKeyboardButton("🔧 تشغيل ملف", callback_data="run_file")],
         [InlineKeyboardButton("🚀 خدماتنا", callback_data="our_services")],
+        [InlineKeyboardButton("🤖 بوتاتي", callback_data="bots")],
     ]
     return InlineKeyboardMarkup(keyboard)
 
@@ -45,9 +76,142 @@ def language_choice_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
+# مؤشرات الصفحات تُحفظ في callback_data بالشكل micros:id (الحد 64 بايت)
+EPOCH = datetime(1970, 1, 1)
+PAGE_SIZE = 10
+
+# عدد أسطر السجل المعروضة، ومدة المتابعة المباشرة بالثواني
+LOG_TAIL_LINES = int(os.getenv("LOG_TAIL_LINES", 30))
+LOG_LIVE_SECONDS = float(os.getenv("LOG_LIVE_SECONDS", 120))
+# (المحادثة، البوت) التي تُتابع سجلاتها حالياً
+live_logs = set()
+
+def encode_cursor(timestamp, row_id):
+    return f"{(timestamp - EPOCH) // timedelta(microseconds=1)}:{row_id}"
+
+def decode_cursor(data):
+    # "prefix" للصفحة الأولى، "prefix:n:cursor" للتالية و"prefix:p:cursor" للسابقة
+    parts = data.split(":")
+    if len(parts) != 4:
+        return None, False
+    micros, row_id = int(parts[2]), int(parts[3])
+    return (EPOCH + timedelta(microseconds=micros), row_id), parts[1] == "p"
+
+def page_keyboard(prefix, rows, key, has_prev, has_next, back, extra=()):
+    nav = []
+    if rows and has_prev:
+        nav.append(InlineKeyboardButton("⬅️ السابق", callback_data=f"{prefix}:p:{encode_cursor(*key(rows[0]))}"))
+    if rows and has_next:
+        nav.append(InlineKeyboardButton("التالي ➡️", callback_data=f"{prefix}:n:{encode_cursor(*key(rows[-1]))}"))
+    keyboard = list(extra)
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("↩️ رجوع", callback_data=back)])
+    return InlineKeyboardMarkup(keyboard)
+
+async def libraries_page(data="libs"):
+    cursor, backward = decode_cursor(data)
+    rows, has_prev, has_next = await db.get_libraries_page(cursor, backward, PAGE_SIZE)
+    libraries_text = "\n".join([f"• {row[1]}" for row in rows]) or "لا توجد مكتبات بعد"
+    text = (
+        "📚 **تثبيت مكتبات جديدة**\n\n"
+        "⏳ **كيفية الاستخدام:**\n"
+        "1. أرسل اسم المكتبة (مثال: python-telegram-bot)\n"
+        "2. لإرسال أكثر من مكتبة، أرسل كل مكتبة في سطر مستقل\n"
+        "3. أرسل /done عند الانتهاء\n\n"
+        f"📝 **المكتبات المثبتة حالياً:**\n{libraries_text}"
+    )
+    keyboard = page_keyboard("libs", rows, lambda row: (row[2], row[0]), has_prev, has_next, "back_to_services")
+    return text, keyboard
+
+async def bots_page(user_id, data="bots"):
+    cursor, backward = decode_cursor(data)
+    rows, has_prev, has_next = await db.get_user_bots_page(user_id, cursor, backward, PAGE_SIZE)
+    bots_text = "\n".join([
+        f"{'🟢' if row[3] else '🔴'} {row[1]} ({row[2].upper()})" for row in rows
+    ]) or "لا توجد بوتات بعد"
+    text = f"🤖 **بوتاتي**\n\n{bots_text}\n\n💾 /export لتنزيل نسخة احتياطية، /import لاستعادتها"
+    # زر السجل بجانب كل بوت
+    logs = [[InlineKeyboardButton(f"📜 سجل {row[1]}", callback_data=f"logs:{row[0]}")] for row in rows]
+    keyboard = page_keyboard("bots", rows, lambda row: (row[4], row[0]), has_prev, has_next, "main_menu", logs)
+    return text, keyboard
+
+def logs_view(bot_id, log, live=False):
+    lines = [
+        line if stream == "out" else f"⚠️ {line}"
+        for _, stream, line in log.tail(LOG_TAIL_LINES)
+    ]
+    # حد الرسالة في تيليجرام 4096 حرفاً: نبقي آخر المخرجات
+    body = "\n".join(lines)[-3500:] or "لا توجد مخرجات بعد"
+    title = "📡 متابعة مباشرة لسجل" if live else "📜 سجل"
+    keyboard = [
+        [
+            InlineKeyboardButton("🔄 تحديث", callback_data=f"logs:{bot_id}"),
+            InlineKeyboardButton("📡 متابعة مباشرة", callback_data=f"logs:{bot_id}:live"),
+        ],
+        [InlineKeyboardButton("↩️ رجوع", callback_data="bots")],
+    ]
+    return f"{title} البوت {bot_id}\n\n{body}", InlineKeyboardMarkup(keyboard)
+
+async def follow_logs(bot, chat_id, message_id, bot_id, log):
+    # يعدل رسالة السجل مع وصول مخرجات جديدة؛ التعديلات المتقاربة تُدمج في outbox
+    key = ("logs", bot_id)
+    queue = log.subscribe()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LOG_LIVE_SECONDS
+    try:
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            while not queue.empty():
+                queue.get_nowait()
+            text, keyboard = logs_view(bot_id, log, live=True)
+            outbox.status(bot, chat_id, key, text, keyboard, message_id=message_id)
+    finally:
+        log.unsubscribe(queue)
+        live_logs.discard((chat_id, bot_id))
+        text, keyboard = logs_view(bot_id, log)
+        outbox.status(bot, chat_id, key, text + "\n\n⏹ انتهت المتابعة المباشرة", keyboard, message_id=message_id)
+        outbox.finish(chat_id, key)
+
+@observe("handler")
+async def handle_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    parts = query.data.split(":")
+    bot_id = int(parts[1])
+    log = loghub.get(bot_id)
+    if log is None or log.user_id != query.from_user.id:
+        await query.answer("لا توجد سجلات لهذا البوت حالياً", show_alert=True)
+        return
+    await query.answer()
+    
+    text, keyboard = logs_view(bot_id, log)
+    await query.edit_message_text(text, reply_markup=keyboard)
+    
+    chat_id = query.message.chat_id
+    if len(parts) == 3 and (chat_id, bot_id) not in live_logs:
+        live_logs.add((chat_id, bot_id))
+        context.application.create_task(
+            follow_logs(context.bot, chat_id, query.message.message_id, bot_id, log)
+        )
+
+@observe("handler")
+async def handle_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    if query.data.startswith("libs"):
+        text, keyboard = await libraries_page(query.data)
+    else:
+        text, keyboard = await bots_page(query.from_user.id, query.data)
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+@observe("handler")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db.add_user(user.id, user.username, user.first_name)
+    await db.add_user(user.id, user.username, user.first_name)
     
     welcome_text = f"""
     👋 أهلاً بك {user.first_name}!
@@ -69,15 +233,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(welcome_text, reply_markup=main_menu_keyboard())
 
+@observe("handler")
 async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     if query.data == "run_file":
         user = query.from_user
-        user_data = db.get_user(user.id)
+        # قراءة واحدة لصف المستخدم تكفي للتحقق ولعرض الحدود
+        user_data = await db.get_user(user.id)
         
-        if not db.can_create_bot(user.id):
+        if not await db.can_create_bot(user.id):
             await query.edit_message_text(
                 "❌ لقد وصلت إلى الحد الأقصى للبوتات النشطة!\n"
                 f"لديك {user_data[4]} بوت نشط من أصل {user_data[5]} مسموح به.",
@@ -113,12 +279,14 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=main_menu_keyboard()
         )
 
+@observe("handler")
 async def handle_services_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     if query.data == "create_file":
-        user_sessions[query.from_user.id] = {"mode": "create_file"}
+        await sessions.delete(query.from_user.id)
+        await sessions.save(query.from_user.id, Session(mode="create_file"))
         await query.edit_message_text(
             "📁 **صنع ملف بوت جديد**\n\n"
             "اختر لغة البرمجة للبوت:",
@@ -126,22 +294,10 @@ async def handle_services_menu(update: Update, context: ContextTypes.DEFAULT_TYP
         )
     
     elif query.data == "install_libraries":
-        user_sessions[query.from_user.id] = {"mode": "install_libraries"}
-        libraries = db.get_libraries()
-        libraries_text = "\n".join([f"• {lib}" for lib in libraries[:10]])
-        if len(libraries) > 10:
-            libraries_text += "\n\n... وأكثر"
+        await sessions.save(query.from_user.id, Session(mode="install_libraries"))
+        text, keyboard = await libraries_page()
         
-        await query.edit_message_text(
-            "📚 **تثبيت مكتبات جديدة**\n\n"
-            "⏳ **كيفية الاستخدام:**\n"
-            "1. أرسل اسم المكتبة (مثال: python-telegram-bot)\n"
-            "2. لإرسال أكثر من مكتبة، أرسل كل مكتبة في سطر مستقل\n"
-            "3. أرسل /done عند الانتهاء\n\n"
-            f"📝 **المكتبات المثبتة حالياً:**\n{libraries_text}",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ رجوع", callback_data="back_to_services")]])
-        )
-        return WAITING_FOR_LIBRARIES
+        await query.edit_message_text(text, reply_markup=keyboard)
     
     elif query.data == "back_to_services":
         await query.edit_message_text(
@@ -149,20 +305,22 @@ async def handle_services_menu(update: Update, context: ContextTypes.DEFAULT_TYP
             reply_markup=services_menu_keyboard()
         )
 
+@observe("handler")
 async def handle_language_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
-    user_data = user_sessions.get(user_id, {})
+    session = await sessions.get(user_id) or Session()
     
     if query.data.startswith("lang_") or query.data.startswith("run_"):
         language = "python" if "python" in query.data else "php"
         extension = ".py" if language == "python" else ".php"
         
         if query.data.startswith("run_"):
-            user_data.update({"mode": "run_file", "language": language})
-            user_sessions[user_id] = user_data
+            # جلسة جديدة: ملف مرفوع سابقاً لا يُعتبر ملف هذا التشغيل
+            session = Session(mode="run_file", language=language)
+            await sessions.save(user_id, session)
             
             await query.edit_message_text(
                 f"📥 **تشغيل ملف {language.upper()}**\n\n"
@@ -173,11 +331,14 @@ async def handle_language_choice(update: Update, context: ContextTypes.DEFAULT_T
                 f"📤 أرسل الملف الآن:",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ إلغاء", callback_data="main_menu")]])
             )
-            return WAITING_FOR_FILE
         
         else:  # create file
-            user_data.update({"mode": "create_file", "language": language, "code": ""})
-            user_sessions[user_id] = user_data
+            if session.code is not None:
+                session.code.discard()
+            session.mode = "create_file"
+            session.language = language
+            session.code = CodeBuffer()
+            await sessions.save(user_id, session)
             
             await query.edit_message_text(
                 f"📝 **إنشاء ملف {language.upper()}**\n\n"
@@ -188,193 +349,456 @@ async def handle_language_choice(update: Update, context: ContextTypes.DEFAULT_T
                 f"💻 ابدأ بإرسال الكود:",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ إلغاء", callback_data="back_to_services")]])
             )
-            return WAITING_FOR_CODE
     
     elif query.data == "back_to_services":
         await query.edit_message_text(
             "🚀 **خدماتنا المتاحة:**",
             reply_markup=services_menu_keyboard()
         )
-    
-    return ConversationHandler.END
 
+@observe("handler")
 async def handle_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    user_data = user_sessions.get(user_id, {})
+    session = await sessions.get(user_id) or Session()
     
-    if user_data.get("mode") == "run_file" and update.message.document:
-        file = await update.message.document.get_file()
-        file_path = f"bots/{user_id}_{user_data['language']}_{update.message.document.file_name}"
+    if session.mode == "run_file" and update.message.document:
+        document = update.message.document
+        file_name = os.path.basename(document.file_name or "bot") or "bot"
         
-        # حفظ الملف
-        await file.download_to_drive(file_path)
+        # حفظ الملف مرة واحدة حسب محتواه، والمسار هنا رابط إليه
+        try:
+            digest = await blob_store.store_document(document)
+        except UploadTooLarge:
+            await update.message.reply_text(
+                f"❌ حجم الملف أكبر من الحد المسموح ({blob_store.max_size // 1024} كيلوبايت)."
+            )
+            return
+        # التحقق من المحتوى في المخزن قبل إنشاء أي رابط، فالملف المرفوض لا يمس مسارات البوتات؛
+        # الملف نفسه (نفس البصمة) يُتحقق منه مرة واحدة فقط
+        try:
+            valid, error = await validator.validate(blob_store.blob_path(digest), session.language, digest)
+        except ValidatorUnavailable:
+            await update.message.reply_text(VALIDATOR_UNAVAILABLE)
+            return
+        if not valid:
+            await update.message.reply_text(
+                f"❌ **الملف يحتوي على خطأ ولن يتم تشغيله**\n\n"
+                f"⚠️ {error}\n\n"
+                f"📤 أصلح الخطأ ثم أرسل الملف مرة أخرى:"
+            )
+            return
+        
+        # البصمة في اسم الرابط: إعادة رفع ملف بالاسم نفسه لا تغير ما يشغله بوت قائم
+        file_path = f"bots/{user_id}_{session.language}_{digest[:16]}_{shorten(file_name, LINK_NAME_MAX)}"
+        blob_store.link(digest, file_path)
         
-        user_data["file_path"] = file_path
-        user_sessions[user_id] = user_data
+        session.file_path = file_path
+        session.file_name = shorten(file_name, BOT_NAME_MAX)
+        await sessions.save(user_id, session)
         
         await update.message.reply_text(
             "✅ **تم استلام الملف بنجاح!**\n\n"
             "📤 الآن أرسل توكن البوت الخاص بك:",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ إلغاء", callback_data="main_menu")]])
         )
-        return CHOOSING_LANGUAGE
     
-    elif update.message.text == "/don" and user_data.get("mode") == "create_file":
+    elif update.message.text == "/don" and session.mode == "create_file":
         # حفظ الكود الذي تم تجميعه
-        code = user_data.get("code", "")
-        language = user_data.get("language", "python")
+        code = session.code or CodeBuffer()
+        language = session.language or "python"
         extension = ".py" if language == "python" else ".php"
-        file_name = f"bot_{user_id}_{len(code)}_{extension}"
+        file_name = f"bot_{user_id}_{code.size}_{extension}"
+        # ملفان بالحجم نفسه يحملان الاسم نفسه: رقم إضافي حتى لا يُستبدل ملف بوت قائم
+        index = 1
+        while os.path.lexists(f"bots/{file_name}"):
+            index += 1
+            file_name = f"bot_{user_id}_{code.size}_{index}_{extension}"
         file_path = f"bots/{file_name}"
+        lines, size = code.lines, code.size
         
-        # حفظ الكود في ملف
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(code)
+        # التحقق من الملف المؤقت قبل حفظه؛ الكود يبقى في الجلسة إذا كان فيه خطأ
+        code.to_state()
+        try:
+            valid, error = await validator.validate(code.path, language)
+        except ValidatorUnavailable:
+            await update.message.reply_text(VALIDATOR_UNAVAILABLE)
+            return
+        if not valid:
+            await update.message.reply_text(
+                f"❌ **الكود يحتوي على خطأ ولم يتم حفظه**\n\n"
+                f"⚠️ {error}\n\n"
+                f"💾 أرسل /cancel للإلغاء والبدء من جديد"
+            )
+            return
+        
+        # نقل الملف المؤقت إلى مكانه النهائي بإعادة تسمية ذرية
+        await asyncio.to_thread(code.commit, file_path)
         
-        # حفظ في قاعدة البيانات
-        db.add_bot(user_id, file_name, language, "TOKEN_HERE", code, file_path)
+        # حفظ في قاعدة البيانات (الكود موجود في الملف فقط، والملف غير مشغّل بعد)
+        await db.add_bot(user_id, file_name, language, "TOKEN_HERE", None, file_path, is_active=False)
         
+        outbox.finish(update.effective_chat.id, "code")
         await update.message.reply_text(
             f"✅ **تم حفظ الملف بنجاح!**\n\n"
             f"📁 اسم الملف: {file_name}\n"
             f"🔤 اللغة: {language.upper()}\n"
-            f"📊 حجم الكود: {len(code)} حرف\n\n"
+            f"📊 حجم الكود: {size} بايت ({lines} سطر)\n\n"
             f"🏠 العودة للقائمة الرئيسية:",
             reply_markup=main_menu_keyboard()
         )
         
-        user_sessions.pop(user_id, None)
-        return ConversationHandler.END
+        await sessions.delete(user_id)
     
     else:
         await update.message.reply_text("❌ لم أستلم ملفاً صالحاً. حاول مرة أخرى.")
-        return WAITING_FOR_FILE
 
+@observe("handler")
 async def handle_code_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    user_data = user_sessions.get(user_id, {})
+    session = await sessions.get(user_id) or Session()
     
-    if user_data.get("mode") == "create_file" and update.message.text:
+    if session.mode == "create_file" and update.message.text:
         # تجميع الكود
-        if "code" not in user_data:
-            user_data["code"] = ""
+        if session.code is None:
+            session.code = CodeBuffer()
         
-        user_data["code"] += update.message.text + "\n"
-        user_sessions[user_id] = user_data
+        code = session.code
+        try:
+            code.append(update.message.text)
+        except CodeBufferFull:
+            await update.message.reply_text(
+                f"❌ **تجاوز الكود الحد المسموح ({code.max_size // 1024} كيلوبايت)**\n\n"
+                f"💾 أرسل /don لحفظ ما تم إرساله أو /cancel للإلغاء"
+            )
+            return
+        await sessions.save(user_id, session)
         
-        await update.message.reply_text(
+        # رسالة تأكيد واحدة تُعدل أثناء لصق الكود بدل رسالة لكل سطر
+        outbox.status(
+            context.bot, update.effective_chat.id, "code",
             f"✅ **تم إضافة السطر بنجاح!**\n\n"
-            f"📊 إجمالي الأسطر: {len(user_data['code'].splitlines())}\n"
+            f"📊 إجمالي الأسطر: {code.lines}\n"
             f"💾 استمر في إرسال الكود أو أرسل /don للانتهاء"
         )
-        return WAITING_FOR_CODE
-    
-    return WAITING_FOR_CODE
 
+@observe("handler")
 async def handle_libraries_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text == "/done":
+        await sessions.delete(update.message.from_user.id)
+        outbox.finish(update.effective_chat.id, "libraries")
         await update.message.reply_text(
             "✅ **تم الانتهاء من إدخال المكتبات**\n\n"
             "🏠 العودة للقائمة الرئيسية:",
             reply_markup=main_menu_keyboard()
         )
-        return ConversationHandler.END
+        return
     
-    libraries = update.message.text.split('\n')
+    lines = update.message.text.split('\n')
     user_id = update.message.from_user.id
-    success_count = 0
     
-    for lib in libraries:
-        if lib.strip():
-            if db.add_library(lib.strip(), user_id):
-                success_count += 1
+    # إضافة كل المكتبات دفعة واحدة
+    added, duplicates = await db.add_libraries(lines, user_id)
     
-    await update.message.reply_text(
+    # رسالة واحدة بالمجاميع تُعدل مع كل دفعة؛ المجاميع في الجلسة مثل باقي حالة المحادثة
+    chat_id = update.effective_chat.id
+    session = await sessions.get(user_id) or Session(mode="install_libraries")
+    totals = session.totals = session.totals or [0, 0]
+    totals[0] += len(added)
+    totals[1] += duplicates
+    await sessions.save(user_id, session)
+    outbox.status(
+        context.bot, chat_id, "libraries",
         f"✅ **تم معالجة المكتبات**\n\n"
-        f"📚 المكتبات المضافة: {success_count}\n"
-        f"🔤 المكتبات المرفوضة (مكررة): {len(libraries) - success_count}\n\n"
+        f"📚 المكتبات المضافة: {totals[0]}\n"
+        f"🔤 المكتبات المرفوضة (مكررة): {totals[1]}\n\n"
         f"💾 استمر في إرسال المكتبات أو أرسل /done للانتهاء"
     )
-    return WAITING_FOR_LIBRARIES
+    
+    # التثبيت الفعلي يتم في الخلفية مع تحديث رسالة التقدم
+    if added:
+        async def report_progress(job):
+            if job.status in ("finished", "failed"):
+                text = f"✅ تم التثبيت: {len(job.done)}/{job.total}"
+                if job.failed:
+                    text += f"\n❌ فشل تثبيت: {', '.join(job.failed)}"
+            else:
+                text = f"⏳ جاري تثبيت المكتبات: {len(job.done) + len(job.failed)}/{job.total}"
+            outbox.status(context.bot, chat_id, ("install", job.id), text)
+            if job.status in ("finished", "failed"):
+                outbox.finish(chat_id, ("install", job.id))
+        
+        job = installer.submit(added, user_id, progress=report_progress)
+        outbox.status(context.bot, chat_id, ("install", job.id), f"⏳ جاري تثبيت المكتبات: 0/{len(added)}")
 
+@observe("handler")
 async def handle_token_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    user_data = user_sessions.get(user_id, {})
+    session = await sessions.get(user_id) or Session()
     
-    if user_data.get("mode") == "run_file" and update.message.text:
+    if session.mode == "run_file" and update.message.text:
         token = update.message.text.strip()
+        language = session.language or "python"
+        file_path = session.file_path
+        
+        # تسجيل البوت ثم تشغيله كعملية مُدارة
+        bot_name = session.file_name or shorten(os.path.basename(file_path), BOT_NAME_MAX)
+        bot_id = await db.add_bot(user_id, bot_name, language, token, None, file_path, is_active=False)
+        # حجز المكان ذرياً قبل التشغيل، فالتحقق في القائمة وحده لا يمنع رفعين متزامنين
+        reserved = bot_id is not None and await db.reserve_slot(bot_id)
+        started = reserved and await supervisor.start(bot_id, user_id, language, file_path, token)
         
-        # هنا يمكنك إضافة منطق تشغيل البوت
-        # هذا مثال مبسط
+        if started:
+            status_text = "✅ تم تشغيل البوت بنجاح!"
+        elif bot_id is not None and not reserved:
+            status_text = "❌ لقد وصلت إلى الحد الأقصى للبوتات النشطة، تم حفظ البوت دون تشغيله."
+        else:
+            status_text = "❌ فشل تشغيل البوت، حاول مرة أخرى لاحقاً."
         
         await update.message.reply_text(
             f"✅ **تم استلام التوكن بنجاح!**\n\n"
             f"🔐 التوكن: {token[:10]}...\n"
-            f"🔤 اللغة: {user_data.get('language', 'unknown')}\n"
-            f"📁 الملف: {user_data.get('file_path', 'unknown')}\n\n"
-            f"⏳ جاري تشغيل البوت...\n\n"
-            f"✅ تم تشغيل البوت بنجاح!",
+            f"🔤 اللغة: {language}\n"
+            f"📁 الملف: {file_path}\n\n"
+            f"{status_text}",
             reply_markup=main_menu_keyboard()
         )
         
-        user_sessions.pop(user_id, None)
-        return ConversationHandler.END
+        await sessions.delete(user_id)
+
+@observe("handler")
+async def export_bots(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    status = await update.message.reply_text("⏳ جاري تجهيز النسخة الاحتياطية...")
+    try:
+        path, count = await backups.export(user_id)
+    except Exception as e:
+        logger.error("فشل تصدير بوتات %s: %s", user_id, e)
+        await status.edit_text("❌ تعذر تجهيز النسخة الاحتياطية، حاول لاحقاً.")
+        return
+    try:
+        if not count:
+            await status.edit_text("لا توجد بوتات لتصديرها بعد.")
+            return
+        with open(path, "rb") as archive:
+            await update.message.reply_document(
+                archive,
+                filename=f"bots_backup_{user_id}.zip",
+                caption=f"💾 نسخة احتياطية من {count} بوت (تحتوي على التوكنات، احتفظ بها بأمان)",
+            )
+        await status.delete()
+    finally:
+        await asyncio.to_thread(os.remove, path)
+
+@observe("handler")
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await sessions.save(update.effective_user.id, Session(mode="import_archive"))
+    await update.message.reply_text(
+        "📥 **استيراد البوتات**\n\n"
+        "أرسل ملف النسخة الاحتياطية (zip) الذي حصلت عليه من /export\n"
+        "البوتات المستوردة تُحفظ متوقفة.\n\n"
+        "💾 أرسل /cancel للإلغاء"
+    )
+
+@observe("handler")
+async def handle_archive(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    status = await update.message.reply_text("⏳ جاري استيراد البوتات...")
+    try:
+        imported, skipped = await backups.import_document(user_id, update.message.document)
+    except UploadTooLarge:
+        await status.edit_text(
+            f"❌ حجم الأرشيف أكبر من الحد المسموح ({backups.max_archive_bytes // (1024 * 1024)} ميغابايت)."
+        )
+        return
+    except ArchiveError as e:
+        await status.edit_text(f"❌ {e}")
+        return
+    except Exception as e:
+        logger.error("فشل استيراد بوتات %s: %s", user_id, e)
+        await sessions.delete(user_id)
+        await status.edit_text("❌ تعذر استيراد النسخة الاحتياطية، حاول لاحقاً.")
+        return
     
-    return CHOOSING_LANGUAGE
+    await sessions.delete(user_id)
+    text = f"✅ تم استيراد {imported} بوت"
+    if skipped:
+        text += f"\n⚠️ تم تجاهل {skipped} عنصر غير صالح أو يتجاوز الحد الأقصى للبوتات"
+    await status.edit_text(text, reply_markup=main_menu_keyboard())
 
+@observe("handler")
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    user_sessions.pop(user_id, None)
+    await sessions.delete(user_id)
+    outbox.finish(update.effective_chat.id, "code")
+    outbox.finish(update.effective_chat.id, "libraries")
     
     await update.message.reply_text(
         "❌ **تم الإلغاء**\n\nالعودة للقائمة الرئيسية:",
         reply_markup=main_menu_keyboard()
     )
-    return ConversationHandler.END
 
-def main():
-    # إنشاء التطبيق
-    application = Application.builder().token("7863334400:AAHCp4jO-pd2qqGQKqxLF1GGHh4w-0zPhqQ").build()
-    
-    # معالج المحادثة لإنشاء الملفات
-    create_file_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_language_choice, pattern="^lang_")],
-        states={
-            WAITING_FOR_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_code_input)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)]
-    )
+def is_command(message):
+    # أمر فقط إذا بدأت الرسالة بكيان bot_command كما يحدده تيليجرام
+    entities = message.entities or ()
+    return bool(entities) and entities[0].type == MessageEntity.BOT_COMMAND and entities[0].offset == 0
+
+async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # مرحلة المحادثة هي session.mode في مخزن الجلسات وليست حالة ConversationHandler في الذاكرة،
+    # فتستمر المحادثة بعد إعادة التشغيل (مع SESSION_BACKEND=file أو postgres)
+    session = await sessions.get(update.effective_user.id)
+    if session is None:
+        return
+    message = update.message
+    if session.mode == "create_file" and session.language:
+        if message.text == "/don":
+            await handle_file_upload(update, context)
+        elif message.text and not is_command(message):
+            # أسطر مثل // تعليق أو /* ... */ جزء من الكود وليست أوامر
+            await handle_code_input(update, context)
+    elif session.mode == "run_file":
+        # بعد استلام الملف تبقى خطوة التوكن
+        if session.file_path:
+            await handle_token_input(update, context)
+        else:
+            await handle_file_upload(update, context)
+    elif session.mode == "install_libraries":
+        if message.text:
+            await handle_libraries_input(update, context)
+    elif session.mode == "import_archive":
+        if message.document:
+            await handle_archive(update, context)
+
+async def post_init(application: Application):
+    # تجهيز مخطط قاعدة البيانات (الترحيلات والمدير) قبل استقبال أي تحديث
+    await db.prepare()
+    
+    # نقطة المقاييس بصيغة Prometheus (عند ضبط METRICS_PORT)
+    if METRICS_PORT:
+        registry.add_collector("bot_sessions", sessions.stats)
+        registry.add_collector("bot_user_cache", db.user_cache.stats)
+        registry.add_collector("bot_supervisor", supervisor.stats)
+        registry.add_collector("bot_uploads", blob_store.stats)
+        registry.add_collector("bot_updates", application.update_processor.stats)
+        registry.add_collector("bot_outbox", outbox.stats)
+        registry.add_collector("bot_validator", validator.stats)
+        registry.add_collector("bot_logs", loghub.stats)
+        registry.add_collector("bot_backups", backups.stats)
+        registry.add_collector("bot_health", watchdog.stats)
+        if isinstance(application.bot.rate_limiter, FloodLimiter):
+            registry.add_collector("bot_send", application.bot.rate_limiter.stats)
+        # المنفذ نفسه للعملية الأمامية، وما بعده لعمليات المعالجة بالترتيب
+        port = int(METRICS_PORT) + 1 + SHARD_INDEX if SHARD_INDEX is not None else None
+        application.bot_data["metrics_server"] = MetricsServer(port)
+        await application.bot_data["metrics_server"].start()
     
-    # معالج المحادثة لتشغيل الملفات
-    run_file_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_language_choice, pattern="^run_")],
-        states={
-            WAITING_FOR_FILE: [MessageHandler(filters.Document.ALL | filters.TEXT, handle_file_upload)],
-            CHOOSING_LANGUAGE: [MessageHandler(filters.TEXT, handle_token_input)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)]
+    # تجهيز البيئة المشتركة بالمكتبات المسجلة (في الخلفية)
+    if PRIMARY:
+        libraries = await db.get_libraries()
+        if libraries:
+            installer.submit(libraries)
+    
+    # إعادة تشغيل البوتات التي كانت نشطة قبل إعادة التشغيل (بوتات مستخدمي هذه العملية فقط)
+    await supervisor.restore(owns)
+    
+    if application.job_queue is None:
+        logger.warning("JobQueue غير متاح، لن تُصحح عدادات البوتات ولن تُفحص البوتات دورياً")
+        return
+    # تصحيح دوري لعدادات active_bots من bots.is_active
+    if PRIMARY:
+        application.job_queue.run_repeating(
+            reconcile_quotas, interval=RECONCILE_INTERVAL, first=RECONCILE_INTERVAL
+        )
+    # فحص صحة البوتات التي تديرها هذه العملية
+    application.job_queue.run_repeating(
+        check_health, interval=watchdog.interval, first=watchdog.first_delay()
     )
+
+async def reconcile_quotas(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        fixed = await db.reconcile_active_bots()
+    except Exception as e:
+        logger.error("فشل تصحيح عدادات البوتات: %s", e)
+        return
+    if fixed:
+        logger.warning("تم تصحيح عداد البوتات النشطة لـ %s مستخدم", len(fixed))
+
+async def check_health(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await watchdog.check()
+    except Exception as e:
+        logger.error("فشل فحص صحة البوتات: %s", e)
+
+async def post_stop(application: Application):
+    # إرسال آخر تعديلات رسائل الحالة قبل إغلاق اتصال البوت
+    await outbox.drain()
+
+async def post_shutdown(application: Application):
+    # إيقاف البوتات المستضافة ثم إغلاق الاتصالات
+    await supervisor.stop_all()
+    await watchdog.close()
+    await blob_store.close()
+    validator.close()
+    if "metrics_server" in application.bot_data:
+        await application.bot_data["metrics_server"].stop()
+    db.close()
+
+def build_application(token=None, request=None, get_updates_request=None):
+    # تحديثات المستخدمين المختلفين بالتوازي حتى CONCURRENT_UPDATES، وتحديثات كل مستخدم بالترتيب
+    update_processor = PerUserUpdateProcessor(int(os.getenv("CONCURRENT_UPDATES", 8)))
     
-    # معالج المحادثة للمكتبات
-    libraries_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(handle_services_menu, pattern="^install_libraries$")],
-        states={
-            WAITING_FOR_LIBRARIES: [MessageHandler(filters.TEXT, handle_libraries_input)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)]
+    # إنشاء التطبيق
+    builder = (
+        Application.builder()
+        .token(token or os.getenv("BOT_TOKEN"))
+        .concurrent_updates(update_processor)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        # حدود الإرسال لكل محادثة وللبوت كله، مع إعادة المحاولة بعد 429؛
+        # الحد العام يخص البوت كله فيُقسم على عمليات المعالجة
+        .rate_limiter(FloodLimiter(global_rate=float(os.getenv("SEND_GLOBAL_RATE", 30)) / SHARDS))
     )
+    if request is not None:
+        # طبقة نقل بديلة (واجهة تيليجرام وهمية في اختبارات الأداء)
+        builder = builder.request(request).get_updates_request(get_updates_request or request)
+    elif METRICS_ENABLED:
+        # قياس استدعاءات واجهة تيليجرام، بنفس أحجام اتصالات ApplicationBuilder الافتراضية:
+        # الإرسال يحتاج اتصالات كثيرة متوازية، وget_updates اتصالاً واحداً
+        builder = builder.request(
+            InstrumentedRequest(connection_pool_size=int(os.getenv("TELEGRAM_POOL_SIZE", 256)))
+        ).get_updates_request(InstrumentedRequest(connection_pool_size=1))
+    application = builder.build()
     
     # إضافة المعالجات
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("export", export_bots))
+    application.add_handler(CommandHandler("import", import_start))
     application.add_handler(CallbackQueryHandler(handle_main_menu, pattern="^(run_file|our_services|main_menu)$"))
     application.add_handler(CallbackQueryHandler(handle_services_menu, pattern="^(create_file|install_libraries|back_to_services)$"))
-    application.add_handler(create_file_conv)
-    application.add_handler(run_file_conv)
-    application.add_handler(libraries_conv)
+    application.add_handler(CallbackQueryHandler(handle_language_choice, pattern="^(lang_|run_)"))
+    application.add_handler(CallbackQueryHandler(handle_page, pattern="^(bots|libs)(:|$)"))
+    application.add_handler(CallbackQueryHandler(handle_logs, pattern="^logs:"))
+    # الرسائل والملفات أثناء محادثة (الكود، الملف، التوكن، المكتبات، الأرشيف) حسب جلسة المستخدم
+    application.add_handler(MessageHandler(filters.TEXT | filters.Document.ALL, route_message))
     
-    # بدء البوت
+    return application
+
+def main():
+    os.makedirs("bots", exist_ok=True)
+    if SHARD_INDEX is not None:
+        # عملية معالجة تستلم تحديثات مستخدميها من العملية الأمامية
+        asyncio.run(run_shard(build_application()))
+        return
+    # SHARDS>1: هذه العملية تستقبل التحديثات فقط وتوزعها حسب المستخدم على عمليات المعالجة
+    application = build_front() if SHARDS > 1 else build_application()
+    
+    # بدء البوت (BOT_MODE=webhook لاستقبال التحديثات عبر HTTP بدلاً من الاستطلاع)
     print("🤖 البوت يعمل الآن...")
-    application.run_polling()
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
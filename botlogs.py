@@ -0,0 +1,241 @@
+import asyncio
+import codecs
+import logging
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+
+from cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class RotatingSpill:
+    # نسخة على القرص بحجم محدود: bot_1.log ثم bot_1.log.1 ... حتى عدد النسخ المسموح.
+    # write تُستدعى من حلقة الأحداث (loghub.feed)، فتضيف إلى مخزن في الذاكرة فقط،
+    # والكتابة والتدوير في خيط عبر مهمة واحدة لكل ملف
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self._size = 0
+        self._pending = bytearray()
+        self._closing = False
+        self._task = None
+        # بايتات أُهملت لأن القرص تأخر عن مخرجات البوت
+        self.dropped = 0
+
+    def write(self, data):
+        # ما ينتظر الكتابة لا يتجاوز حجم ملف واحد
+        if self._pending and len(self._pending) + len(data) > self.max_bytes:
+            self.dropped += len(data)
+            return
+        self._pending += data
+        self._closing = False
+        self._schedule()
+
+    def close(self):
+        self._closing = True
+        self._schedule()
+
+    def _schedule(self):
+        if self._task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # خارج حلقة الأحداث (مثل نهاية الإيقاف) تتم الكتابة مباشرة
+            self._drain()
+            return
+        self._task = loop.create_task(self._flush())
+
+    async def _flush(self):
+        try:
+            while self._pending or self._closing:
+                # المخزن يُفرغ في حلقة الأحداث، والخيط يكتب نسخة منه فقط
+                data = bytes(self._pending)
+                self._pending.clear()
+                if data:
+                    await asyncio.to_thread(self._write, data)
+                else:
+                    self._closing = False
+                    await asyncio.to_thread(self._close)
+        except OSError as e:
+            logger.warning("تعذرت كتابة السجل %s: %s", self.path, e)
+            self.dropped += len(self._pending)
+            self._pending.clear()
+        finally:
+            self._task = None
+
+    def _drain(self):
+        data = bytes(self._pending)
+        self._pending.clear()
+        if data:
+            self._write(data)
+        if self._closing:
+            self._closing = False
+            self._close()
+
+    def _write(self, data):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'ab')
+            self._size = self._file.tell()
+        if self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'ab')
+        self._size = 0
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RingLog:
+    # آخر الأسطر فقط، محدودة بعدد الأسطر وبالبايتات مهما كان البوت كثير الكلام
+    def __init__(self, user_id, max_lines, max_bytes, max_line, spill=None):
+        self.user_id = user_id
+        self.max_bytes = max_bytes
+        self.max_line = max_line
+        self.lines = deque(maxlen=max_lines)
+        self.size = 0
+        self.total_lines = 0
+        self.dropped = 0
+        self.spill = spill
+        # أجزاء السطر غير المكتمل لكل مجرى (بدون سطر جديد بعد)
+        self._partial = {}
+        self._subscribers = set()
+
+    def feed(self, stream, data):
+        if self.spill is not None:
+            self.spill.write(data.encode('utf-8', 'replace'))
+        text = self._partial.pop(stream, '') + data
+        parts = text.split('\n')
+        tail = parts.pop()
+        if tail:
+            # سطر طويل بلا نهاية يُقطع عند max_line حتى لا يكبر الجزء المعلق
+            if len(tail) > self.max_line:
+                parts.append(tail)
+            else:
+                self._partial[stream] = tail
+        for line in parts:
+            self._append(stream, line)
+
+    def _append(self, stream, line):
+        if len(line) > self.max_line:
+            line = line[:self.max_line] + ' …'
+        entry = (time.time(), stream, line)
+        if len(self.lines) == self.lines.maxlen:
+            self._forget(self.lines[0])
+        self.lines.append(entry)
+        self.size += len(line)
+        self.total_lines += 1
+        while self.size > self.max_bytes and self.lines:
+            self._forget(self.lines.popleft())
+        for queue in self._subscribers:
+            if queue.full():
+                continue
+            queue.put_nowait(entry)
+
+    def _forget(self, entry):
+        self.size -= len(entry[2])
+        self.dropped += 1
+
+    def tail(self, count):
+        return list(self.lines)[-count:]
+
+    def subscribe(self, size=256):
+        queue = asyncio.Queue(size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def close(self):
+        for stream, line in list(self._partial.items()):
+            self._append(stream, line)
+        self._partial.clear()
+        if self.spill is not None:
+            self.spill.close()
+
+
+class LogHub:
+    # مخزن لكل بوت يعمل، ويبقى بعد توقفه مدة محدودة لقراءة سبب التوقف
+    def __init__(self, max_lines=None, max_bytes=None, max_line=None, spill_dir=None,
+                 spill_bytes=None, spill_backups=None):
+        self.max_lines = max_lines or int(os.getenv('LOG_MAX_LINES', 500))
+        self.max_bytes = max_bytes or int(os.getenv('LOG_MAX_BYTES', 64 * 1024))
+        self.max_line = max_line or int(os.getenv('LOG_MAX_LINE', 1000))
+        self.spill_dir = spill_dir or os.getenv('LOG_SPILL_DIR')
+        self.spill_bytes = spill_bytes or int(os.getenv('LOG_SPILL_BYTES', 1024 * 1024))
+        self.spill_backups = int(os.getenv('LOG_SPILL_BACKUPS', 2) if spill_backups is None else spill_backups)
+        self._active = {}
+        self._recent = TTLCache(
+            maxsize=int(os.getenv('LOG_BUFFERS', 1000)), ttl=float(os.getenv('LOG_KEEP_SECONDS', 24 * 3600))
+        )
+
+    def open(self, bot_id, user_id):
+        log = self._active.get(bot_id) or self._recent.pop(bot_id)
+        if log is None:
+            spill = None
+            if self.spill_dir:
+                spill = RotatingSpill(
+                    os.path.join(self.spill_dir, f"bot_{bot_id}.log"), self.spill_bytes, self.spill_backups
+                )
+            log = RingLog(user_id, self.max_lines, self.max_bytes, self.max_line, spill)
+        self._active[bot_id] = log
+        return log
+
+    def release(self, bot_id):
+        # البوت توقف نهائياً: يبقى مخزنه للقراءة فقط حتى تنتهي صلاحيته
+        log = self._active.pop(bot_id, None)
+        if log is not None:
+            log.close()
+            self._recent.set(bot_id, log)
+
+    def get(self, bot_id):
+        return self._active.get(bot_id) or self._recent.get(bot_id)
+
+    def feed(self, bot_id, stream, data):
+        log = self._active.get(bot_id)
+        if log is not None:
+            log.feed(stream, data)
+
+    async def pump(self, bot_id, reader, stream, chunk_size=4096):
+        # يقرأ مخرجات العملية باستمرار حتى لا تمتلئ الأنبوبة ويتوقف البوت عن الكتابة
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        while chunk := await reader.read(chunk_size):
+            self.feed(bot_id, stream, decoder.decode(chunk))
+
+    def stats(self):
+        return {
+            'active': len(self._active),
+            'recent': len(self._recent),
+            'active_bytes': sum(log.size for log in self._active.values()),
+            'spill_dropped_bytes': sum(
+                log.spill.dropped for log in self._active.values() if log.spill is not None
+            ),
+        }
+
+
+# سجلات البوتات المستضافة
+loghub = LogHub()
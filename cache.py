@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # ذاكرة مؤقتة بمدة صلاحية وحد أقصى للعناصر (تُحذف الأقدم استخداماً أولاً)
+    def __init__(self, maxsize=1024, ttl=60, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # يُستدعى بالمفتاح والقيمة عند حذف عنصر بسبب الحد أو انتهاء الصلاحية
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires = item
+        if expires <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            if self.on_evict:
+                self.on_evict(key, value)
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            old_key, (old_value, _) = self._data.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(old_key, old_value)
+
+    def expire(self):
+        # حذف كل العناصر المنتهية (الأقدم استخداماً في البداية غالباً)
+        now = time.monotonic()
+        expired = [key for key, (_, expires) in self._data.items() if expires <= now]
+        for key in expired:
+            value, _ = self._data.pop(key)
+            self.expirations += 1
+            if self.on_evict:
+                self.on_evict(key, value)
+        return len(expired)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and item[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,92 @@
+import os
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class CodeBufferFull(Exception):
+    pass
+
+
+class CodeBuffer:
+    # يجمع الكود المرسل رسالةً رسالة مع عدّاد للأسطر والحجم بدلاً من إعادة حسابهما في كل مرة
+    def __init__(self, directory="bots", spool_size=None, max_size=None):
+        self.directory = directory
+        self.spool_size = spool_size or int(os.getenv('CODE_SPOOL_BYTES', 64 * 1024))
+        self.max_size = max_size or int(os.getenv('CODE_MAX_BYTES', 1024 * 1024))
+        self.lines = 0
+        self.size = 0
+        self.path = None
+        self._chunks = []
+        self._file = None
+
+    def append(self, text):
+        data = (text + "\n").encode("utf-8")
+        if self.size + len(data) > self.max_size:
+            raise CodeBufferFull(f"تجاوز الكود الحد الأقصى ({self.max_size} بايت)")
+        self.lines += text.count("\n") + 1
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        # بعد حد معين ننقل الكود إلى ملف مؤقت بدلاً من إبقائه في الذاكرة
+        if self.size > self.spool_size:
+            self._spill()
+
+    def _spill(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # الملف المؤقت في نفس مجلد الوجهة حتى تكون إعادة التسمية ذرية
+        fd, self.path = tempfile.mkstemp(dir=self.directory, prefix=".code-", suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+        self._file.writelines(self._chunks)
+        self._chunks = []
+
+    def to_state(self):
+        # حالة مختصرة قابلة للحفظ: الكود نفسه يبقى في الملف المؤقت
+        if self._file is None:
+            self._spill()
+        self._file.flush()
+        return {"p": self.path, "l": self.lines, "s": self.size}
+
+    @classmethod
+    def from_state(cls, state, directory="bots"):
+        buffer = cls(directory)
+        path = state.get("p")
+        if path and os.path.exists(path):
+            buffer.path = path
+            buffer.lines = state.get("l", 0)
+            buffer.size = state.get("s", 0)
+            buffer._file = open(path, "ab")
+        return buffer
+
+    def commit(self, file_path):
+        if self._file is None:
+            self._spill()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self.path, file_path)
+        self.path = None
+
+    def close(self):
+        # إغلاق الملف مع إبقائه على القرص (الجلسة محفوظة ويمكن استئنافها)
+        if self._file is None and self._chunks:
+            self._spill()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
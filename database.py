@@ -1,174 +1,482 @@
-import psycopg2
+import asyncio
 import os
+import re
+import threading
+import psycopg2
+from psycopg2 import errors, pool
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
+from cache import TTLCache
+from metrics import ERRORS, observe
+from migrations import LATEST_VERSION, migrate
+
 load_dotenv()
 
+# حجز مكان وتفعيل البوت معاً، فقط إذا بقي للمستخدم مكان (active_bots < max_bots)
+RESERVE_SQL = '''
+    WITH target AS (
+        SELECT user_id FROM bots
+        WHERE id = %s AND is_active IS NOT TRUE
+        FOR UPDATE
+    ), reserved AS (
+        UPDATE users SET active_bots = active_bots + 1
+        WHERE user_id IN (SELECT user_id FROM target) AND active_bots < max_bots
+        RETURNING user_id
+    )
+    UPDATE bots SET is_active = TRUE
+    WHERE id = %s AND user_id IN (SELECT user_id FROM reserved)
+    RETURNING user_id
+'''
+
+ADMIN_SQL = '''
+    INSERT INTO users (user_id, username, is_admin, max_bots)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (user_id) DO UPDATE SET
+    is_admin = EXCLUDED.is_admin, max_bots = EXCLUDED.max_bots
+'''
+
+# طول libraries.library_name؛ اسم أطول يُفشل الإدخال المجمع للرسالة كلها
+LIBRARY_NAME_MAX = 100
+
+def normalize_library_name(line):
+    # يحول سطراً من قائمة متطلبات إلى اسم مكتبة موحد أو None إذا لم يكن اسماً صالحاً
+    line = line.split('#', 1)[0].strip()
+    if not line or line.startswith('-'):
+        return None
+    name = re.split(r'[\s\[<>=!~;@]', line, 1)[0].lower()
+    if len(name) > LIBRARY_NAME_MAX:
+        return None
+    if '/' in name:
+        # حزم Composer بالشكل vendor/package
+        return name if re.fullmatch(r'[a-z0-9_.-]+/[a-z0-9_.-]+', name) else None
+    if not re.fullmatch(r'[a-z0-9]([a-z0-9._-]*[a-z0-9])?', name):
+        return None
+    return re.sub(r'[-_.]+', '-', name)
+
 class Database:
-    def __init__(self):
-        self.conn = None
-        self.connect()
-        self.create_tables()
-    
+    def __init__(self, dsn=None, min_size=None, max_size=None, query_timeout=None):
+        self.dsn = dsn or os.getenv('DATABASE_URL')
+        self.min_size = min_size or int(os.getenv('DB_POOL_MIN', 1))
+        self.max_size = max_size or int(os.getenv('DB_POOL_MAX', 10))
+        self.query_timeout = query_timeout or float(os.getenv('DB_QUERY_TIMEOUT', 10))
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        # لا يتجاوز عدد الاستعلامات المتزامنة حجم مجمع الاتصالات
+        self._slots = asyncio.Semaphore(self.max_size)
+        # صفوف المستخدمين المقروءة مؤخراً (تُبطل عند كل كتابة على المستخدم)
+        self.user_cache = TTLCache(
+            maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('USER_CACHE_TTL', 30))
+        )
+        # المدير يُضاف من الإعدادات بدلاً من معرف ثابت في الكود
+        admin_id = os.getenv('ADMIN_ID')
+        self.admin_id = int(admin_id) if admin_id else None
+        self.admin_max_bots = int(os.getenv('ADMIN_MAX_BOTS', 10))
+        # لا اتصال عند الاستيراد: المجمع يُفتح عند أول استعلام، والمخطط يُجهز صراحة بـ prepare()
+        self.migration_timeout = float(os.getenv('DB_MIGRATION_TIMEOUT', 600))
+
     def connect(self):
         try:
-            self.conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+            self.pool = pool.ThreadedConnectionPool(
+                self.min_size, self.max_size, self.dsn,
+                # مهلة لكل استعلام على مستوى الخادم
+                options=f'-c statement_timeout={int(self.query_timeout * 1000)}',
+                # statement_timeout لا يحد اتصالاً انقطع شبكياً؛ keepalive يكشفه خلال دقيقة تقريباً
+                keepalives=1,
+                keepalives_idle=int(os.getenv('DB_KEEPALIVE_IDLE', 30)),
+                keepalives_interval=10,
+                keepalives_count=3,
+            )
             print("✅ تم الاتصال بقاعدة البيانات بنجاح")
         except Exception as e:
             print(f"❌ خطأ في الاتصال بقاعدة البيانات: {e}")
-    
-    def create_tables(self):
-        try:
-            with self.conn.cursor() as cur:
-                # جدول المستخدمين
-                cur.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id BIGINT PRIMARY KEY,
-                        username VARCHAR(100),
-                        first_name VARCHAR(100),
-                        is_admin BOOLEAN DEFAULT FALSE,
-                        active_bots INTEGER DEFAULT 0,
-                        max_bots INTEGER DEFAULT 3,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # جدول البوتات
-                cur.execute('''
-                    CREATE TABLE IF NOT EXISTS bots (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT,
-                        bot_name VARCHAR(100),
-                        bot_language VARCHAR(10),
-                        bot_token VARCHAR(100),
-                        bot_code TEXT,
-                        file_path VARCHAR(200),
-                        is_active BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
-                ''')
-                
-                # جدول المكتبات
-                cur.execute('''
-                    CREATE TABLE IF NOT EXISTS libraries (
-                        id SERIAL PRIMARY KEY,
-                        library_name VARCHAR(100) UNIQUE,
-                        installed_by BIGINT,
-                        installed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (installed_by) REFERENCES users (user_id)
-                    )
-                ''')
-                
-                self.conn.commit()
-                print("✅ تم إنشاء الجداول بنجاح")
-                
-                # إضافة المدير
-                self.add_admin()
-                
-        except Exception as e:
-            print(f"❌ خطأ في إنشاء الجداول: {e}")
-    
-    def add_admin(self):
+
+    def _get_conn(self):
+        # إعادة إنشاء المجمع إذا فشل الاتصال الأول
+        with self._pool_lock:
+            if self.pool is None or self.pool.closed:
+                self.connect()
+            if self.pool is None:
+                raise psycopg2.OperationalError("قاعدة البيانات غير متاحة")
+        conn = self.pool.getconn()
+        if conn.closed:
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+        return conn
+
+    def _prepare(self, conn):
+        # طلب واحد: تحديث المدير وقراءة إصدار المخطط معاً
+        sql = 'SELECT coalesce(max(version), 0) FROM schema_version'
+        params = None
+        if self.admin_id is not None:
+            sql = ADMIN_SQL + '; ' + sql
+            params = (self.admin_id, 'admin', True, self.admin_max_bots)
         try:
-            with self.conn.cursor() as cur:
-                cur.execute('''
-                    INSERT INTO users (user_id, username, is_admin, max_bots) 
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (user_id) DO UPDATE SET 
-                    is_admin = EXCLUDED.is_admin, max_bots = EXCLUDED.max_bots
-                ''', (6689435577, 'admin', True, 10))
-                self.conn.commit()
-                print("✅ تم إضافة المدير بنجاح")
-        except Exception as e:
-            print(f"❌ خطأ في إضافة المدير: {e}")
-    
-    def get_user(self, user_id):
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                version = cur.fetchone()[0]
+            conn.commit()
+        except errors.UndefinedTable:
+            # قاعدة بيانات جديدة أو سابقة لجدول الإصدارات
+            conn.rollback()
+            version = 0
+        if version >= LATEST_VERSION:
+            return
+        applied = migrate(conn)
+        if applied:
+            print(f"✅ تم تحديث مخطط قاعدة البيانات إلى الإصدار {applied[-1]}")
+        if self.admin_id is not None:
+            with conn.cursor() as cur:
+                cur.execute(ADMIN_SQL, (self.admin_id, 'admin', True, self.admin_max_bots))
+            conn.commit()
+
+    async def prepare(self):
+        # عند بدء التشغيل وبمهلة خاصة: الترحيلات قد تطول ولا تُشغل داخل أول استعلام لمستخدم
+        await self.run(self._prepare, timeout=self.migration_timeout)
+
+    def _call(self, func, *args):
+        # كل استدعاء يعمل داخل معاملة واحدة على اتصال من المجمع
+        for attempt in range(2):
+            conn = self._get_conn()
+            try:
+                result = func(conn, *args)
+                conn.commit()
+            except psycopg2.extensions.QueryCanceledError:
+                conn.rollback()
+                self.pool.putconn(conn)
+                raise
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # الاتصال مقطوع: نتخلص منه ونعيد المحاولة مرة واحدة باتصال جديد
+                self.pool.putconn(conn, close=True)
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                conn.rollback()
+                self.pool.putconn(conn)
+                raise
+            self.pool.putconn(conn)
+            return result
+
+    def _done(self, task):
+        # المكان يُحرر عندما يعيد الخيط اتصاله إلى المجمع فعلاً، وليس عند انتهاء مهلة الانتظار،
+        # وإلا طلب المستدعون التالون اتصالات من مجمع ممتلئ (PoolError) بدل الانتظار
+        self._slots.release()
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, func, *args, timeout=None):
+        # timeout للعمليات الطويلة متعددة الاستعلامات؛ كل استعلام يبقى محدوداً بـ statement_timeout
+        await self._slots.acquire()
+        task = asyncio.ensure_future(asyncio.to_thread(self._call, func, *args))
+        task.add_done_callback(self._done)
         try:
-            with self.conn.cursor() as cur:
-                cur.execute('SELECT * FROM users WHERE user_id = %s', (user_id,))
+            return await asyncio.wait_for(asyncio.shield(task), timeout or self.query_timeout + 1)
+        except Exception:
+            ERRORS.inc('db', 'query')
+            raise
+
+    async def execute(self, sql, params=None):
+        def _execute(conn):
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.rowcount
+        return await self.run(_execute)
+
+    async def fetchone(self, sql, params=None):
+        def _fetchone(conn):
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
                 return cur.fetchone()
+        return await self.run(_fetchone)
+
+    async def fetchall(self, sql, params=None):
+        def _fetchall(conn):
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+        return await self.run(_fetchall)
+
+    def close(self):
+        if self.pool is not None and not self.pool.closed:
+            self.pool.closeall()
+
+    @observe("db")
+    async def get_user(self, user_id):
+        # صف المستخدم كاملاً يكفي لكل ما تحتاجه القوائم (بما فيه حدود البوتات)
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            return user
+        try:
+            user = await self.fetchone('SELECT * FROM users WHERE user_id = %s', (user_id,))
         except Exception as e:
             print(f"❌ خطأ في جلب بيانات المستخدم: {e}")
             return None
-    
-    def add_user(self, user_id, username, first_name):
+        if user is not None:
+            self.user_cache.set(user_id, user)
+        return user
+
+    @observe("db")
+    async def add_user(self, user_id, username, first_name):
+        # المستخدم الموجود في الذاكرة المؤقتة مسجل مسبقاً
+        if user_id in self.user_cache:
+            return
         try:
-            with self.conn.cursor() as cur:
-                cur.execute('''
-                    INSERT INTO users (user_id, username, first_name) 
+            # الصف يعود في الحالتين (جديد أو موجود) فيُخزن، ولا يكتب /start التالي في القاعدة
+            user = await self.fetchone('''
+                WITH inserted AS (
+                    INSERT INTO users (user_id, username, first_name)
                     VALUES (%s, %s, %s)
                     ON CONFLICT (user_id) DO NOTHING
-                ''', (user_id, username, first_name))
-                self.conn.commit()
+                    RETURNING *
+                )
+                SELECT * FROM inserted
+                UNION ALL
+                SELECT * FROM users WHERE user_id = %s AND NOT EXISTS (SELECT 1 FROM inserted)
+            ''', (user_id, username, first_name, user_id))
         except Exception as e:
             print(f"❌ خطأ في إضافة المستخدم: {e}")
-    
-    def can_create_bot(self, user_id):
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute('''
-                    SELECT active_bots, max_bots FROM users WHERE user_id = %s
-                ''', (user_id,))
-                result = cur.fetchone()
-                if result:
-                    active_bots, max_bots = result
-                    return active_bots < max_bots
-                return False
-        except Exception as e:
-            print(f"❌ خطأ في التحقق من إمكانية إنشاء بوت: {e}")
+            self.user_cache.pop(user_id)
+            return
+        if user is not None:
+            self.user_cache.set(user_id, user)
+
+    @observe("db")
+    async def can_create_bot(self, user_id):
+        user = await self.get_user(user_id)
+        if user is None:
             return False
-    
-    def add_bot(self, user_id, bot_name, language, token, code, file_path):
-        try:
-            with self.conn.cursor() as cur:
+        active_bots, max_bots = user[4], user[5]
+        return active_bots < max_bots
+
+    @observe("db")
+    async def add_bot(self, user_id, bot_name, language, token, code, file_path, is_active=False):
+        def _add_bot(conn):
+            with conn.cursor() as cur:
                 # إضافة البوت
                 cur.execute('''
                     INSERT INTO bots (user_id, bot_name, bot_language, bot_token, bot_code, file_path, is_active)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ''', (user_id, bot_name, language, token, code, file_path, True))
-                
-                # تحديث عدد البوتات النشطة
-                cur.execute('''
-                    UPDATE users SET active_bots = active_bots + 1 WHERE user_id = %s
-                ''', (user_id,))
-                
-                self.conn.commit()
-                return True
+                    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
+                ''', (user_id, bot_name, language, token, code, file_path, False))
+                bot_id = cur.fetchone()[0]
+
+                # التفعيل يمر بالحجز الشرطي نفسه، فلا يتجاوز المستخدم حده
+                if is_active:
+                    cur.execute(RESERVE_SQL, (bot_id, bot_id))
+                return bot_id
+        try:
+            return await self.run(_add_bot)
         except Exception as e:
             print(f"❌ خطأ في إضافة البوت: {e}")
+            return None
+        finally:
+            self.user_cache.pop(user_id)
+
+    @observe("db")
+    async def reserve_slot(self, bot_id):
+        # حجز مكان للبوت وتفعيله في استعلام شرطي واحد. قفل صف المستخدم يجعل الطلبات
+        # المتزامنة تنتظر ثم تعيد فحص active_bots < max_bots على القيمة الجديدة
+        try:
+            row = await self.fetchone(RESERVE_SQL, (bot_id, bot_id))
+        except Exception as e:
+            print(f"❌ خطأ في حجز مكان للبوت: {e}")
+            return False
+        if row:
+            self.user_cache.pop(row[0])
+        return row is not None
+
+    @observe("db")
+    async def release_slot(self, bot_id):
+        # يحرر المكان فقط إذا كان البوت نشطاً فعلاً، فتكرار الإيقاف لا يُنقص العداد مرتين
+        try:
+            row = await self.fetchone('''
+                WITH changed AS (
+                    UPDATE bots SET is_active = FALSE
+                    WHERE id = %s AND is_active
+                    RETURNING user_id
+                )
+                UPDATE users SET active_bots = GREATEST(active_bots - 1, 0)
+                WHERE user_id IN (SELECT user_id FROM changed)
+                RETURNING user_id
+            ''', (bot_id,))
+            if row:
+                self.user_cache.pop(row[0])
+            return True
+        except Exception as e:
+            print(f"❌ خطأ في تحرير مكان البوت: {e}")
             return False
-    
-    def get_user_bots(self, user_id):
+
+    @observe("db")
+    async def record_health(self, changes, deactivate=()):
+        # كل نتائج دورة الفحص في معاملة واحدة: الحالات المتغيرة في استعلام واحد،
+        # ثم إيقاف البوتات المعطلة وإنقاص عدادات أصحابها في استعلام واحد
+        def _record(conn):
+            released = []
+            with conn.cursor() as cur:
+                if changes:
+                    execute_values(cur, '''
+                        UPDATE bots SET health = v.health, health_checked_at = CURRENT_TIMESTAMP
+                        FROM (VALUES %s) AS v (id, health)
+                        WHERE bots.id = v.id
+                    ''', changes, template='(%s::integer, %s)', page_size=len(changes))
+                if deactivate:
+                    cur.execute('''
+                        WITH changed AS (
+                            UPDATE bots SET is_active = FALSE
+                            WHERE id = ANY(%s) AND is_active
+                            RETURNING user_id
+                        ), counts AS (
+                            SELECT user_id, count(*) AS released FROM changed GROUP BY user_id
+                        )
+                        UPDATE users SET active_bots = GREATEST(active_bots - counts.released, 0)
+                        FROM counts WHERE users.user_id = counts.user_id
+                        RETURNING users.user_id
+                    ''', (list(deactivate),))
+                    released = [row[0] for row in cur.fetchall()]
+            return released
         try:
-            with self.conn.cursor() as cur:
+            released = await self.run(_record)
+        except Exception as e:
+            print(f"❌ خطأ في حفظ نتائج فحص البوتات: {e}")
+            return False
+        for user_id in released:
+            self.user_cache.pop(user_id)
+        return True
+
+    @observe("db")
+    async def reconcile_active_bots(self):
+        # يعيد حساب active_bots من bots.is_active للمستخدمين المختلفين فقط
+        def _reconcile(conn):
+            with conn.cursor() as cur:
                 cur.execute('''
-                    SELECT id, bot_name, bot_language, is_active, created_at 
-                    FROM bots WHERE user_id = %s ORDER BY created_at DESC
-                ''', (user_id,))
-                return cur.fetchall()
+                    SELECT u.user_id FROM users u
+                    LEFT JOIN bots b ON b.user_id = u.user_id AND b.is_active
+                    GROUP BY u.user_id, u.active_bots
+                    HAVING u.active_bots IS DISTINCT FROM count(b.id)
+                ''')
+                drifted = [row[0] for row in cur.fetchall()]
+                if not drifted:
+                    return []
+                # قفل صفوف هؤلاء المستخدمين فقط ثم إعادة العد بلقطة جديدة، حتى لا يكتب
+                # التصحيح قيمة قديمة فوق حجز تم بعد القراءة الأولى
+                cur.execute(
+                    'SELECT user_id FROM users WHERE user_id = ANY(%s) ORDER BY user_id FOR UPDATE',
+                    (drifted,)
+                )
+                cur.execute('''
+                    UPDATE users u SET active_bots = c.active
+                    FROM (
+                        SELECT u2.user_id, count(b.id) AS active FROM users u2
+                        LEFT JOIN bots b ON b.user_id = u2.user_id AND b.is_active
+                        WHERE u2.user_id = ANY(%s)
+                        GROUP BY u2.user_id
+                    ) c
+                    WHERE u.user_id = c.user_id AND u.active_bots IS DISTINCT FROM c.active
+                    RETURNING u.user_id
+                ''', (drifted,))
+                return [row[0] for row in cur.fetchall()]
+        fixed = await self.run(_reconcile)
+        for user_id in fixed:
+            self.user_cache.pop(user_id)
+        return fixed
+
+    @observe("db")
+    async def get_active_bots(self):
+        try:
+            return await self.fetchall('''
+                SELECT id, user_id, bot_language, file_path, bot_token
+                FROM bots WHERE is_active = TRUE
+            ''')
+        except Exception as e:
+            print(f"❌ خطأ في جلب البوتات النشطة: {e}")
+            return []
+
+    @observe("db")
+    async def get_user_bots(self, user_id):
+        try:
+            return await self.fetchall('''
+                SELECT id, bot_name, bot_language, is_active, created_at
+                FROM bots WHERE user_id = %s ORDER BY created_at DESC, id DESC
+            ''', (user_id,))
         except Exception as e:
             print(f"❌ خطأ في جلب بوتات المستخدم: {e}")
             return []
-    
-    def add_library(self, library_name, user_id):
+
+    async def _keyset_page(self, select, where, params, keys, cursor, backward, limit):
+        # ترقيم بالمفتاح: الاستعلام يبدأ من آخر صف معروض بدلاً من OFFSET
+        direction, op = ('ASC', '>') if backward else ('DESC', '<')
+        conditions = [where] if where else []
+        if cursor is not None:
+            conditions.append(f"({', '.join(keys)}) {op} (%s, %s)")
+            params = params + tuple(cursor)
+        sql = select
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ', '.join(f'{key} {direction}' for key in keys) + ' LIMIT %s'
+        rows = await self.fetchall(sql, params + (limit + 1,))
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+            return rows, more, True
+        return rows, cursor is not None, more
+
+    @observe("db")
+    async def get_user_bots_page(self, user_id, cursor=None, backward=False, limit=10):
+        # يعيد (الصفوف، يوجد سابق، يوجد تالٍ)؛ المؤشر هو (created_at, id) لأول أو آخر صف
         try:
-            with self.conn.cursor() as cur:
-                cur.execute('''
-                    INSERT INTO libraries (library_name, installed_by) 
-                    VALUES (%s, %s) ON CONFLICT (library_name) DO NOTHING
-                ''', (library_name.strip(), user_id))
-                self.conn.commit()
-                return True
+            return await self._keyset_page(
+                'SELECT id, bot_name, bot_language, is_active, created_at FROM bots',
+                'user_id = %s', (user_id,), ('created_at', 'id'), cursor, backward, limit
+            )
         except Exception as e:
-            print(f"❌ خطأ في إضافة المكتبة: {e}")
-            return False
-    
-    def get_libraries(self):
+            print(f"❌ خطأ في جلب بوتات المستخدم: {e}")
+            return [], False, False
+
+    @observe("db")
+    async def get_libraries_page(self, cursor=None, backward=False, limit=10):
+        # المؤشر هو (installed_at, id)
         try:
-            with self.conn.cursor() as cur:
-                cur.execute('SELECT library_name FROM libraries ORDER BY installed_at DESC')
-                return [row[0] for row in cur.fetchall()]
+            return await self._keyset_page(
+                'SELECT id, library_name, installed_at FROM libraries',
+                None, (), ('installed_at', 'id'), cursor, backward, limit
+            )
+        except Exception as e:
+            print(f"❌ خطأ في جلب المكتبات: {e}")
+            return [], False, False
+
+    @observe("db")
+    async def add_library(self, library_name, user_id):
+        added, _ = await self.add_libraries([library_name], user_id)
+        return bool(added)
+
+    @observe("db")
+    async def add_libraries(self, lines, user_id):
+        # إدخال كل المكتبات في استعلام واحد، وRETURNING تخبرنا بما أضيف فعلاً
+        valid = [name for name in map(normalize_library_name, lines) if name]
+        names = list(dict.fromkeys(valid))
+        if not names:
+            return [], 0
+        try:
+            rows = await self.fetchall('''
+                INSERT INTO libraries (library_name, installed_by)
+                SELECT unnest(%s::varchar[]), %s
+                ON CONFLICT DO NOTHING
+                RETURNING library_name
+            ''', (names, user_id))
+        except Exception as e:
+            print(f"❌ خطأ في إضافة المكتبات: {e}")
+            return [], 0
+        added = [row[0] for row in rows]
+        # المكرر يشمل ما كان موجوداً مسبقاً وما تكرر داخل الرسالة نفسها
+        return added, len(valid) - len(added)
+
+    @observe("db")
+    async def get_libraries(self):
+        try:
+            rows = await self.fetchall('SELECT library_name FROM libraries ORDER BY installed_at DESC')
+            return [row[0] for row in rows]
         except Exception as e:
             print(f"❌ خطأ في جلب المكتبات: {e}")
             return []
@@ -0,0 +1,79 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # تحديثات المستخدمين المختلفين تُعالج بالتوازي، وتحديثات المستخدم الواحد بالترتيب
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # المستخدم -> [قفل، عدد تحديثاته المنتظرة أو الجارية]
+        self._users = {}
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.max_user_depth = 0
+        self.processed = 0
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # نأخذ قفل المستخدم قبل مكان التنفيذ العام حتى لا يحجز مستخدم واحد كل الأماكن
+        # وهو ينتظر دوره. أقفال asyncio تخدم المنتظرين بترتيب وصولهم (FIFO)
+        key = self._key(update)
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.max_user_depth = max(self.max_user_depth, entry[1])
+        try:
+            async with entry[0]:
+                await self._run(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[key]
+
+    async def _run(self, update, coroutine):
+        async with self._slots:
+            self.queued -= 1
+            self.in_flight += 1
+            try:
+                await self.do_process_update(update, coroutine)
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'limit': self.max_concurrent_updates,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'users_pending': len(self._users),
+            'max_user_depth': self.max_user_depth,
+            'processed': self.processed,
+        }
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import Counter
+import httpx
+from dotenv import load_dotenv
+
+from botlogs import loghub
+from database import db
+from sharding import owns
+from supervisor import supervisor
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# نتائج الفحص كما تُحفظ في bots.health
+OK = 'ok'
+RESTARTING = 'restarting'
+DEAD = 'dead'
+TOKEN_INVALID = 'token_invalid'
+MISSING_FILE = 'missing_file'
+GAVE_UP = 'gave_up'
+
+
+class BotHealth:
+    __slots__ = ('status', 'saved', 'failures', 'attempts', 'retry_at', 'token_checked')
+
+    def __init__(self):
+        self.status = None
+        # آخر حالة كُتبت في قاعدة البيانات، فلا يُكتب إلا ما تغير
+        self.saved = None
+        # فحوص فاشلة متتالية، ومحاولات إعادة التشغيل من الفحص
+        self.failures = 0
+        self.attempts = 0
+        self.retry_at = 0.0
+        # None: لم يُفحص التوكن بعد
+        self.token_checked = None
+
+
+class HealthMonitor:
+    # فحص دوري للبوتات النشطة: هل عمليتها حية، وهل توكنها صالح (getMe)
+    def __init__(self, supervisor, database, interval=None, batch_size=None, concurrency=None,
+                 timeout=None, api_url=None, token_interval=None, failures=None, max_restarts=None,
+                 backoff_base=None, backoff_max=None):
+        self.supervisor = supervisor
+        self.db = database
+        self.interval = interval or float(os.getenv('HEALTH_INTERVAL', 60))
+        self.batch_size = batch_size or int(os.getenv('HEALTH_BATCH', 100))
+        self.concurrency = concurrency or int(os.getenv('HEALTH_CONCURRENCY', 10))
+        self.timeout = timeout or float(os.getenv('HEALTH_TIMEOUT', 5))
+        # واجهة Bot API أو بديل محلي لها (خادم Bot API محلي أو واجهة وهمية في الاختبارات)
+        self.api_url = (api_url or os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')).rstrip('/')
+        # getMe لكل بوت مرة كل token_interval ثانية، أما فحص العملية فكل دورة
+        self.token_interval = token_interval or float(os.getenv('HEALTH_TOKEN_INTERVAL', 3600))
+        # فشل متتالٍ قبل أي إجراء، حتى لا يُعاد تشغيل بوت ما زال في منتصف تشغيله
+        self.failures = failures or int(os.getenv('HEALTH_FAILURES', 2))
+        self.max_restarts = max_restarts or int(os.getenv('HEALTH_MAX_RESTARTS', 3))
+        self.backoff_base = backoff_base or float(os.getenv('HEALTH_BACKOFF_BASE', 30))
+        self.backoff_max = backoff_max or float(os.getenv('HEALTH_BACKOFF_MAX', 1800))
+        self._bots = {}
+        self._client = None
+        self.cycles = 0
+        self.probes = 0
+        self.token_checks = 0
+        self.restarts = 0
+        self.deactivated = 0
+        self.last_duration = 0.0
+
+    def first_delay(self):
+        # بداية عشوائية حتى لا تفحص كل العمليات (SHARDS) في اللحظة نفسها
+        return self.interval * random.uniform(0.5, 1.0)
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def _check_token(self, token):
+        # True صالح، False مرفوض، None تعذر الحكم (شبكة أو 429 أو خطأ خادم)
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, limits=httpx.Limits(max_connections=self.concurrency)
+            )
+        self.token_checks += 1
+        try:
+            response = await self._client.get(f"{self.api_url}/bot{token}/getMe")
+        except httpx.InvalidURL:
+            return False
+        except httpx.HTTPError:
+            return None
+        if response.status_code in (401, 404):
+            return False
+        if response.status_code != 200:
+            return None
+        try:
+            return bool(response.json().get('ok'))
+        except ValueError:
+            return None
+
+    async def _probe(self, slots, row, health):
+        bot_id, _, _, file_path, token = row
+        async with slots:
+            self.probes += 1
+            bp = self.supervisor.processes.get(bot_id)
+            if bp is None:
+                status = DEAD if file_path and os.path.exists(file_path) else MISSING_FILE
+            elif not bp.running:
+                # المشرف في فترة الانتظار قبل إعادة التشغيل، فهو من يتولى الأمر
+                status = RESTARTING
+            else:
+                status = OK
+            now = time.monotonic()
+            due = health.token_checked is None or now - health.token_checked >= self.token_interval
+            if status in (OK, DEAD) and due:
+                valid = await self._check_token(token)
+                if valid:
+                    health.token_checked = now
+                elif valid is False:
+                    status = TOKEN_INVALID
+            return status
+
+    async def _apply(self, row, status, health, deactivate):
+        bot_id, user_id, language, file_path, token = row
+        health.status = status
+        if status == OK:
+            health.failures = 0
+            health.attempts = 0
+            return
+        if status == RESTARTING:
+            return
+        health.failures += 1
+        if health.failures < self.failures:
+            return
+        if status == DEAD and health.attempts < self.max_restarts:
+            # is_active صحيحة ولا عملية للبوت: إعادة تشغيله بمهلة متزايدة عشوائية
+            health.attempts += 1
+            health.failures = 0
+            health.retry_at = time.monotonic() + self._backoff(health.attempts)
+            self.restarts += 1
+            logger.warning("البوت %s نشط في قاعدة البيانات بدون عملية، إعادة تشغيله", bot_id)
+            await self.supervisor.start(bot_id, user_id, language, file_path, token)
+            loghub.feed(bot_id, 'sys', "أعاد فحص الصحة تشغيل البوت\n")
+            return
+        if status == DEAD:
+            health.status = GAVE_UP
+        reason = {
+            TOKEN_INVALID: "التوكن مرفوض من تيليجرام",
+            MISSING_FILE: "ملف البوت غير موجود",
+        }.get(status, "تعذر إبقاء البوت يعمل")
+        # الإيقاف بعد حفظ is_active=FALSE مع باقي نتائج الدفعة (check)؛ إذا فشل الحفظ يبقى البوت
+        # كما هو ويُعاد الحكم عليه في الدورة التالية، فلا يبقى بوت نشط في قاعدة البيانات بلا عملية
+        deactivate.append((bot_id, reason))
+
+    async def check(self):
+        started = time.monotonic()
+        rows = [row for row in await self.db.get_active_bots() if owns(row[1])]
+        active = {row[0] for row in rows}
+        for bot_id in list(self._bots):
+            if bot_id not in active:
+                del self._bots[bot_id]
+        slots = asyncio.Semaphore(self.concurrency)
+        # دفعات متتالية: لا يزيد عدد الفحوص المعلقة عن حجم الدفعة، وتُحفظ نتائج كل دفعة معاً
+        for index in range(0, len(rows), self.batch_size):
+            now = time.monotonic()
+            batch = []
+            for row in rows[index:index + self.batch_size]:
+                health = self._bots.setdefault(row[0], BotHealth())
+                if now >= health.retry_at:
+                    batch.append((row, health))
+            statuses = await asyncio.gather(*(self._probe(slots, row, health) for row, health in batch))
+            changes, deactivate = [], []
+            for (row, health), status in zip(batch, statuses):
+                await self._apply(row, status, health, deactivate)
+                if health.status != health.saved:
+                    changes.append((row[0], health.status))
+            if not (changes or deactivate):
+                continue
+            if not await self.db.record_health(changes, [bot_id for bot_id, _ in deactivate]):
+                continue
+            for row, health in batch:
+                health.saved = health.status
+            for bot_id, reason in deactivate:
+                logger.warning("إيقاف البوت %s: %s", bot_id, reason)
+                loghub.feed(bot_id, 'sys', f"تم إيقاف البوت: {reason}\n")
+                # المكان حُرر مع الحفظ
+                await self.supervisor.stop(bot_id, release=False)
+                self._bots.pop(bot_id, None)
+                self.deactivated += 1
+        self.cycles += 1
+        self.last_duration = time.monotonic() - started
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        statuses = Counter(health.status for health in self._bots.values())
+        return {
+            'tracked': len(self._bots),
+            'cycles': self.cycles,
+            'probes': self.probes,
+            'token_checks': self.token_checks,
+            'restarts': self.restarts,
+            'deactivated': self.deactivated,
+            'last_duration_seconds': round(self.last_duration, 3),
+            **{f'status_{status}': count for status, count in statuses.items() if status},
+        }
+
+
+# فحص صحة البوتات المستضافة
+watchdog = HealthMonitor(supervisor, db)
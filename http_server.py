@@ -0,0 +1,117 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class HTTPServer:
+    # خادم HTTP/1.1 صغير فوق asyncio يكفي لاستقبال التحديثات وعرض المقاييس
+    # handler(method, path, headers, body) -> (status, body, content_type)
+    def __init__(self, handler, host, port, max_body=1024 * 1024):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self._server = None
+        self._serving = False
+        self._connections = set()
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self._serving = True
+        # عند استخدام المنفذ 0 نحتفظ بالمنفذ الفعلي
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self, timeout=30):
+        if self._server is None:
+            return
+        self._serving = False
+        self._server.close()
+        # انتظار الطلبات الجارية ثم إغلاق الاتصالات الخاملة
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("انتهت مهلة انتظار %s طلب جارٍ", self._active)
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body:
+            raise OverflowError(length)
+        body = await reader.readexactly(length) if length else b''
+        return method, path, headers, body
+
+    def _write_response(self, writer, status, body, content_type, keep_alive):
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+
+    async def _serve(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except OverflowError:
+                    self._write_response(writer, 413, b'', 'text/plain', False)
+                    break
+                except (ValueError, asyncio.IncompleteReadError):
+                    self._write_response(writer, 400, b'', 'text/plain', False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                self._active += 1
+                self._idle.clear()
+                try:
+                    status, payload, content_type = await self.handler(method, path, headers, body)
+                except Exception as e:
+                    logger.error("خطأ في معالجة الطلب %s: %s", path, e)
+                    status, payload, content_type = 503, b'', 'text/plain'
+                finally:
+                    self._active -= 1
+                    if not self._active:
+                        self._idle.set()
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and self._serving
+                self._write_response(writer, status, payload, content_type, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
@@ -0,0 +1,239 @@
+import asyncio
+import contextlib
+import fcntl
+import itertools
+import logging
+import os
+import re
+import sys
+import tempfile
+from dotenv import load_dotenv
+
+from sandbox import launcher, uid_base
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# pip wheel ينفذ setup.py لحزم يسميها المستخدمون، وComposer ينفذ سكربتات الحزم:
+# لا يصلهما من بيئة المدير إلا ما يلزم التنزيل (لا DATABASE_URL ولا BOT_TOKEN)
+BUILD_ENV = (
+    'PATH', 'LANG', 'LC_ALL', 'TZ', 'HOME',
+    'HTTP_PROXY', 'HTTPS_PROXY', 'NO_PROXY', 'http_proxy', 'https_proxy', 'no_proxy',
+    'PIP_INDEX_URL', 'PIP_EXTRA_INDEX_URL', 'SSL_CERT_FILE',
+)
+
+# الحساب الافتراضي للبناء: الرقم السابق لحسابات البوتات فلا يشارك أي بوت ملفاته
+BUILD_UID_OFFSET = -1
+
+
+class InstallJob:
+    __slots__ = ('id', 'user_id', 'names', 'done', 'failed', 'status', 'task')
+
+    def __init__(self, job_id, user_id, names):
+        self.id = job_id
+        self.user_id = user_id
+        self.names = names
+        self.done = []
+        self.failed = []
+        self.status = "pending"
+        self.task = None
+
+    @property
+    def total(self):
+        return len(self.names)
+
+
+class LibraryInstaller:
+    def __init__(self, envs_dir=None, concurrency=None):
+        self.envs_dir = envs_dir or os.getenv('ENVS_DIR', 'envs')
+        self.python_env = os.path.join(self.envs_dir, 'python')
+        self.php_env = os.path.join(self.envs_dir, 'php')
+        # ذاكرة مشتركة للحزم المبنية: التثبيت المتكرر لا يعيد التنزيل أو البناء
+        self.wheelhouse = os.getenv('WHEEL_CACHE_DIR', os.path.join(self.envs_dir, 'wheelhouse'))
+        self.composer_cache = os.getenv('COMPOSER_CACHE_DIR', os.path.join(self.envs_dir, 'composer-cache'))
+        self.concurrency = concurrency or int(os.getenv('INSTALL_CONCURRENCY', 4))
+        # البناء ينفذ كود الحزم: يعمل بحساب غير مميز وحدود موارد، ومجلده وHOME خارج المشروع
+        # (بعيداً عن .env والملفات المرفوعة). -1 بدون تبديل الحساب كما في BOT_UID_BASE
+        base = uid_base()
+        self.build_uid = int(os.getenv('BUILD_UID', base + BUILD_UID_OFFSET if base >= 0 else -1))
+        self.build_home = os.path.abspath(
+            os.getenv('BUILD_HOME', os.path.join(tempfile.gettempdir(), 'bot-builds'))
+        )
+        self.build_cpu_seconds = int(os.getenv('BUILD_CPU_SECONDS', 900))
+        self.build_memory_mb = int(os.getenv('BUILD_MEMORY_MB', 4096))
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # التثبيت في البيئة نفسها يتم بالتسلسل، أما التنزيل والبناء فبالتوازي
+        self._env_locks = {'python': asyncio.Lock(), 'php': asyncio.Lock()}
+        self._installed = set()
+        self._ids = itertools.count(1)
+        self.jobs = {}
+
+    @contextlib.asynccontextmanager
+    async def _env_lock(self, language):
+        # قفل ملف إضافة إلى قفل العملية: عمليات المعالجة (SHARDS) تشترك في البيئات نفسها
+        async with self._env_locks[language]:
+            os.makedirs(self.envs_dir, exist_ok=True)
+            with open(os.path.join(self.envs_dir, f'.{language}.lock'), 'w') as lock:
+                await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+                yield
+
+    @property
+    def python_bin(self):
+        return os.path.join(self.python_env, 'bin', 'python')
+
+    @property
+    def php_autoload(self):
+        return os.path.join(self.php_env, 'vendor', 'autoload.php')
+
+    @staticmethod
+    def language_of(name):
+        # أسماء Composer بالشكل vendor/package، وما عداها حزم pip
+        return 'php' if '/' in name else 'python'
+
+    async def _run(self, *cmd, cwd=None, **extra_env):
+        env = {key: os.environ[key] for key in BUILD_ENV if key in os.environ}
+        env.update(extra_env)
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=cwd,
+            env=env,
+        )
+        output, _ = await process.communicate()
+        return process.returncode, output.decode(errors='replace')
+
+    def _own(self, path, mode=None):
+        # ينشئ المجلد ويجعله ملكاً لحساب البناء (مع محتواه إن أنشأه المدير سابقاً)
+        os.makedirs(path, exist_ok=True)
+        if mode is not None:
+            os.chmod(path, mode)
+        if self.build_uid < 0 or os.stat(path).st_uid == self.build_uid:
+            return
+        for root, dirs, files in os.walk(path):
+            for name in (root, *(os.path.join(root, entry) for entry in dirs + files)):
+                os.lchown(name, self.build_uid, self.build_uid)
+
+    async def _build(self, *cmd, **extra_env):
+        # أوامر تنفذ كود الحزم (pip wheel وcomposer require) عبر مشغل البوتات نفسه
+        await asyncio.to_thread(self._own, self.build_home, 0o700)
+        return await self._run(
+            *launcher(self.build_cpu_seconds, self.build_memory_mb, self.build_uid, cmd),
+            cwd=self.build_home, HOME=self.build_home, **extra_env
+        )
+
+    async def _ensure_python_env(self):
+        if not os.path.exists(self.python_bin):
+            code, output = await self._run(sys.executable, '-m', 'venv', self.python_env)
+            if code != 0:
+                raise RuntimeError(output)
+
+    @staticmethod
+    def _wheel_key(name):
+        # أسماء ملفات wheel لا تتبع حالة أحرف ثابتة (PyYAML-6.0-... أو pyyaml-6.0-...)
+        return re.sub(r'[-_.]+', '_', name).lower()
+
+    def _cached(self, name):
+        key = self._wheel_key(name)
+        try:
+            with os.scandir(self.wheelhouse) as entries:
+                return any(
+                    entry.name.endswith('.whl') and self._wheel_key(entry.name.split('-', 1)[0]) == key
+                    for entry in entries
+                )
+        except FileNotFoundError:
+            return False
+
+    async def _build_wheel(self, name):
+        if self._cached(name):
+            return True
+        async with self._slots:
+            wheelhouse = os.path.abspath(self.wheelhouse)
+            code, output = await self._build(
+                os.path.abspath(sys.executable), '-m', 'pip', 'wheel', '--quiet',
+                '--wheel-dir', wheelhouse, '--find-links', wheelhouse, name
+            )
+        if code != 0:
+            logger.warning("فشل بناء الحزمة %s: %s", name, output[-500:])
+        return code == 0
+
+    async def _install_python(self, job, names, progress):
+        await asyncio.to_thread(self._own, self.wheelhouse)
+        async with self._env_lock('python'):
+            await self._ensure_python_env()
+
+        async def build(name):
+            ok = await self._build_wheel(name)
+            (job.done if ok else job.failed).append(name)
+            if progress:
+                await progress(job)
+            return name if ok else None
+
+        built = [name for name in await asyncio.gather(*(build(name) for name in names)) if name]
+        if not built:
+            return
+        async with self._env_lock('python'):
+            code, output = await self._run(
+                self.python_bin, '-m', 'pip', 'install', '--quiet',
+                '--no-index', '--find-links', self.wheelhouse, *built
+            )
+        if code != 0:
+            logger.warning("فشل تثبيت الحزم في البيئة المشتركة: %s", output[-500:])
+            for name in built:
+                job.done.remove(name)
+                job.failed.append(name)
+            return
+        self._installed.update(built)
+
+    async def _install_php(self, job, names, progress):
+        # Composer يحمّل الحزم بالتوازي ويستخدم ذاكرته المشتركة
+        async with self._env_lock('php'):
+            await asyncio.to_thread(self._own, self.php_env)
+            await asyncio.to_thread(self._own, self.composer_cache)
+            code, output = await self._build(
+                'composer', 'require', '--no-interaction', '--quiet',
+                '--working-dir', os.path.abspath(self.php_env), *names,
+                COMPOSER_CACHE_DIR=os.path.abspath(self.composer_cache)
+            )
+        if code == 0:
+            job.done.extend(names)
+            self._installed.update(names)
+        else:
+            logger.warning("فشل تثبيت حزم PHP: %s", output[-500:])
+            job.failed.extend(names)
+        if progress:
+            await progress(job)
+
+    async def _process(self, job, progress):
+        job.status = "running"
+        pending = [name for name in job.names if name not in self._installed]
+        job.done.extend(name for name in job.names if name in self._installed)
+        by_language = {'python': [], 'php': []}
+        for name in pending:
+            by_language[self.language_of(name)].append(name)
+        try:
+            await asyncio.gather(
+                self._install_python(job, by_language['python'], progress) if by_language['python'] else asyncio.sleep(0),
+                self._install_php(job, by_language['php'], progress) if by_language['php'] else asyncio.sleep(0),
+            )
+            job.status = "finished"
+        except Exception as e:
+            logger.error("خطأ في مهمة التثبيت %s: %s", job.id, e)
+            job.status = "failed"
+        if progress:
+            await progress(job)
+        return job
+
+    def submit(self, names, user_id=None, progress=None):
+        # يعيد المهمة فوراً؛ التثبيت يستمر في الخلفية ويبلغ عن تقدمه عبر progress
+        job = InstallJob(next(self._ids), user_id, list(names))
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._process(job, progress))
+        job.task.add_done_callback(lambda _: self.jobs.pop(job.id, None))
+        return job
+
+
+# مثبت المكتبات المشترك
+installer = LibraryInstaller()
@@ -0,0 +1,191 @@
+import bisect
+import functools
+import logging
+import os
+import time
+from telegram.request import HTTPXRequest
+from dotenv import load_dotenv
+
+from http_server import HTTPServer
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = os.getenv('METRICS_PORT')
+SLOW_CALL_MS = float(os.getenv('SLOW_CALL_MS', 0))
+# بدون منفذ للمقاييس ولا سجل للاستدعاءات البطيئة تعود المزخرفات بالدوال كما هي
+ENABLED = bool(METRICS_PORT) or SLOW_CALL_MS > 0
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for label_values, value in self.values.items():
+            yield f'{self.name}{_labels(self.labels, label_values)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # القيم -> [عدادات الفئات، المجموع، العدد]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for label_values, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labels, label_values, f'le="{bound}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _labels(self.labels, label_values, 'le="+Inf"')
+            yield f'{self.name}_bucket{labels} {count}'
+            yield f'{self.name}_sum{_labels(self.labels, label_values)} {total}'
+            yield f'{self.name}_count{_labels(self.labels, label_values)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # دوال تعيد قاموس إحصائيات رقمية تُعرض كمقاييس gauge
+        self.collectors = {}
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix, collect):
+        self.collectors[prefix] = collect
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, collect in self.collectors.items():
+            try:
+                stats = collect()
+            except Exception as e:
+                logger.debug("تعذر جمع إحصائيات %s: %s", prefix, e)
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'# TYPE {prefix}_{key} gauge')
+                    lines.append(f'{prefix}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+LATENCY = registry.register(Histogram(
+    'bot_call_duration_seconds', 'Latency of handlers and database calls', ('kind', 'name')
+))
+ERRORS = registry.register(Counter(
+    'bot_call_errors_total', 'Exceptions raised by handlers and database calls', ('kind', 'name')
+))
+TRANSITIONS = registry.register(Counter(
+    'bot_conversation_transitions_total', 'Conversation steps entered, by stored session mode', ('from', 'to')
+))
+API_LATENCY = registry.register(Histogram(
+    'bot_telegram_api_duration_seconds', 'Latency of Telegram Bot API calls', ('method',)
+))
+API_ERRORS = registry.register(Counter(
+    'bot_telegram_api_errors_total', 'Failed Telegram Bot API calls', ('method',)
+))
+
+
+def _record(kind, name, started):
+    elapsed = time.perf_counter() - started
+    LATENCY.observe(elapsed, kind, name)
+    if SLOW_CALL_MS and elapsed * 1000 >= SLOW_CALL_MS:
+        logger.warning("استدعاء بطيء: %s.%s استغرق %.1f ms", kind, name, elapsed * 1000)
+
+
+def observe(kind):
+    # مزخرف للدوال غير المتزامنة: زمن التنفيذ والأخطاء
+    def decorator(func):
+        if not ENABLED:
+            return func
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                ERRORS.inc(kind, name)
+                _record(kind, name, started)
+                raise
+            _record(kind, name, started)
+            return result
+        return wrapper
+    return decorator
+
+
+class InstrumentedRequest(HTTPXRequest):
+    # يقيس كل استدعاء لواجهة تيليجرام حسب اسم الطريقة (sendMessage، getFile ...)
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(api_method)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, api_method)
+
+
+class MetricsServer:
+    def __init__(self, port=None, host=None):
+        self.server = HTTPServer(
+            self._handle,
+            host or os.getenv('METRICS_HOST', '127.0.0.1'),
+            int(port or METRICS_PORT or 9090),
+        )
+
+    async def _handle(self, method, path, headers, body):
+        if path.split('?', 1)[0] != '/metrics':
+            return 404, b'', 'text/plain'
+        return 200, registry.render().encode(), 'text/plain; version=0.0.4'
+
+    async def start(self):
+        await self.server.start()
+        logger.info("المقاييس متاحة على المنفذ %s", self.server.port)
+
+    async def stop(self):
+        await self.server.stop(timeout=1)
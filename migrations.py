@@ -0,0 +1,134 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# قفل استشاري يمنع عمليتين من تطبيق الترحيلات في الوقت نفسه
+MIGRATION_LOCK_ID = 0x59454d454e38
+
+SCHEMA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description VARCHAR(200),
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# (الإصدار، الوصف، الأوامر) بترتيب تصاعدي. لا يُعدل ترحيل طُبق سابقاً، بل يُضاف ترحيل جديد
+MIGRATIONS = [
+    (1, 'users, bots and libraries', (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username VARCHAR(100),
+            first_name VARCHAR(100),
+            is_admin BOOLEAN DEFAULT FALSE,
+            active_bots INTEGER DEFAULT 0,
+            max_bots INTEGER DEFAULT 3,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS bots (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            bot_name VARCHAR(100),
+            bot_language VARCHAR(10),
+            bot_token VARCHAR(100),
+            bot_code TEXT,
+            file_path VARCHAR(200),
+            is_active BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS libraries (
+            id SERIAL PRIMARY KEY,
+            library_name VARCHAR(100) UNIQUE,
+            installed_by BIGINT,
+            installed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (installed_by) REFERENCES users (user_id)
+        )
+        ''',
+    )),
+    (2, 'conversation sessions', (
+        # جلسات المحادثة (عند استخدام SESSION_BACKEND=postgres)
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id BIGINT PRIMARY KEY,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (3, 'listing indexes and normalized library names', (
+        # قوائم البوتات والمكتبات تُقرأ بالصفحات بترتيب (التاريخ، المعرف)
+        '''
+        CREATE INDEX IF NOT EXISTS bots_user_created_idx
+        ON bots (user_id, created_at DESC, id DESC)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS libraries_installed_at_idx
+        ON libraries (installed_at DESC, id DESC)
+        ''',
+        # القواعد القديمة قد تحوي الاسم نفسه بحالة أحرف مختلفة، نبقي أقدمها
+        '''
+        DELETE FROM libraries a USING libraries b
+        WHERE lower(a.library_name) = lower(b.library_name) AND a.id > b.id
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS libraries_name_normalized_idx
+        ON libraries (lower(library_name))
+        ''',
+    )),
+    (4, 'bot health status', (
+        # آخر نتيجة لفحص الصحة الدوري (ok, dead, restarting, token_invalid, ...)
+        'ALTER TABLE bots ADD COLUMN IF NOT EXISTS health VARCHAR(20)',
+        'ALTER TABLE bots ADD COLUMN IF NOT EXISTS health_checked_at TIMESTAMP',
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_VERSION_TABLE)
+        cur.execute('SELECT coalesce(max(version), 0) FROM schema_version')
+        return cur.fetchone()[0]
+
+
+def migrate(conn):
+    # يطبق الترحيلات الناقصة، كل ترحيل في معاملة مستقلة مع تسجيل إصداره
+    with conn.cursor() as cur:
+        # بناء الفهارس على جداول كبيرة قد يتجاوز مهلة الاستعلامات العادية
+        cur.execute('SET statement_timeout = 0')
+        cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+    try:
+        version = current_version(conn)
+        conn.commit()
+        applied = []
+        for number, description, statements in MIGRATIONS:
+            if number <= version:
+                continue
+            try:
+                with conn.cursor() as cur:
+                    for sql in statements:
+                        cur.execute(sql)
+                    cur.execute(
+                        'INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                        (number, description)
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error("فشل ترحيل قاعدة البيانات %s (%s)", number, description)
+                raise
+            logger.info("تم تطبيق ترحيل قاعدة البيانات %s: %s", number, description)
+            applied.append(number)
+        return applied
+    finally:
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+            cur.execute('RESET statement_timeout')
+        conn.commit()
@@ -0,0 +1,292 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import BaseRateLimiter
+from dotenv import load_dotenv
+
+from cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# أولويات الإرسال: الأصغر يُرسل أولاً (تُمرر عبر rate_limit_args)
+HIGH, NORMAL, LOW = 0, 1, 2
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, capacity):
+        # rate=0 يعني بدون حد
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now):
+        # الثواني المتبقية حتى يتوفر رمز واحد
+        if now < self.paused_until:
+            return self.paused_until - now
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class FloodLimiter(BaseRateLimiter):
+    # حدود إرسال عامة ولكل محادثة لكل استدعاءات Bot API، والطلبات المنتظرة تُخدم حسب الأولوية
+    def __init__(self, global_rate=None, chat_rate=None, chat_burst=None, max_retries=None):
+        global_rate = float(os.getenv('SEND_GLOBAL_RATE', 30) if global_rate is None else global_rate)
+        self.chat_rate = float(os.getenv('SEND_CHAT_RATE', 1) if chat_rate is None else chat_rate)
+        self.chat_burst = int(os.getenv('SEND_CHAT_BURST', 3) if chat_burst is None else chat_burst)
+        self.max_retries = int(os.getenv('SEND_MAX_RETRIES', 3) if max_retries is None else max_retries)
+        self._global = TokenBucket(global_rate, int(global_rate))
+        # دلو لكل محادثة؛ الدلو الخامل يمتلئ على أي حال فلا ضرر من حذفه
+        self._chats = TTLCache(maxsize=100000, ttl=60)
+        # [الأولوية، التسلسل، المحادثة، future]
+        self._waiting = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self.granted = 0
+        self.delayed = 0
+        self.retries = 0
+        self.max_waiting = 0
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._grant_loop())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for entry in self._waiting:
+            entry[3].cancel()
+        self._waiting.clear()
+
+    def _bucket(self, chat_id):
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    def _ready(self, chat_id, now):
+        bucket = self._bucket(chat_id)
+        delay = self._global.delay(now)
+        if bucket is not None:
+            delay = max(delay, bucket.delay(now))
+        return delay, bucket
+
+    async def _acquire(self, chat_id, priority):
+        if not self._waiting:
+            delay, bucket = self._ready(chat_id, time.monotonic())
+            if not delay:
+                self._global.take()
+                if bucket is not None:
+                    bucket.take()
+                self.granted += 1
+                return
+        if self._task is None:
+            # المحدد غير مهيأ (خارج دورة حياة التطبيق)
+            return
+        self.delayed += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, [priority, next(self._seq), chat_id, future])
+        self.max_waiting = max(self.max_waiting, len(self._waiting))
+        self._wakeup.set()
+        await future
+
+    async def _grant_loop(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            wait = None
+            blocked = []
+            while self._waiting:
+                entry = heapq.heappop(self._waiting)
+                future = entry[3]
+                if future.done():
+                    # ألغى صاحب الطلب انتظاره
+                    continue
+                global_delay = self._global.delay(now)
+                if global_delay:
+                    heapq.heappush(self._waiting, entry)
+                    wait = global_delay if wait is None else min(wait, global_delay)
+                    break
+                bucket = self._bucket(entry[2])
+                chat_delay = bucket.delay(now) if bucket is not None else 0.0
+                if chat_delay:
+                    # محادثة مشغولة لا تحجز دور المحادثات الأخرى
+                    blocked.append(entry)
+                    wait = chat_delay if wait is None else min(wait, chat_delay)
+                    continue
+                self._global.take()
+                if bucket is not None:
+                    bucket.take()
+                self.granted += 1
+                future.set_result(None)
+            for entry in blocked:
+                heapq.heappush(self._waiting, entry)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint == 'getUpdates':
+            return await callback(*args, **kwargs)
+        chat_id = data.get('chat_id')
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else NORMAL
+        for attempt in itertools.count():
+            await self._acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retries += 1
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                # 429 لمحادثة يوقف تلك المحادثة فقط، وبدون محادثة يوقف الإرسال كله
+                (self._bucket(chat_id) or self._global).pause(seconds)
+                logger.warning("حد الإرسال في %s (chat=%s)، إعادة المحاولة بعد %s ثانية", endpoint, chat_id, seconds)
+
+    def stats(self):
+        return {
+            'granted': self.granted,
+            'delayed': self.delayed,
+            'waiting': len(self._waiting),
+            'max_waiting': self.max_waiting,
+            'retries': self.retries,
+        }
+
+
+class StatusSlot:
+    __slots__ = ('message_id', 'text', 'reply_markup', 'dirty', 'task', 'updated')
+
+    def __init__(self):
+        self.message_id = None
+        self.text = None
+        self.reply_markup = None
+        self.dirty = False
+        self.task = None
+        self.updated = 0.0
+
+
+class Outbox:
+    # رسالة حالة واحدة لكل (محادثة، مفتاح) تُعدل بدل إرسال رسائل جديدة، والتحديثات المتقاربة تُدمج في تعديل واحد
+    def __init__(self, debounce=None, idle=None):
+        self.debounce = float(os.getenv('OUTBOX_DEBOUNCE', 0.7) if debounce is None else debounce)
+        # مفتاح بلا تحديث لهذه المدة يُحذف (محادثة تُركت دون /done أو /cancel)
+        self.idle = float(os.getenv('OUTBOX_IDLE', 600) if idle is None else idle)
+        self._slots = {}
+        self._tasks = set()
+        self.updates = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.edited = 0
+
+    def status(self, bot, chat_id, key, text, reply_markup=None, message_id=None):
+        # لا ينتظر الإرسال: المعالج يعود فوراً والإرسال يتم في الخلفية.
+        # message_id يربط المفتاح برسالة موجودة لتُعدل بدل إرسال رسالة جديدة
+        slot = self._slots.get((chat_id, key))
+        if slot is None:
+            slot = self._slots[(chat_id, key)] = StatusSlot()
+            slot.message_id = message_id
+        self.updates += 1
+        slot.updated = time.monotonic()
+        slot.text = text
+        slot.reply_markup = reply_markup
+        slot.dirty = True
+        if slot.task is not None:
+            self.coalesced += 1
+            return
+        slot.task = asyncio.create_task(self._flush(bot, chat_id, key, slot))
+        self._tasks.add(slot.task)
+        slot.task.add_done_callback(self._tasks.discard)
+
+    def finish(self, chat_id, key):
+        # التحديث القادم بالمفتاح نفسه يبدأ رسالة جديدة؛ التعديل المعلق يُرسل كما هو
+        self._slots.pop((chat_id, key), None)
+
+    def _drop(self, chat_id, key, slot, idle):
+        # يُحذف المفتاح إذا لم يُحدث منذ idle ثانية؛ التحديث الأحدث يجدول حذفاً خاصاً به
+        if slot.task is None and self._slots.get((chat_id, key)) is slot \
+                and time.monotonic() - slot.updated >= idle:
+            del self._slots[(chat_id, key)]
+
+    async def _flush(self, bot, chat_id, key, slot):
+        idle = self.idle
+        try:
+            # أول رسالة تُرسل فوراً، وما بعدها ينتظر فترة الدمج
+            if slot.message_id is not None:
+                await asyncio.sleep(self.debounce)
+            while slot.dirty:
+                slot.dirty = False
+                await self._deliver(bot, chat_id, slot, slot.text, slot.reply_markup)
+                if slot.dirty:
+                    await asyncio.sleep(self.debounce)
+        except Exception as e:
+            logger.warning("تعذر إرسال رسالة الحالة إلى %s: %s", chat_id, e)
+            # رسالة لا يمكن إرسالها أو تعديلها: لا فائدة من إبقاء مفتاحها
+            idle = 0
+        finally:
+            slot.task = None
+            asyncio.get_running_loop().call_later(idle, self._drop, chat_id, key, slot, idle)
+
+    async def _deliver(self, bot, chat_id, slot, text, reply_markup):
+        if slot.message_id is not None:
+            try:
+                await bot.edit_message_text(
+                    text, chat_id=chat_id, message_id=slot.message_id,
+                    reply_markup=reply_markup, rate_limit_args=LOW
+                )
+                self.edited += 1
+                return
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    return
+                # حذف المستخدم الرسالة أو لم تعد قابلة للتعديل: نرسل واحدة جديدة
+                slot.message_id = None
+        message = await bot.send_message(chat_id, text, reply_markup=reply_markup, rate_limit_args=LOW)
+        slot.message_id = message.message_id
+        self.sent += 1
+
+    async def drain(self, timeout=5):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    def stats(self):
+        return {
+            'slots': len(self._slots),
+            'pending': len(self._tasks),
+            'updates': self.updates,
+            'coalesced': self.coalesced,
+            'sent': self.sent,
+            'edited': self.edited,
+        }
+
+
+# رسائل الحالة المدمجة
+outbox = Outbox()
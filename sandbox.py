@@ -0,0 +1,34 @@
+import os
+import sys
+
+# يضبط حدود الموارد ويتخلى عن صلاحيات المدير ثم يستبدل نفسه بأمر البوت (نفس رقم العملية)
+# نستخدمه بدلاً من preexec_fn لأنه غير آمن مع وجود خيوط في العملية الأم
+LAUNCHER = (
+    "import os, resource, sys\n"
+    "cpu, mem, uid = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])\n"
+    "resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))\n"
+    "resource.setrlimit(resource.RLIMIT_AS, (mem, mem))\n"
+    "os.nice(10)\n"
+    "if uid >= 0:\n"
+    "    os.setgroups([])\n"
+    "    os.setgid(uid)\n"
+    "    os.setuid(uid)\n"
+    "os.execvp(sys.argv[4], sys.argv[4:])\n"
+)
+
+# البيئة وحدها لا تعزل شيئاً: عملية بصلاحيات المدير تقرأ /proc/<pid>/environ للمدير وملف .env
+# وملفات المستخدمين الآخرين. لذلك يعمل كل بوت بحساب خاص به (BOT_UID_BASE + رقم البوت)،
+# وكل عامل مشترك بحساب أول بوت يستضيفه ولا يستضيف إلا بوتات مالكه. يتطلب تشغيل المدير
+# بصلاحيات root، ولا يحتاج إنشاء الحسابات فعلياً في النظام
+DEFAULT_UID_BASE = 100000
+
+
+def uid_base():
+    # -1: بدون تبديل الحساب (ممكن فقط بدون root)
+    return int(os.getenv('BOT_UID_BASE', DEFAULT_UID_BASE if os.geteuid() == 0 else -1))
+
+
+def launcher(cpu_seconds, memory_mb, uid, command):
+    # -1 يعني بدون حد (RLIM_INFINITY)
+    memory = memory_mb * 1024 * 1024 if memory_mb > 0 else -1
+    return [sys.executable, '-S', '-c', LAUNCHER, str(cpu_seconds), str(memory), str(uid), *command]
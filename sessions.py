@@ -0,0 +1,249 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from dotenv import load_dotenv
+
+from cache import TTLCache
+from code_buffer import CodeBuffer
+from database import db
+from metrics import TRANSITIONS
+
+load_dotenv()
+
+
+class Session:
+    # سجل مختصر لحالة محادثة المستخدم
+    __slots__ = ('mode', 'language', 'file_path', 'file_name', 'code', 'totals', 'saved_mode')
+
+    def __init__(self, mode=None, language=None, file_path=None, code=None, totals=None, file_name=None):
+        self.mode = mode
+        self.language = language
+        self.file_path = file_path
+        # اسم الملف كما أرسله المستخدم، ويصبح اسم البوت
+        self.file_name = file_name
+        self.code = code
+        # مجاميع المكتبات المضافة والمرفوضة منذ بداية الإدخال
+        self.totals = totals
+        # المرحلة كما حُفظت آخر مرة: المعالجات تغير mode في الكائن نفسه قبل الحفظ
+        self.saved_mode = None
+
+    def to_record(self):
+        record = {"t": time.time()}
+        if self.mode:
+            record["m"] = self.mode
+        if self.language:
+            record["l"] = self.language
+        if self.file_path:
+            record["f"] = self.file_path
+        if self.file_name:
+            record["o"] = self.file_name
+        if self.code is not None:
+            record["c"] = self.code.to_state()
+        if self.totals:
+            record["n"] = self.totals
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        code = record.get("c")
+        session = cls(
+            mode=record.get("m"),
+            language=record.get("l"),
+            file_path=record.get("f"),
+            code=CodeBuffer.from_state(code) if code else None,
+            totals=record.get("n"),
+            file_name=record.get("o"),
+        )
+        session.saved_mode = session.mode
+        return session
+
+    def close(self, discard=False):
+        if self.code is not None:
+            if discard:
+                self.code.discard()
+            else:
+                self.code.close()
+
+
+class FileSessionBackend:
+    # ملف JSON لكل مستخدم، يُكتب بإعادة تسمية ذرية
+    name = "file"
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv('SESSION_DIR', 'sessions')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.json")
+
+    def _read(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, user_id, record):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".session-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(record, f, separators=(",", ":"))
+        os.replace(tmp_path, self._path(user_id))
+
+    def _remove(self, user_id):
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+
+    def _cleanup(self, before):
+        expired = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") and entry.stat().st_mtime < before:
+                record = self._read(entry.path)
+                os.remove(entry.path)
+                if record:
+                    expired.append(record)
+        return expired
+
+    async def load(self, user_id):
+        return await asyncio.to_thread(self._read, self._path(user_id))
+
+    async def save(self, user_id, record):
+        await asyncio.to_thread(self._write, user_id, record)
+
+    async def delete(self, user_id):
+        await asyncio.to_thread(self._remove, user_id)
+
+    async def cleanup(self, before):
+        return await asyncio.to_thread(self._cleanup, before)
+
+
+class PostgresSessionBackend:
+    # جدول sessions يسمح بمشاركة الجلسات بين أكثر من عملية
+    name = "postgres"
+
+    def __init__(self, database):
+        self.db = database
+
+    async def load(self, user_id):
+        row = await self.db.fetchone('SELECT data FROM sessions WHERE user_id = %s', (user_id,))
+        return row[0] if row else None
+
+    async def save(self, user_id, record):
+        await self.db.execute('''
+            INSERT INTO sessions (user_id, data, updated_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+            data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+        ''', (user_id, json.dumps(record, separators=(",", ":"))))
+
+    async def delete(self, user_id):
+        await self.db.execute('DELETE FROM sessions WHERE user_id = %s', (user_id,))
+
+    async def cleanup(self, before):
+        rows = await self.db.fetchall('''
+            DELETE FROM sessions WHERE updated_at < to_timestamp(%s)::timestamp
+            RETURNING data
+        ''', (before,))
+        return [row[0] for row in rows]
+
+
+class SessionStore:
+    def __init__(self, backend=None, ttl=None, maxsize=None):
+        self.backend = backend
+        self.ttl = ttl or float(os.getenv('SESSION_TTL', 3600))
+        self._cache = TTLCache(
+            maxsize=maxsize or int(os.getenv('SESSION_MAX', 10000)),
+            ttl=self.ttl,
+            on_evict=self._evicted
+        )
+        self._saves = 0
+
+    @staticmethod
+    def _transition(before, after):
+        if before != after:
+            TRANSITIONS.inc(before or "none", after or "none")
+
+    def _evicted(self, user_id, session):
+        # مع التخزين الدائم تبقى الجلسة محفوظة ويمكن تحميلها لاحقاً
+        session.close(discard=self.backend is None)
+
+    async def get(self, user_id):
+        session = self._cache.get(user_id)
+        if session is not None or self.backend is None:
+            return session
+        try:
+            record = await self.backend.load(user_id)
+        except Exception as e:
+            print(f"❌ خطأ في تحميل الجلسة: {e}")
+            return None
+        if not record:
+            return None
+        session = Session.from_record(record)
+        if record.get("t", 0) + self.ttl < time.time():
+            await self.delete(user_id)
+            session.close(discard=True)
+            return None
+        self._cache.set(user_id, session)
+        return session
+
+    async def save(self, user_id, session):
+        # الحفظ يجدد مدة صلاحية الجلسة؛ جلسة أخرى تحل محل القائمة تحذف ملف كودها المؤقت
+        previous = self._cache.pop(user_id)
+        if previous is not None and previous is not session:
+            previous.close(discard=True)
+        self._transition((previous or session).saved_mode, session.mode)
+        session.saved_mode = session.mode
+        self._cache.set(user_id, session)
+        if self.backend is not None:
+            try:
+                await self.backend.save(user_id, session.to_record())
+            except Exception as e:
+                print(f"❌ خطأ في حفظ الجلسة: {e}")
+        self._saves += 1
+        if self._saves % 256 == 0:
+            await self.cleanup()
+
+    async def delete(self, user_id, discard=True):
+        session = self._cache.pop(user_id)
+        if self.backend is not None:
+            try:
+                await self.backend.delete(user_id)
+            except Exception as e:
+                print(f"❌ خطأ في حذف الجلسة: {e}")
+        if session is not None:
+            self._transition(session.saved_mode, None)
+            session.close(discard=discard)
+
+    async def cleanup(self):
+        self._cache.expire()
+        if self.backend is None:
+            return
+        try:
+            expired = await self.backend.cleanup(time.time() - self.ttl)
+        except Exception as e:
+            print(f"❌ خطأ في تنظيف الجلسات: {e}")
+            return
+        for record in expired:
+            Session.from_record(record).close(discard=True)
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats['live'] = stats.pop('size')
+        stats['backend'] = self.backend.name if self.backend else "memory"
+        return stats
+
+
+def create_session_store():
+    backend = os.getenv('SESSION_BACKEND', 'memory')
+    if backend == 'file':
+        return SessionStore(FileSessionBackend())
+    if backend == 'postgres':
+        return SessionStore(PostgresSessionBackend(db))
+    return SessionStore()
+
+
+# مخزن جلسات المحادثة
+sessions = create_session_store()
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+from dotenv import load_dotenv
+
+from dispatcher import PerUserUpdateProcessor
+from metrics import METRICS_PORT, MetricsServer, registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# عدد عمليات المعالجة؛ 1 يعني عملية واحدة تستقبل التحديثات وتعالجها بنفسها
+SHARDS = max(int(os.getenv('SHARDS', 1)), 1)
+# رقم عملية المعالجة الحالية؛ لا يُضبط في العملية الأمامية ولا بدون تجزئة
+SHARD_INDEX = int(os.environ['SHARD_INDEX']) if os.getenv('SHARD_INDEX') else None
+# المهام العامة (تجهيز المكتبات، تصحيح العدادات) تعمل في عملية واحدة فقط
+PRIMARY = not SHARD_INDEX
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+
+
+def shard_of(user_id, shards=SHARDS):
+    return (user_id or 0) % shards
+
+
+def owns(user_id):
+    # بوتات المستخدم تُشغَّل وتُستعاد في العملية التي تعالج تحديثاته
+    return SHARD_INDEX is None or shard_of(user_id) == SHARD_INDEX
+
+
+class Shard:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.watcher = None
+        self.routed = 0
+        self.lost = 0
+        self.restarts = 0
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+
+class ShardRouter(BaseUpdateProcessor):
+    # العملية الأمامية: كل تحديث يُرسل سطر JSON إلى عملية المعالجة الخاصة بمستخدمه،
+    # فتبقى حالة محادثة كل مستخدم في عملية واحدة
+    def __init__(self, shards=None, command=None, env=None, stop_timeout=None):
+        # التوجيه متسلسل ليحفظ ترتيب التحديثات، والمعالجة المتوازية تتم داخل كل عملية
+        super().__init__(1)
+        self.shards = [Shard(index) for index in range(shards or SHARDS)]
+        self.command = command or [sys.executable, BOT_SCRIPT]
+        self.env = env
+        self.stop_timeout = stop_timeout or float(os.getenv('DRAIN_TIMEOUT', 30))
+        self._stopping = False
+
+    async def _spawn(self, shard):
+        env = dict(self.env or os.environ, SHARDS=str(len(self.shards)), SHARD_INDEX=str(shard.index))
+        shard.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            env=env,
+            stdin=asyncio.subprocess.PIPE,
+            # الإيقاف يتم بإغلاق stdin بعد تفريغ التحديثات، وليس بإشارة Ctrl+C
+            start_new_session=True,
+        )
+        logger.info("تم تشغيل عملية المعالجة %s (pid=%s)", shard.index, shard.process.pid)
+
+    async def _watch(self, shard):
+        while True:
+            code = await shard.process.wait()
+            if self._stopping:
+                return
+            shard.restarts += 1
+            logger.error("توقفت عملية المعالجة %s (code=%s)، إعادة تشغيلها", shard.index, code)
+            await asyncio.sleep(1)
+            try:
+                await self._spawn(shard)
+            except OSError as e:
+                logger.error("تعذر تشغيل عملية المعالجة %s: %s", shard.index, e)
+
+    async def initialize(self):
+        self._stopping = False
+        await asyncio.gather(*(self._spawn(shard) for shard in self.shards))
+        for shard in self.shards:
+            shard.watcher = asyncio.create_task(self._watch(shard))
+
+    async def do_process_update(self, update, coroutine):
+        # التطبيق الأمامي بلا معالجات فلا حاجة لتنفيذ المعالجة هنا
+        coroutine.close()
+        shard = self.shards[shard_of(PerUserUpdateProcessor._key(update), len(self.shards))]
+        try:
+            shard.process.stdin.write((json.dumps(update.to_dict()) + '\n').encode())
+            # امتلاء الأنبوبة يبطئ الاستقبال بدل تكديس التحديثات في الذاكرة
+            await shard.process.stdin.drain()
+            shard.routed += 1
+        except (BrokenPipeError, ConnectionResetError):
+            shard.lost += 1
+            logger.warning("فُقد التحديث %s: عملية المعالجة %s متوقفة", update.update_id, shard.index)
+
+    async def _close(self, shard):
+        if not shard.alive:
+            return
+        # إغلاق stdin يطلب من العملية معالجة ما وصلها ثم الإيقاف
+        shard.process.stdin.close()
+        try:
+            await asyncio.wait_for(shard.process.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("عملية المعالجة %s لم تتوقف خلال %s ثانية", shard.index, self.stop_timeout)
+            shard.process.kill()
+            await shard.process.wait()
+
+    async def shutdown(self):
+        self._stopping = True
+        await asyncio.gather(*(self._close(shard) for shard in self.shards))
+        for shard in self.shards:
+            if shard.watcher is not None:
+                shard.watcher.cancel()
+        await asyncio.gather(*(shard.watcher for shard in self.shards if shard.watcher), return_exceptions=True)
+
+    def stats(self):
+        return {
+            'shards': len(self.shards),
+            'alive': sum(shard.alive for shard in self.shards),
+            'routed': sum(shard.routed for shard in self.shards),
+            'lost': sum(shard.lost for shard in self.shards),
+            'restarts': sum(shard.restarts for shard in self.shards),
+        }
+
+
+async def _front_post_init(application: Application):
+    if METRICS_PORT:
+        registry.add_collector("bot_shards", application.update_processor.stats)
+        application.bot_data["metrics_server"] = MetricsServer()
+        await application.bot_data["metrics_server"].start()
+
+
+async def _front_post_shutdown(application: Application):
+    if "metrics_server" in application.bot_data:
+        await application.bot_data["metrics_server"].stop()
+
+
+def build_front(token=None, shards=None, command=None, env=None, request=None):
+    # تطبيق بلا معالجات: يستقبل التحديثات (استطلاع أو ويب هوك) ويوزعها فقط
+    builder = (
+        Application.builder()
+        .token(token or os.getenv("BOT_TOKEN"))
+        .concurrent_updates(ShardRouter(shards, command, env))
+        .post_init(_front_post_init)
+        .post_shutdown(_front_post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    return builder.build()
+
+
+async def run_shard(application):
+    # عملية معالجة: التحديثات تصل أسطر JSON على stdin بدل الاستطلاع أو الويب هوك
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=4 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    loop.add_signal_handler(signal.SIGTERM, reader.feed_eof)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.start()
+        while line := await reader.readline():
+            await application.update_queue.put(Update.de_json(json.loads(line), application.bot))
+    finally:
+        # معالجة كل ما وصل من العملية الأمامية قبل الإيقاف
+        if application.running:
+            await application.update_queue.join()
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
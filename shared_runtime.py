@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import os
+from dotenv import load_dotenv
+
+from botlogs import loghub
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared_worker.py')
+
+
+def is_eligible(file_path):
+    # يكفي البوتات المبنية على python-telegram-bot والتي تنتهي بـ run_polling؛
+    # ما عداها (حلقات خاصة، webhook) يعمل في عملية مستقلة كالمعتاد
+    try:
+        with open(file_path, encoding='utf-8', errors='replace') as f:
+            source = f.read()
+    except OSError:
+        return False
+    return (
+        'telegram.ext' in source
+        and 'run_polling' in source
+        and 'run_webhook' not in source
+        and 'asyncio.run(' not in source
+    )
+
+
+class SharedWorker:
+    def __init__(self, index, owner, uid):
+        self.index = index
+        # صاحب كل البوتات في هذا العامل، والحساب الذي يعمل به (-1 بدون تبديل)
+        self.owner = owner
+        self.uid = uid
+        self.process = None
+        self.reader_task = None
+        # bot_id -> BotProcess المستضاف في هذا العامل
+        self.bots = {}
+        self.rss = 0
+        self.rss_deltas = {}
+        self.ready = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def spawn(self, command, env, cwd):
+        self.ready = asyncio.get_running_loop().create_future()
+        self.process = await asyncio.create_subprocess_exec(
+            *command, WORKER_SCRIPT,
+            cwd=cwd,
+            env=env,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            # مخرجات العامل نفسه فقط؛ مخرجات البوتات تصل كأحداث log
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True,
+            # حدث log قد يحمل حتى LOG_FLUSH_BYTES من مخرجات بوت في سطر واحد
+            limit=4 * 1024 * 1024,
+        )
+        self.reader_task = asyncio.create_task(self._read())
+        try:
+            await asyncio.wait_for(asyncio.shield(self.ready), 30)
+        except (Exception, asyncio.CancelledError):
+            # عامل لم يجهز (انتهت المهلة أو توقف أو أُلغي التحميل) لا يبقى معلقاً بلا مالك
+            await self._abort()
+            raise
+
+    async def _abort(self):
+        self.ready.cancel()
+        if self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        self.reader_task.cancel()
+        await asyncio.gather(self.reader_task, return_exceptions=True)
+
+    async def _send(self, **command):
+        self.process.stdin.write((json.dumps(command) + '\n').encode())
+        await self.process.stdin.drain()
+
+    def reserve(self, bp):
+        # يُسجل البوت عند اختيار العامل، فلا يُغلق العامل الفارغ قبل وصول أمر التشغيل
+        bp.exited = asyncio.get_running_loop().create_future()
+        bp.worker = self
+        self.bots[bp.bot_id] = bp
+
+    async def load(self, bp, path):
+        if not self.alive:
+            self._finish(bp.bot_id, "توقف العامل المشترك قبل تشغيل البوت")
+            return
+        await self._send(op='start', id=bp.bot_id, path=os.path.abspath(path), token=bp.token)
+
+    async def unload(self, bp, timeout=10):
+        if bp.bot_id in self.bots and self.alive:
+            await self._send(op='stop', id=bp.bot_id)
+            await asyncio.wait({bp.exited}, timeout=timeout)
+
+    def _finish(self, bot_id, error):
+        bp = self.bots.pop(bot_id, None)
+        self.rss_deltas.pop(bot_id, None)
+        if bp is not None and not bp.exited.done():
+            bp.exited.set_result(error)
+
+    async def _read(self):
+        async for line in self.process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            kind = event.get('event')
+            if kind == 'ready':
+                self.rss = event['rss']
+                if not self.ready.done():
+                    self.ready.set_result(None)
+            elif kind == 'started':
+                self.rss_deltas[event['id']] = event['rss_delta']
+            elif kind == 'log':
+                loghub.feed(event['id'], event['stream'], event['data'])
+            elif kind == 'exited':
+                self._finish(event['id'], event.get('error'))
+            elif kind == 'stats':
+                self.rss = event['rss']
+                self.rss_deltas.update({int(k): v for k, v in event['bots'].items()})
+        # انتهت العملية: كل بوتاتها تُعامل كبوتات توقفت ويعيد المشرف تشغيلها
+        await self.process.wait()
+        if not self.ready.done():
+            self.ready.set_exception(RuntimeError("توقف العامل المشترك قبل أن يجهز"))
+        for bot_id in list(self.bots):
+            self._finish(bot_id, f"توقف العامل المشترك (code={self.process.returncode})")
+
+    async def close(self, timeout=10):
+        if not self.alive:
+            return
+        # إغلاق stdin يطلب من العامل إيقاف بوتاته والخروج
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+        if self.reader_task is not None:
+            await asyncio.gather(self.reader_task, return_exceptions=True)
+
+
+class SharedRuntime:
+    # يوزع بوتات كل مستخدم على عمليات مشتركة خاصة به، الأقل حملاً أولاً؛
+    # بوتات مستخدمين مختلفين لا تجتمع في عملية واحدة (انظر shared_worker.py)
+    def __init__(self, launch, stage=None, workers=None):
+        # launch(bp) يعيد (الأمر، البيئة، المجلد، الحساب) لعامل جديد أول بوتاته bp
+        self.launch = launch
+        # stage(bp, uid) ينسخ ملف البوت إلى حيث يقرؤه حساب العامل ويعيد مساره
+        self.stage = stage
+        self.max_workers = workers or int(os.getenv('SHARED_WORKERS', 1))
+        # المستخدم -> عماله
+        self.workers = {}
+        self._index = 0
+        # المستخدم -> [القفل، عدد من ينتظره]: تشغيل عامل لمستخدم (حتى 30 ثانية) لا يؤخر غيره،
+        # ويُحذف القفل عندما لا يستخدمه أحد
+        self._locks = {}
+
+    async def _pick(self, bp):
+        entry = self._locks.setdefault(bp.user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._pick_locked(bp)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[bp.user_id]
+
+    async def _pick_locked(self, bp):
+        workers = [worker for worker in self.workers.get(bp.user_id, ()) if worker.alive]
+        if len(workers) < self.max_workers:
+            command, env, cwd, uid = await asyncio.to_thread(self.launch, bp)
+            self._index += 1
+            worker = SharedWorker(self._index, bp.user_id, uid)
+            await worker.spawn(command, env, cwd)
+            logger.info(
+                "تم تشغيل العامل المشترك %s للمستخدم %s (pid=%s)", worker.index, bp.user_id, worker.process.pid
+            )
+        else:
+            worker = min(workers, key=lambda worker: len(worker.bots))
+        # القائمة كما هي الآن: unload قد يحذف عاملاً منها أثناء التشغيل
+        self.workers[bp.user_id] = [
+            other for other in self.workers.get(bp.user_id, ()) if other.alive and other is not worker
+        ] + [worker]
+        worker.reserve(bp)
+        return worker
+
+    async def load(self, bp):
+        worker = await self._pick(bp)
+        path = bp.file_path
+        if self.stage is not None and worker.uid >= 0:
+            try:
+                path = await asyncio.to_thread(self.stage, bp, worker.uid)
+            except Exception:
+                worker.bots.pop(bp.bot_id, None)
+                raise
+        await worker.load(bp, path)
+
+    async def unload(self, bp):
+        worker = bp.worker
+        if worker is None:
+            return
+        await worker.unload(bp)
+        # عامل بلا بوتات لا يبقى مشغولاً بانتظار بوتات صاحبه
+        if not worker.bots:
+            # يُحذف من القائمة قبل الإغلاق حتى لا يختاره تحميل جديد أثناء إغلاقه
+            workers = [other for other in self.workers.get(worker.owner, ()) if other is not worker]
+            if workers:
+                self.workers[worker.owner] = workers
+            else:
+                self.workers.pop(worker.owner, None)
+            await worker.close()
+
+    def _all(self):
+        return [worker for workers in self.workers.values() for worker in workers]
+
+    def memory(self):
+        # ذاكرة العامل موزعة على بوتاته: ما زاد عند تحميل كل بوت + حصة متساوية من الأساس
+        per_bot = {}
+        for worker in self._all():
+            if not worker.alive or not worker.bots:
+                continue
+            deltas = {bot_id: worker.rss_deltas.get(bot_id, 0) for bot_id in worker.bots}
+            base = max(worker.rss - sum(deltas.values()), 0) / len(deltas)
+            for bot_id, delta in deltas.items():
+                per_bot[bot_id] = int(base + delta)
+        return per_bot
+
+    async def close(self):
+        await asyncio.gather(*(worker.close() for worker in self._all()))
+        self.workers = {}
+
+    def stats(self):
+        alive = [worker for worker in self._all() if worker.alive]
+        return {
+            'workers': len(alive),
+            'hosted': sum(len(worker.bots) for worker in alive),
+            'workers_rss_bytes': sum(worker.rss for worker in alive),
+        }
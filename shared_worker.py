@@ -0,0 +1,268 @@
+# عملية عاملة تستضيف عدة بوتات python-telegram-bot في حلقة أحداث واحدة.
+# تُشغَّل من shared_runtime ولا يستوردها البوت الرئيسي: الأوامر تصل أسطر JSON
+# على stdin والأحداث تُكتب أسطر JSON على stdout الأصلي.
+# لا عزل بين البوتات داخل العامل: كل بوت يصل إلى توكنات غيره وذاكرتهم، وos._exit أو استدعاء
+# معطِّل في أحدها يوقف الجميع؛ لذلك لا يستضيف العامل إلا بوتات مستخدم واحد
+import asyncio
+import contextvars
+import json
+import os
+import runpy
+import sys
+import time
+import traceback
+
+from telegram.ext import Application, ApplicationBuilder
+
+# البوت الذي ينفذ الكود حالياً؛ المهام التي ينشئها البوت ترث قيمته
+current_bot = contextvars.ContextVar('current_bot', default=None)
+
+_original_build = ApplicationBuilder.build
+_original_run_polling = Application.run_polling
+_original_run_webhook = Application.run_webhook
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError):
+        return 0
+
+
+# أقصى ما يُحتفظ به من مخرجات بوت واحد بين دفعتي إرسال؛ الزائد يُهمل ويُعد
+LOG_FLUSH_BYTES = int(os.getenv('LOG_FLUSH_BYTES', 64 * 1024))
+
+
+class HostedBot:
+    __slots__ = (
+        'bot_id', 'path', 'token', 'applications', 'task', 'stopping', 'rss_delta',
+        'output', 'output_size', 'dropped'
+    )
+
+    def __init__(self, bot_id, path, token):
+        self.bot_id = bot_id
+        self.path = path
+        self.token = token
+        # (التطبيق، إعدادات run_polling)
+        self.applications = []
+        self.task = None
+        self.stopping = asyncio.Event()
+        self.rss_delta = 0
+        self.output = []
+        self.output_size = 0
+        self.dropped = 0
+
+
+class BotOutput:
+    # بديل sys.stdout/sys.stderr: الكتابة تذهب إلى سجل البوت صاحب السياق الحالي
+    def __init__(self, stream, fallback):
+        self.stream = stream
+        self.fallback = fallback
+
+    def write(self, data):
+        bot = current_bot.get()
+        if bot is None:
+            return self.fallback.write(data)
+        if bot.output_size + len(data) > LOG_FLUSH_BYTES:
+            bot.dropped += len(data)
+        else:
+            bot.output.append((self.stream, data))
+            bot.output_size += len(data)
+        return len(data)
+
+    def flush(self):
+        self.fallback.flush()
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.fallback.fileno()
+
+    @property
+    def encoding(self):
+        return self.fallback.encoding
+
+
+def _build(builder):
+    # كل بوت يستخدم توكنه المسجل مهما كان التوكن المكتوب في كوده، إلا إذا مرر كائن Bot جاهزاً
+    bot = current_bot.get()
+    if bot is not None:
+        try:
+            builder.token(bot.token)
+        except RuntimeError:
+            pass
+    return _original_build(builder)
+
+
+def _run_polling(application, poll_interval=0.0, timeout=10, bootstrap_retries=-1,
+                 allowed_updates=None, drop_pending_updates=None, **kwargs):
+    bot = current_bot.get()
+    if bot is None:
+        return _original_run_polling(
+            application, poll_interval, timeout, bootstrap_retries,
+            allowed_updates=allowed_updates, drop_pending_updates=drop_pending_updates, **kwargs
+        )
+    # بدل حلقة أحداث خاصة، يُشغَّل التطبيق في حلقة العامل بعد انتهاء تحميل الملف
+    bot.applications.append((application, {
+        'poll_interval': poll_interval,
+        'timeout': timeout,
+        'bootstrap_retries': bootstrap_retries,
+        'allowed_updates': allowed_updates,
+        'drop_pending_updates': drop_pending_updates,
+    }))
+
+
+def _run_webhook(application, *args, **kwargs):
+    if current_bot.get() is None:
+        return _original_run_webhook(application, *args, **kwargs)
+    raise RuntimeError("run_webhook غير مدعوم في الاستضافة المشتركة")
+
+
+ApplicationBuilder.build = _build
+Application.run_polling = _run_polling
+Application.run_webhook = _run_webhook
+
+
+class Worker:
+    def __init__(self, out):
+        self.out = out
+        self.bots = {}
+
+    def emit(self, event, **fields):
+        self.out.write(json.dumps({'event': event, **fields}, ensure_ascii=False) + '\n')
+        self.out.flush()
+
+    def start(self, bot_id, path, token):
+        if bot_id in self.bots:
+            return
+        bot = self.bots[bot_id] = HostedBot(bot_id, path, token)
+        bot.task = asyncio.create_task(self._host(bot))
+
+    def stop(self, bot_id):
+        bot = self.bots.get(bot_id)
+        if bot is not None:
+            bot.stopping.set()
+
+    def _load(self, bot):
+        # تحميل الملف متزامن، فلا يتداخل مع تحميل بوت آخر؛ التوكن في البيئة أثناء التحميل فقط
+        saved = {key: os.environ.get(key) for key in ('BOT_TOKEN', 'TELEGRAM_BOT_TOKEN')}
+        saved_argv = sys.argv
+        os.environ['BOT_TOKEN'] = os.environ['TELEGRAM_BOT_TOKEN'] = bot.token
+        sys.argv = [bot.path]
+        try:
+            runpy.run_path(bot.path, run_name='__main__')
+        finally:
+            sys.argv = saved_argv
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    async def _host(self, bot):
+        # لكل مهمة نسخة سياق خاصة، فالقيمة تخص هذا البوت وما ينشئه من مهام
+        current_bot.set(bot)
+        error = None
+        started = []
+        before = rss()
+        try:
+            self._load(bot)
+            if not bot.applications:
+                raise RuntimeError("لم يستدعِ البوت run_polling")
+            for application, polling in bot.applications:
+                await application.initialize()
+                started.append(application)
+                if application.post_init:
+                    await application.post_init(application)
+                await application.updater.start_polling(**polling)
+                await application.start()
+            bot.rss_delta = max(rss() - before, 0)
+            self.emit('started', id=bot.bot_id, rss_delta=bot.rss_delta)
+            await bot.stopping.wait()
+        except (Exception, SystemExit) as e:
+            error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            traceback.print_exc()
+        finally:
+            for application in reversed(started):
+                try:
+                    if application.updater.running:
+                        await application.updater.stop()
+                    if application.running:
+                        await application.stop()
+                    if application.post_stop:
+                        await application.post_stop(application)
+                    await application.shutdown()
+                    if application.post_shutdown:
+                        await application.post_shutdown(application)
+                except Exception:
+                    traceback.print_exc()
+            self.flush_output()
+            self.bots.pop(bot.bot_id, None)
+            self.emit('exited', id=bot.bot_id, error=error)
+
+    def flush_output(self):
+        for bot in list(self.bots.values()):
+            if bot.dropped:
+                bot.output.append(('sys', f"[تم تجاهل {bot.dropped} بايت من المخرجات]\n"))
+                bot.dropped = 0
+            if not bot.output:
+                continue
+            # دمج الأجزاء المتتالية من المجرى نفسه في حدث واحد
+            merged = []
+            for stream, data in bot.output:
+                if merged and merged[-1][0] == stream:
+                    merged[-1][1].append(data)
+                else:
+                    merged.append((stream, [data]))
+            bot.output = []
+            bot.output_size = 0
+            for stream, parts in merged:
+                self.emit('log', id=bot.bot_id, stream=stream, data=''.join(parts))
+
+    async def pump_output(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.flush_output()
+
+    async def report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.emit('stats', rss=rss(), bots={bot.bot_id: bot.rss_delta for bot in self.bots.values()})
+
+
+async def main():
+    # قناة الأوامر هي stdout الأصلي؛ مخرجات البوتات تذهب إلى stderr
+    out = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    os.dup2(2, 1)
+    sys.stdout = BotOutput('out', sys.__stderr__)
+    sys.stderr = BotOutput('err', sys.__stderr__)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    worker = Worker(out)
+    reporter = asyncio.create_task(worker.report(float(os.getenv('SHARED_STATS_INTERVAL', 15))))
+    output = asyncio.create_task(worker.pump_output(0.2))
+    worker.emit('ready', pid=os.getpid(), rss=rss(), time=time.time())
+    while line := await reader.readline():
+        command = json.loads(line)
+        if command['op'] == 'start':
+            worker.start(command['id'], command['path'], command['token'])
+        elif command['op'] == 'stop':
+            worker.stop(command['id'])
+
+    # أُغلق stdin: العملية الأم انتهت أو طلبت الإيقاف
+    reporter.cancel()
+    output.cancel()
+    for bot in list(worker.bots.values()):
+        bot.stopping.set()
+    await asyncio.gather(*(bot.task for bot in list(worker.bots.values())), return_exceptions=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import tempfile
+import httpx
+from dotenv import load_dotenv
+
+from cache import TTLCache
+
+load_dotenv()
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class BlobStore:
+    # كل محتوى يُخزن مرة واحدة باسم بصمته (sha256)، ومسارات المستخدمين روابط رمزية إليه
+    def __init__(self, root=None, max_size=None, chunk_size=64 * 1024):
+        self.root = root or os.getenv('BLOB_DIR', os.path.join('bots', '.blobs'))
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        self.max_size = max_size or int(os.getenv('UPLOAD_MAX_BYTES', 5 * 1024 * 1024))
+        self.chunk_size = chunk_size
+        # file_unique_id من تيليجرام -> البصمة، لتجنب إعادة تنزيل ملف معروف
+        self._known = TTLCache(maxsize=int(os.getenv('BLOB_INDEX_SIZE', 50000)), ttl=7 * 24 * 3600)
+        self._client = None
+        self.uploads = 0
+        self.dedup_hits = 0
+        self.bytes_written = 0
+        self.bytes_saved = 0
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    async def store_document(self, document):
+        # يعيد البصمة فقط؛ الرابط يُنشأ باسم يتضمنها (link) حتى لا يُعاد توجيه رابط بوت قائم
+        if document.file_size and document.file_size > self.max_size:
+            raise UploadTooLarge(document.file_size)
+        self.uploads += 1
+        digest = self._known.get(document.file_unique_id)
+        if digest is not None and os.path.exists(self.blob_path(digest)):
+            self.dedup_hits += 1
+            self.bytes_saved += document.file_size or 0
+        else:
+            file = await document.get_file()
+            digest = await self._download(file.file_path)
+            self._known.set(document.file_unique_id, digest)
+        return digest
+
+    async def _chunks(self, source):
+        if source.startswith(('http://', 'https://')):
+            if self._client is None:
+                self._client = httpx.AsyncClient(timeout=60)
+            async with self._client.stream('GET', source) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    yield chunk
+        else:
+            # خادم Bot API محلي يعيد مساراً على القرص
+            with open(source, 'rb') as f:
+                while chunk := f.read(self.chunk_size):
+                    yield chunk
+
+    async def _download(self, source):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                async for chunk in self._chunks(source):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLarge(size)
+                    hasher.update(chunk)
+                    out.write(chunk)
+            digest = hasher.hexdigest()
+            self._commit(tmp_path, digest, size)
+            return digest
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _commit(self, tmp_path, digest, size):
+        final_path = self.blob_path(digest)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            self.dedup_hits += 1
+            self.bytes_saved += size
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+            self.bytes_written += size
+
+    def store_file(self, source, link_path):
+        # نسخة متزامنة لملف مفتوح (مثل عضو في أرشيف)، تُستدعى من خيط منفصل
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while chunk := source.read(self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLarge(size)
+                    hasher.update(chunk)
+                    out.write(chunk)
+            digest = hasher.hexdigest()
+            self._commit(tmp_path, digest, size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.link(digest, link_path)
+        return digest
+
+    async def save_document(self, document, path, max_size):
+        # ملف لا يُحفظ في المخزن (مثل أرشيف الاستيراد): يُنزل كما هو إلى path على دفعات
+        if document.file_size and document.file_size > max_size:
+            raise UploadTooLarge(document.file_size)
+        file = await document.get_file()
+        size = 0
+        with open(path, 'wb') as out:
+            async for chunk in self._chunks(file.file_path):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(size)
+                out.write(chunk)
+        return size
+
+    def link(self, digest, link_path):
+        # رابط رمزي نسبي يُستبدل بشكل ذري
+        target = os.path.relpath(self.blob_path(digest), os.path.dirname(os.path.abspath(link_path)))
+        tmp_link = f"{link_path}.{os.getpid()}.tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(target, tmp_link)
+        os.replace(tmp_link, link_path)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {
+            'uploads': self.uploads,
+            'dedup_hits': self.dedup_hits,
+            'bytes_written': self.bytes_written,
+            'bytes_saved': self.bytes_saved,
+        }
+
+
+# مخزن الملفات المرفوعة
+blob_store = BlobStore()
@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import sys
+import time
+from dotenv import load_dotenv
+
+from botlogs import loghub
+from database import db
+from installer import installer
+from sandbox import launcher, uid_base
+from shared_runtime import SharedRuntime, is_eligible
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# متغيرات البيئة المسموح بتمريرها للبوتات (لا نمرر أسرار البوت الرئيسي)
+INHERITED_ENV = ('PATH', 'LANG', 'LC_ALL', 'TZ')
+
+
+class BotProcess:
+    __slots__ = (
+        'bot_id', 'user_id', 'language', 'file_path', 'token',
+        'process', 'task', 'restarts', 'started_at', 'startup_time', 'stopping',
+        'shared', 'worker', 'exited', 'pumps'
+    )
+
+    def __init__(self, bot_id, user_id, language, file_path, token):
+        self.bot_id = bot_id
+        self.user_id = user_id
+        self.language = language
+        self.file_path = file_path
+        self.token = token
+        self.process = None
+        self.task = None
+        self.restarts = 0
+        self.started_at = None
+        self.startup_time = None
+        self.stopping = False
+        # في الوضع المشترك: العامل المستضيف و future يكتمل برسالة الخطأ عند توقف البوت
+        self.shared = False
+        self.worker = None
+        self.exited = None
+        # مهام قراءة stdout/stderr إلى مخزن السجلات
+        self.pumps = ()
+
+    @property
+    def running(self):
+        if self.shared:
+            return self.exited is not None and not self.exited.done()
+        return self.process is not None and self.process.returncode is None
+
+
+class BotSupervisor:
+    def __init__(self, database, cpu_seconds=None, memory_mb=None, max_restarts=None,
+                 backoff_base=None, backoff_max=None):
+        self.db = database
+        self.cpu_seconds = cpu_seconds or int(os.getenv('BOT_CPU_SECONDS', 3600))
+        self.memory_mb = memory_mb or int(os.getenv('BOT_MEMORY_MB', 512))
+        self.max_restarts = max_restarts or int(os.getenv('BOT_MAX_RESTARTS', 5))
+        self.backoff_base = backoff_base or float(os.getenv('BOT_BACKOFF_BASE', 1))
+        self.backoff_max = backoff_max or float(os.getenv('BOT_BACKOFF_MAX', 300))
+        # إذا استمر البوت هذه المدة نعتبره مستقراً ونصفّر عداد إعادة التشغيل
+        self.stable_after = 60
+        # process: عملية لكل بوت، shared: بوتات python-telegram-bot المؤهلة تتشارك عمليات قليلة
+        self.hosting_mode = os.getenv('HOSTING_MODE', 'process')
+        # حساب كل بوت BOT_UID_BASE + رقمه (انظر sandbox.py)، و-1 بدون تبديل الحساب
+        self.uid_base = uid_base()
+        # مجلد عمل خاص بكل حساب بوت، فيه نسخة من ملفه وما يكتبه أثناء التشغيل
+        self.home_dir = os.path.abspath(os.getenv('BOT_HOME_DIR', os.path.join('bots', '.home')))
+        if self.uid_base >= 0 and os.path.exists('.env') and os.stat('.env').st_mode & 0o044:
+            logger.warning("ملف .env مقروء لحسابات البوتات؛ نفّذ chmod 600 .env")
+        elif self.uid_base < 0:
+            logger.warning(
+                "البوتات المستضافة تعمل بحساب المدير نفسه ويمكنها قراءة أسراره (DATABASE_URL وتوكنات البوتات)؛ "
+                "شغّل المدير بصلاحيات root مع BOT_UID_BASE أو داخل حاوية"
+            )
+        self.runtime = None
+        if self.hosting_mode == 'shared':
+            self.runtime = SharedRuntime(self._shared_launch, self._stage if self.uid_base >= 0 else None)
+        self.processes = {}
+        self.total_restarts = 0
+        self.reaped = 0
+
+    def _python(self):
+        # البوتات تعمل داخل البيئة المشتركة للمكتبات إن وُجدت
+        if os.path.exists(installer.python_bin):
+            return os.path.abspath(installer.python_bin)
+        return sys.executable
+
+    def _uid(self, bp):
+        return self.uid_base + bp.bot_id if self.uid_base >= 0 else -1
+
+    def _home(self, uid):
+        # المجلد الأب قابل للعبور وليس للسرد، وكل مجلد لا يفتحه إلا حسابه
+        os.makedirs(self.home_dir, exist_ok=True)
+        os.chmod(self.home_dir, 0o711)
+        home = os.path.join(self.home_dir, str(uid))
+        os.makedirs(home, exist_ok=True)
+        os.chown(home, uid, uid)
+        os.chmod(home, 0o700)
+        return home
+
+    def _stage(self, bp, uid):
+        # الملفات المرفوعة لا يقرؤها إلا المدير (0600)، فيُنسخ ملف البوت إلى مجلد حسابه
+        home = self._home(uid)
+        staged = os.path.join(home, f"bot_{bp.bot_id}{os.path.splitext(bp.file_path)[1]}")
+        tmp_path = f"{staged}.tmp"
+        shutil.copyfile(bp.file_path, tmp_path)
+        os.chown(tmp_path, uid, uid)
+        os.replace(tmp_path, staged)
+        return staged
+
+    def _command(self, bp, file_path):
+        # مسارات مطلقة لأن العملية تبدأ داخل مجلد البوت
+        file_path = os.path.abspath(file_path)
+        if bp.language == "python":
+            command = [self._python(), '-u', file_path]
+        else:
+            command = ['php']
+            if os.path.exists(installer.php_autoload):
+                command += ['-d', f'auto_prepend_file={os.path.abspath(installer.php_autoload)}']
+            command.append(file_path)
+        return launcher(self.cpu_seconds, self.memory_mb, self._uid(bp), command)
+
+    def _env(self, bp, token=True):
+        env = {key: os.environ[key] for key in INHERITED_ENV if key in os.environ}
+        env['PYTHONUNBUFFERED'] = '1'
+        if self.uid_base >= 0:
+            env['HOME'] = os.path.join(self.home_dir, str(self._uid(bp)))
+        # العامل المشترك يستلم توكن كل بوت مع أمر تشغيله وليس من البيئة
+        if token:
+            env['BOT_TOKEN'] = env['TELEGRAM_BOT_TOKEN'] = bp.token
+        return env
+
+    def _shared_launch(self, bp):
+        # عامل مشترك لمالك bp وحده، بحساب أول بوت يستضيفه؛ باقي بوتات المالك تُنسخ إلى مجلده
+        uid = self._uid(bp)
+        cwd = self._home(uid) if uid >= 0 else os.path.abspath(os.getenv('BOTS_DIR', 'bots'))
+        command = launcher(
+            int(os.getenv('SHARED_CPU_SECONDS', -1)), int(os.getenv('SHARED_MEMORY_MB', 2048)),
+            uid, [self._python(), '-u']
+        )
+        return command, self._env(bp, token=False), cwd, uid
+
+    async def _spawn(self, bp):
+        started = time.perf_counter()
+        if bp.shared:
+            await self.runtime.load(bp)
+            bp.startup_time = time.perf_counter() - started
+            bp.started_at = time.monotonic()
+            return
+        uid = self._uid(bp)
+        if uid >= 0:
+            file_path = await asyncio.to_thread(self._stage, bp, uid)
+        else:
+            file_path = bp.file_path
+        bp.process = await asyncio.create_subprocess_exec(
+            *self._command(bp, file_path),
+            cwd=os.path.dirname(os.path.abspath(file_path)),
+            env=self._env(bp),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # مجموعة عمليات مستقلة حتى نوقف البوت مع أي عمليات فرعية أنشأها
+            start_new_session=True,
+        )
+        bp.pumps = (
+            asyncio.create_task(loghub.pump(bp.bot_id, bp.process.stdout, 'out')),
+            asyncio.create_task(loghub.pump(bp.bot_id, bp.process.stderr, 'err')),
+        )
+        bp.startup_time = time.perf_counter() - started
+        bp.started_at = time.monotonic()
+
+    async def _wait(self, bp):
+        # رمز الخروج للعملية المستقلة، أو رسالة الخطأ من العامل المشترك
+        if bp.shared:
+            return await bp.exited
+        returncode = await bp.process.wait()
+        # آخر ما كتبه البوت (مثل traceback) يصل إلى السجل قبل إعادة التشغيل
+        await asyncio.wait(bp.pumps, timeout=1)
+        return returncode
+
+    def _backoff(self, restarts):
+        return min(self.backoff_base * (2 ** (restarts - 1)), self.backoff_max)
+
+    async def start(self, bot_id, user_id, language, file_path, token):
+        # المكان محجوز مسبقاً (db.reserve_slot أو بوت نشط عند الاستعادة)، ويُحرر عند الفشل
+        if bot_id in self.processes:
+            return True
+        bp = BotProcess(bot_id, user_id, language, file_path, token)
+        loghub.open(bot_id, user_id)
+        bp.shared = (
+            self.runtime is not None and language == "python"
+            and await asyncio.to_thread(is_eligible, file_path)
+        )
+        try:
+            await self._spawn(bp)
+        except Exception as e:
+            logger.error("فشل تشغيل البوت %s: %s", bot_id, e)
+            loghub.feed(bot_id, 'sys', f"فشل التشغيل: {e}\n")
+            loghub.release(bot_id)
+            await self.db.release_slot(bot_id)
+            return False
+
+        self.processes[bot_id] = bp
+        bp.task = asyncio.create_task(self._watch(bp))
+        if bp.shared:
+            logger.info("تم تشغيل البوت %s في العامل المشترك %s", bot_id, bp.worker.index)
+        else:
+            logger.info("تم تشغيل البوت %s (pid=%s)", bot_id, bp.process.pid)
+        return True
+
+    async def _watch(self, bp):
+        try:
+            while True:
+                # انتظار العملية يضمن حصادها وعدم بقائها كعملية زومبي
+                returncode = await self._wait(bp)
+                self.reaped += 1
+                if bp.stopping:
+                    return
+
+                if time.monotonic() - bp.started_at >= self.stable_after:
+                    bp.restarts = 0
+                bp.restarts += 1
+                if bp.restarts > self.max_restarts:
+                    logger.warning("البوت %s توقف %s مرات متتالية، سيتم إيقافه", bp.bot_id, bp.restarts - 1)
+                    loghub.feed(bp.bot_id, 'sys', f"توقف {bp.restarts - 1} مرات متتالية، تم إيقاف البوت\n")
+                    break
+
+                delay = self._backoff(bp.restarts)
+                logger.warning("البوت %s توقف (code=%s)، إعادة التشغيل بعد %.1f ثانية", bp.bot_id, returncode, delay)
+                loghub.feed(bp.bot_id, 'sys', f"توقف البوت ({returncode})، إعادة التشغيل بعد {delay:.0f} ثانية\n")
+                await asyncio.sleep(delay)
+                if bp.stopping:
+                    return
+                try:
+                    await self._spawn(bp)
+                    self.total_restarts += 1
+                except Exception as e:
+                    logger.error("فشل إعادة تشغيل البوت %s: %s", bp.bot_id, e)
+                    break
+        except asyncio.CancelledError:
+            return
+
+        self.processes.pop(bp.bot_id, None)
+        loghub.release(bp.bot_id)
+        await self.db.release_slot(bp.bot_id)
+
+    async def _terminate(self, bp, timeout=5):
+        bp.stopping = True
+        if bp.shared:
+            await self.runtime.unload(bp)
+        elif bp.running:
+            try:
+                os.killpg(bp.process.pid, signal.SIGTERM)
+                await asyncio.wait_for(bp.process.wait(), timeout)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                try:
+                    os.killpg(bp.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await bp.process.wait()
+        if bp.task is not None:
+            # قد تكون مهمة المراقبة في فترة انتظار قبل إعادة التشغيل
+            bp.task.cancel()
+            await asyncio.gather(bp.task, return_exceptions=True)
+
+    async def stop(self, bot_id, release=True):
+        # release=False: المستدعي يحرر الأماكن بنفسه دفعة واحدة (مثل فحص الصحة)
+        bp = self.processes.pop(bot_id, None)
+        if bp is None:
+            return False
+        await self._terminate(bp)
+        loghub.release(bot_id)
+        if release:
+            await self.db.release_slot(bot_id)
+        return True
+
+    async def stop_all(self):
+        # عند إيقاف البوت الرئيسي نبقي is_active كما هي ليُعاد تشغيلها في المرة القادمة
+        processes = list(self.processes.values())
+        self.processes.clear()
+        await asyncio.gather(*(self._terminate(bp) for bp in processes))
+        if self.runtime is not None:
+            await self.runtime.close()
+
+    async def restore(self, owns=None):
+        for bot_id, user_id, language, file_path, token in await self.db.get_active_bots():
+            if owns is not None and not owns(user_id):
+                continue
+            if not file_path or not os.path.exists(file_path):
+                await self.db.release_slot(bot_id)
+                continue
+            await self.start(bot_id, user_id, language, file_path, token)
+
+    def _rss(self, pid):
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            return 0
+
+    def stats(self):
+        running = [bp for bp in self.processes.values() if bp.running]
+        startup_times = [bp.startup_time for bp in running if bp.startup_time is not None]
+        # ذاكرة كل بوت: RSS عمليته، أو حصته المقدرة من عامله المشترك
+        rss = {bp.bot_id: self._rss(bp.process.pid) for bp in running if not bp.shared}
+        if self.runtime is not None:
+            rss.update(self.runtime.memory())
+        stats = {
+            'hosting_mode': self.hosting_mode,
+            'supervised': len(self.processes),
+            'running': len(running),
+            'restarts': self.total_restarts,
+            'reaped': self.reaped,
+            'avg_startup_ms': 1000 * sum(startup_times) / len(startup_times) if startup_times else 0,
+            'rss_bytes': rss,
+            'total_rss_bytes': sum(rss.values()),
+            'avg_rss_bytes': sum(rss.values()) // len(rss) if rss else 0,
+        }
+        if self.runtime is not None:
+            stats.update({f'shared_{key}': value for key, value in self.runtime.stats().items()})
+        return stats
+
+
+# مشرف البوتات المستضافة
+supervisor = BotSupervisor(db)
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+from cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class ValidatorUnavailable(Exception):
+    # خطأ في أداة التحقق نفسها وليس في كود المستخدم
+    pass
+
+
+def _init_worker(memory_mb):
+    # عمليات التحقق لا تحتاج ذاكرة كبيرة؛ ملف خبيث لا يستنزف ذاكرة الخادم.
+    # الحد فوق ما تشغله العملية عند بدئها (الوحدات المستوردة)، فيبقى memory_mb كاملاً للترجمة
+    with open('/proc/self/statm') as f:
+        used = int(f.read().split()[0]) * resource.getpagesize()
+    limit = used + memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    os.nice(5)
+
+
+def _compile_python(path):
+    # تُنفذ داخل عملية من المجمع: ترجمة كاملة بدون تشغيل الكود
+    try:
+        with open(path, 'rb') as f:
+            source = f.read()
+        compile(source, os.path.basename(path), 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        return False, f"سطر {e.lineno}: {e.msg}"
+    except (ValueError, RecursionError) as e:
+        return False, f"{type(e).__name__}: {e}"
+    return True, None
+
+
+def file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(64 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class CodeValidator:
+    # تحقق من الكود قبل حفظه: ترجمة Python في مجمع عمليات، و php -l لملفات PHP
+    def __init__(self, workers=None, timeout=None, memory_mb=None):
+        self.workers = workers or int(os.getenv('VALIDATE_WORKERS', min(2, os.cpu_count() or 1)))
+        self.timeout = timeout or float(os.getenv('VALIDATE_TIMEOUT', 10))
+        self.memory_mb = memory_mb or int(os.getenv('VALIDATE_MEMORY_MB', 512))
+        self.php = shutil.which('php')
+        self._pool = None
+        # (اللغة، البصمة) -> (صالح، رسالة الخطأ)؛ الملف نفسه لا يُتحقق منه مرتين
+        self._results = TTLCache(maxsize=int(os.getenv('VALIDATE_CACHE_SIZE', 10000)), ttl=24 * 3600)
+        self._inflight = {}
+        self.checks = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def _executor(self):
+        if self._pool is None:
+            # forkserver وليس fork: العمليات لا ترث ذاكرة المدير، فحد RLIMIT_AS يخص التحقق وحده
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver'),
+                initializer=_init_worker, initargs=(self.memory_mb,)
+            )
+        return self._pool
+
+    def _reset_pool(self):
+        # لا يمكن إلغاء مهمة عالقة في المجمع، فنوقف عملياته ونبدأ مجمعاً جديداً عند الحاجة
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def validate(self, path, language, digest=None):
+        if digest is None:
+            digest = await asyncio.to_thread(file_digest, path)
+        key = (language, digest)
+        result = self._results.get(key)
+        if result is not None:
+            self.cache_hits += 1
+            return result
+        # نفس الملف المرفوع من عدة مستخدمين في الوقت نفسه يُتحقق منه مرة واحدة
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.cache_hits += 1
+            return await asyncio.shield(pending)
+        pending = self._inflight[key] = asyncio.ensure_future(self._check(path, language))
+        try:
+            result = await asyncio.shield(pending)
+        finally:
+            self._inflight.pop(key, None)
+        self._results.set(key, result)
+        return result
+
+    async def _check(self, path, language):
+        self.checks += 1
+        if language == 'php':
+            return await self._lint_php(path)
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor(), _compile_python, path), self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._reset_pool()
+            return False, "انتهت مهلة التحقق من الكود"
+        except (BrokenProcessPool, MemoryError) as e:
+            # انهيار عملية التحقق أو نفاد ذاكرتها لا يعني أن الكود خاطئ؛ لا تُحفظ النتيجة
+            self.failures += 1
+            self._reset_pool()
+            logger.error("تعذر التحقق من %s: %s", path, type(e).__name__)
+            raise ValidatorUnavailable(type(e).__name__) from e
+
+    async def _lint_php(self, path):
+        if self.php is None:
+            return True, None
+        process = await asyncio.create_subprocess_exec(
+            self.php, '-n', '-l', path,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            process.kill()
+            await process.wait()
+            return False, "انتهت مهلة التحقق من الكود"
+        if process.returncode == 0:
+            return True, None
+        # أول سطر من php -l يصف الخطأ مع رقم السطر
+        message = output.decode('utf-8', 'replace').strip().splitlines()
+        return False, (message[0] if message else "خطأ في صياغة PHP").replace(path, os.path.basename(path))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'checks': self.checks,
+            'cache_hits': self.cache_hits,
+            'cached': len(self._results),
+            'timeouts': self.timeouts,
+            'failures': self.failures,
+        }
+
+
+# التحقق من ملفات البوتات قبل حفظها وتشغيلها
+validator = CodeValidator()
@@ -0,0 +1,104 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+from telegram import Update
+from dotenv import load_dotenv
+
+from http_server import HTTPServer
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    # يستقبل تحديثات تيليجرام عبر HTTP ويضعها في طابور نفس التطبيق
+    def __init__(self, application, listen=None, port=None, url_path=None, secret_token=None):
+        self.application = application
+        self.url_path = url_path or os.getenv('WEBHOOK_PATH', '/webhook')
+        self.secret_token = secret_token or os.getenv('WEBHOOK_SECRET', '')
+        # بدون سر يقبل المنفذ المفتوح تحديثات مزورة من أي أحد: نولد سراً يُسجل مع set_webhook
+        self.generated_secret = not self.secret_token
+        if self.generated_secret:
+            self.secret_token = secrets.token_urlsafe(32)
+        self.server = HTTPServer(
+            self._handle,
+            listen or os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            int(port if port is not None else os.getenv('WEBHOOK_PORT', 8443)),
+        )
+        self.draining = False
+        self.received = 0
+        self.rejected = 0
+
+    @property
+    def port(self):
+        return self.server.port
+
+    async def _handle(self, method, path, headers, body):
+        if path.split('?', 1)[0] != self.url_path:
+            return 404, b'', 'text/plain'
+        if method != 'POST':
+            return 405, b'', 'text/plain'
+        token = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token, self.secret_token):
+            self.rejected += 1
+            return 403, b'', 'text/plain'
+        # أثناء الإيقاف نرفض التحديثات الجديدة فيعيد تيليجرام إرسالها لاحقاً
+        if self.draining:
+            return 503, b'', 'text/plain'
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, b'', 'text/plain'
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return 200, b'', 'text/plain'
+
+    async def start(self):
+        await self.server.start()
+        logger.info("خادم الويب هوك يعمل على المنفذ %s", self.port)
+
+    async def stop(self, timeout=None):
+        self.draining = True
+        await self.server.stop(timeout or float(os.getenv('DRAIN_TIMEOUT', 30)))
+
+
+async def run_webhook(application, webhook_url=None):
+    # نفس دورة حياة run_polling لكن مع خادم الويب هوك الخاص بنا
+    webhook_url = webhook_url or os.getenv('WEBHOOK_URL')
+    server = WebhookServer(application)
+    if server.generated_secret and not webhook_url:
+        # السر المولد لا يعرفه تيليجرام إلا إذا سجلنا الويب هوك بأنفسنا
+        raise RuntimeError("WEBHOOK_SECRET مطلوب عند تسجيل الويب هوك خارجياً (بدون WEBHOOK_URL)")
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url.rstrip('/') + server.url_path,
+                secret_token=server.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        await server.start()
+        await stop_event.wait()
+    finally:
+        # التفريغ: إيقاف الاستقبال أولاً، ثم application.stop يعالج ما بقي في الطابور
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)